@@ -0,0 +1,60 @@
+"""来水预报模型的基准用例"""
+import datetime as dt
+import os
+import shutil
+
+import synthetic
+from harness import case, get_client
+
+
+@case('model1.arima_path', 'years')
+def arima_path(years, workdir):
+    from model1.inflow_ARIMA import arima_path
+
+    path = os.path.join(workdir, f'monthly_{years}.csv')
+    synthetic.monthly_inflow(years).to_csv(path, index=False)
+    return lambda: arima_path(path, 12)
+
+
+@case('model1.sarima_path', 'years')
+def sarima_path(years, workdir):
+    from model1.inflow_SARIMA import sarima_path
+
+    path = os.path.join(workdir, f'monthly_{years}.csv')
+    synthetic.monthly_inflow(years).to_csv(path, index=False)
+    return lambda: sarima_path(path, 12)
+
+
+@case('model1.sarima_predict', 'years')
+def sarima_predict(years, workdir):
+    from model1.sarima_predict import sarima_predict
+
+    df = synthetic.daily_inflow(years)
+    data = {'inflow': list(df['inflow']), 'time': list(df['time'])}
+    predict_end_date = dt.datetime.now() + dt.timedelta(days=365)
+    return lambda: sarima_predict(data, predict_end_date)
+
+
+@case('model1.sum_monthly_series', 'years')
+def sum_monthly_series(years, workdir):
+    from model1.utils.construct_data_from_history import sum_monthly_series
+
+    source = os.path.join(workdir, f'daily_{years}.csv')
+    target = os.path.join(workdir, f'daily_{years}_monthly.csv')
+    synthetic.daily_inflow(years).to_csv(source, index=False)
+
+    def run():
+        shutil.copyfile(source, target)  # 原地改写为逐月数据，每次从逐日数据重新开始
+        sum_monthly_series(target)
+    return run
+
+
+@case('api.model1.mid_long_inflow_predict', 'years')
+def mid_long_inflow_predict(years, workdir):
+    client = get_client()
+    content = synthetic.daily_inflow(years).to_csv(index=False).encode()
+
+    def run():
+        response = client.post('/model1/mid_long_inflow_predict', files={'upload_file': ('inflow.csv', content)})
+        response.raise_for_status()
+    return run
@@ -0,0 +1,31 @@
+"""需水预测模型的基准用例"""
+import datetime as dt
+
+import synthetic
+from harness import case
+
+
+@case('model2.PM_ET0', 'years')
+def pm_et0(years, workdir):
+    from model2.main import PM_ET0
+
+    weather = synthetic.weather_forecast(30)['daily']
+    days = [dt.datetime(2025, 1, 1) + dt.timedelta(days=i) for i in range(int(years * 365))]
+    inputs = [(int(w['tempMax']), int(w['tempMin']), float(w['pressure']) * 0.1, float(w['windSpeedDay']))
+              for w in weather]
+
+    def run():
+        for i, day in enumerate(days):
+            PM_ET0(*inputs[i % len(inputs)], day)
+    return run
+
+
+@case('model2.predict_e')
+def predict_e(value, workdir):
+    from model2.main import predict_e
+
+    datalist = synthetic.weather_forecast(30)['daily']
+    today = dt.datetime.combine(dt.date.today(), dt.time())
+    plant_d = today - dt.timedelta(days=60)
+    end_d = today + dt.timedelta(days=29)
+    return lambda: predict_e('wheat', plant_d, today, end_d, datalist)
@@ -0,0 +1,106 @@
+"""水资源配置模型的基准用例"""
+import json
+
+import synthetic
+from harness import Skip, case, get_client
+from utils.config import load_config
+
+
+@case('model3.calculate_10days_allocation', 'areas')
+def calculate_10days_allocation(n_areas, workdir):
+    from model3.implement import calculate_10days_allocation
+
+    water_demand_data, inflow_data, area_info = synthetic.irrigation_areas(n_areas)
+    return lambda: calculate_10days_allocation(water_demand_data, inflow_data, area_info)
+
+
+@case('model3.sum_data_to_10days')
+def sum_data_to_10days(value, workdir):
+    from model3.implement import sum_data_to_10days
+
+    records = synthetic.daily_records('precip')
+    return lambda: sum_data_to_10days(records, 'precip')
+
+
+@case('model3.build_requirement_matrix', 'areas')
+def build_requirement_matrix(n_areas, workdir):
+    from model3.rolling_plan import build_requirement_matrix
+
+    data = synthetic.irrigation_areas(n_areas)
+    return lambda: build_requirement_matrix(*data)
+
+
+@case('model3.rolling_plan_lp', 'areas')
+def rolling_plan_lp(n_areas, workdir):
+    from model3.rolling_plan import RollingHorizonPlanner, build_requirement_matrix
+
+    matrix = build_requirement_matrix(*synthetic.irrigation_areas(n_areas))
+
+    def run():
+        planner = RollingHorizonPlanner(*matrix)
+        planner.solve()
+    return run
+
+
+@case('model3.allocation_scenarios', 'areas')
+def allocation_scenarios(n_areas, workdir):
+    from model3.scenario import run_scenarios
+
+    from model3.rolling_plan import align_supply, build_requirement_matrix
+
+    water_demand_data, inflow_data, area_info = synthetic.irrigation_areas(n_areas)
+    scenarios = [{'name': '偏枯', 'inflow_scale': 0.8}, {'name': '正常'}, {'name': '偏丰', 'inflow_scale': 1.2}]
+    _, dekads, demand, precip, area = build_requirement_matrix(water_demand_data, inflow_data, area_info)
+    full_supply = align_supply(None, dekads, demand, precip, area)
+    supply = [{'date': d, 'supply': float(v) * 0.8} for d, v in zip(dekads, full_supply)]  # 供水不足，走逐情景LP
+    return lambda: run_scenarios(water_demand_data, inflow_data, area_info, scenarios, supply)
+
+
+@case('api.model3.get_allocation_for_each_area')
+def get_allocation_for_each_area(value, workdir):
+    client = get_client()
+    with open(load_config('model3')['area-info-file'], 'r', encoding='utf-8') as f:
+        body = synthetic.allocation_request(list(json.load(f)))
+
+    def run():
+        client.post('/model3/get_allocation_for_each_area', json=body).raise_for_status()
+    return run
+
+
+def _allocation_model():
+    try:
+        from model3 import allocation_model
+    except ImportError as e:  # 依赖 model3.model_base 与 pymoo
+        raise Skip(f"无法导入 model3.allocation_model：{e}")
+    return allocation_model
+
+
+@case('model3.canal_tree_distribution', 'nodes')
+def canal_tree_distribution(n_nodes, workdir):
+    allocation_model = _allocation_model()
+    tree, demand, roots = synthetic.canal_tree(n_nodes)
+    model = allocation_model.WaterResourceNSGAIII.__new__(allocation_model.WaterResourceNSGAIII)
+    model.tree_structure = tree
+    model.water_sources = []
+    parent_allocation = {root: sum(demand.values()) / len(roots) * 0.8 for root in roots}
+    return lambda: model.distribute_water_to_children(parent_allocation, demand)
+
+
+@case('model3.nsga3_yearly', 'nodes')
+def nsga3_yearly(n_nodes, workdir):
+    allocation_model = _allocation_model()
+    import pandas as pd
+    from pymoo.algorithms.moo.nsga3 import NSGA3
+    from pymoo.factory import get_reference_directions
+    from pymoo.optimize import minimize
+
+    tree, demand, roots = synthetic.canal_tree(n_nodes)
+    sources = [f's{i}' for i in range(len(roots))]
+    yearly_demand = pd.Series({root: demand[root] * 50 for root in roots})
+    problem = allocation_model.WaterResourceNSGAIII.WaterAllocationProblem(
+        sources, list(tree['ID']), {s: float(yearly_demand.iloc[i]) for i, s in enumerate(sources)}, yearly_demand,
+        {s: 1.0 for s in sources}, {}, {s: 1 for s in sources}, dict(zip(sources, roots)), roots)
+    algorithm = NSGA3(pop_size=100, ref_dirs=get_reference_directions("das-dennis", 2, n_partitions=12),
+                      n_offsprings=50, eliminate_duplicates=True)
+    return lambda: minimize(problem, algorithm, termination=('n_gen', 50), seed=1, verbose=False)
+
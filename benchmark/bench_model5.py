@@ -0,0 +1,71 @@
+"""土壤含水量遥感反演的基准用例"""
+import os
+
+import synthetic
+from harness import case, get_client
+
+
+def _rasters(workdir, megapixels):
+    paths = (f'{workdir}/SYN{megapixels}_R.TIF', f'{workdir}/SYN{megapixels}_NIR.TIF')
+    if not all(os.path.exists(p) for p in paths):
+        paths = synthetic.write_band_rasters(workdir, megapixels)
+    return paths
+
+
+@case('model5.nir_red_to_smi_tiled', 'megapixels')
+def nir_red_to_smi_tiled(megapixels, workdir):
+    from model5.algorithm import nir_red_to_smi_tiled
+
+    red, nir = _rasters(workdir, megapixels)
+    output = f'{workdir}/SYN{megapixels}_SMI.tif'
+    return lambda: nir_red_to_smi_tiled(red, nir, output)
+
+
+@case('model5.generate_geoJSON', 'megapixels')
+def generate_geojson(megapixels, workdir):
+    from model5.algorithm import nir_red_to_smi_tiled
+    from model5.togeoJSON import generate_geoJSON
+
+    red, nir = _rasters(workdir, megapixels)
+    smi_tif = f'{workdir}/SYN{megapixels}_SMI_vector.tif'
+    nir_red_to_smi_tiled(red, nir, smi_tif)
+    output = f'{workdir}/SYN{megapixels}.geojson'
+
+    def cleanup():
+        if os.path.exists(output):
+            os.remove(output)
+    return lambda: generate_geoJSON(smi_tif, output), cleanup
+
+
+@case('api.model5.get_smi.cold', 'megapixels')
+def get_smi_cold(megapixels, workdir):
+    from model5.result_cache import get_result_cache
+
+    client = get_client()
+    red, nir = _rasters(workdir, megapixels)
+    cache = get_result_cache()
+    existing = cache.keys()
+
+    def run():
+        response = client.get('/model5/get_smi', params={'red_tif_dir': red, 'nir_tif_dir': nir})
+        response.raise_for_status()
+        assert response.headers['X-Cache'] == 'MISS'
+
+    def evict_new_entries():  # 删除本次生成的缓存条目，下一次仍是完整计算
+        for key in cache.keys() - existing:
+            cache.remove(key)
+    return run, evict_new_entries
+
+
+@case('api.model5.get_smi.cached', 'megapixels')
+def get_smi_cached(megapixels, workdir):
+    client = get_client()
+    red, nir = _rasters(workdir, megapixels)
+    params = {'red_tif_dir': red, 'nir_tif_dir': nir}
+    client.get('/model5/get_smi', params=params).raise_for_status()
+
+    def run():
+        response = client.get('/model5/get_smi', params=params)
+        response.raise_for_status()
+        assert response.headers['X-Cache'] == 'HIT'
+    return run
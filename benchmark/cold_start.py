@@ -0,0 +1,73 @@
+"""
+服务冷启动导入耗时检查
+
+在子进程中执行 python -X importtime -c "import main"，统计导入 main 的累计耗时，
+超过预算（配置 startup.import-budget-ms）或启动时导入了重量级模块时以非零状态退出，
+可放在CI中防止模型依赖重新回到启动路径上。
+
+用法（在项目根目录执行）：
+    python benchmark/cold_start.py
+    python benchmark/cold_start.py --budget-ms 1000 --top 20
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.config import load_config  # noqa: E402
+
+HEAVY_MODULES = ('statsmodels', 'geopandas', 'osgeo', 'rasterio', 'matplotlib', 'seaborn', 'pulp', 'pymoo',
+                 'scipy', 'pandas', 'shapely', 'pyogrio')  # 只应在接口首次调用时导入的模块
+
+
+def import_times(module='main'):
+    """
+    :return: [(模块名, 自身耗时毫秒, 累计耗时毫秒)]，按导入顺序
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"导入{module}失败：\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        rows.append((name.strip(), int(self_us) / 1000, int(cumulative_us) / 1000))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--module', default='main')
+    parser.add_argument('--budget-ms', type=float, default=None, help='默认取配置 startup.import-budget-ms')
+    parser.add_argument('--top', type=int, default=15, help='列出累计耗时最长的顶层模块数')
+    args = parser.parse_args()
+    budget = args.budget_ms or float(load_config('startup').get('import-budget-ms', 1500))
+
+    rows = import_times(args.module)
+    total = next(cumulative for name, _, cumulative in rows if name == args.module)
+    top_level = {}
+    for name, _, cumulative in rows:
+        root = name.split('.')[0]
+        if name == root:
+            top_level[root] = max(top_level.get(root, 0), cumulative)
+    print(f"导入 {args.module} 累计 {total:.0f} ms（预算 {budget:.0f} ms）")
+    for name, cumulative in sorted(top_level.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {cumulative:8.1f} ms  {name}")
+
+    failed = False
+    heavy = sorted({name.split('.')[0] for name, _, _ in rows} & set(HEAVY_MODULES))
+    if heavy:
+        print(f"启动时导入了重量级模块：{heavy}")
+        failed = True
+    if total > budget:
+        print(f"超出导入预算 {total - budget:.0f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+和风天气 30 天预报接口的本地模拟服务，供压测使用
+
+回放录制的 /v7/weather/30d 响应JSON（多个文件时轮流返回），未指定时返回 synthetic.weather_forecast 生成的预报。
+回放时默认把逐日预报的日期平移到从今天开始，需水预测等按日期匹配预报的接口才能得到正常结果。
+可配置响应延迟与错误率，模拟真实接口的网络耗时和偶发故障。
+
+用法（在项目根目录执行）：
+    python benchmark/fake_weather.py --record benchmark/weather_30d.json   # 从真实接口录制一次响应
+    python benchmark/fake_weather.py --port 8090 --replay benchmark/weather_30d.json --latency-ms 150 --error-rate 0.02
+然后把配置 hefeng.api-url 改为 http://127.0.0.1:8090 并启动服务。
+"""
+import argparse
+import datetime as dt
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+API_NAME = '/v7/weather/30d'
+
+
+def shift_dates(response, start=None):
+    """
+    把逐日预报的日期平移为从 start（默认今天）开始的连续日期
+    :return: 新的响应dict
+    """
+    start = start or dt.date.today()
+    daily = [dict(day, fxDate=(start + dt.timedelta(days=i)).strftime('%Y-%m-%d'))
+             for i, day in enumerate(response['daily'])]
+    return dict(response, daily=daily)
+
+
+class WeatherHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        if not self.path.startswith(API_NAME):
+            self.send_error(404)
+            return
+        delay = max(0.0, random.gauss(server.latency_ms, server.jitter_ms)) / 1000
+        time.sleep(delay)
+        if random.random() < server.error_rate:
+            self.send_error(server.error_status)
+            return
+        with server.lock:
+            response = next(server.responses)
+        if server.shift_dates:
+            response = shift_dates(response)
+        body = json.dumps(response, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # 压测时不逐条打印请求
+        pass
+
+
+def make_server(host='127.0.0.1', port=8090, responses=None, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0,
+                error_status=503, shift=True):
+    """
+    :param responses: 回放的响应dict列表，None 表示使用合成预报
+    :param latency_ms: 平均响应延迟（毫秒）
+    :param jitter_ms: 延迟的标准差（毫秒）
+    :param error_rate: 返回错误状态码的比例 0~1
+    :param error_status: 错误时返回的HTTP状态码
+    :param shift: 是否把预报日期平移到从今天开始
+    :return: ThreadingHTTPServer，调用 serve_forever() 运行
+    """
+    if not responses:
+        import synthetic
+        responses = [synthetic.weather_forecast(30)]
+    server = ThreadingHTTPServer((host, port), WeatherHandler)
+    server.daemon_threads = True
+    server.responses = itertools.cycle(responses)
+    server.lock = threading.Lock()
+    server.latency_ms = latency_ms
+    server.jitter_ms = jitter_ms
+    server.error_rate = error_rate
+    server.error_status = error_status
+    server.shift_dates = shift
+    return server
+
+
+def serve_in_thread(server):
+    """在后台线程中运行，返回线程；停止时调用 server.shutdown()"""
+    thread = threading.Thread(target=server.serve_forever, name='fake-weather', daemon=True)
+    thread.start()
+    return thread
+
+
+def load_responses(paths):
+    responses = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            responses.append(json.load(f))
+    return responses
+
+
+def record(path):
+    """按当前配置请求一次真实接口，保存响应JSON"""
+    from utils.hefeng_weather_predict import request_weather
+
+    response = request_weather()
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(response, f, ensure_ascii=False, indent=2)
+    print(f"已录制 {len(response.get('daily', []))} 天预报：{path}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--replay', nargs='*', default=[], help='录制的响应JSON文件，多个时轮流返回')
+    parser.add_argument('--record', default=None, help='从真实接口录制一次响应到该文件后退出')
+    parser.add_argument('--latency-ms', type=float, default=100.0)
+    parser.add_argument('--jitter-ms', type=float, default=20.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--no-shift-dates', action='store_true', help='按录制时的日期原样返回')
+    args = parser.parse_args()
+
+    if args.record:
+        os.chdir(os.path.dirname(BENCHMARK_DIR))
+        record(args.record)
+        return
+    server = make_server(args.host, args.port, load_responses(args.replay), args.latency_ms, args.jitter_ms,
+                         args.error_rate, args.error_status, not args.no_shift_dates)
+    print(f"模拟天气接口：http://{args.host}:{args.port}{API_NAME}（延迟 {args.latency_ms:.0f}±{args.jitter_ms:.0f} ms，"
+          f"错误率 {args.error_rate:.1%}）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
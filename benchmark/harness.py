@@ -0,0 +1,157 @@
+"""
+基准测试框架：用例注册、计时、结果保存与对比
+
+用例函数只做准备工作（生成合成数据、导入模块），返回被计时的无参函数；
+也可以返回 (被计时函数, 每次计时后执行的清理函数)，清理不计入耗时。
+用例准备时抛出 Skip 表示当前环境无法运行（如缺少可选依赖），结果中记录原因。
+"""
+import datetime as dt
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+
+SCALES = {  # 参数名 → 各档规模的取值
+    'years': {'small': (5,), 'medium': (5, 20), 'large': (5, 20, 50)},  # 逐日序列年数
+    'areas': {'small': (10,), 'medium': (10, 100), 'large': (10, 100, 1000)},  # 灌片数
+    'nodes': {'small': (50,), 'medium': (50, 500), 'large': (50, 500, 5000)},  # 渠系树节点数
+    'megapixels': {'small': (1,), 'medium': (1, 10), 'large': (1, 10, 100)},  # 影像像元数（百万）
+}
+CASES = []
+
+
+class Skip(Exception):
+    """当前环境无法运行该用例"""
+
+
+def case(name, param=None):
+    """
+    注册用例
+    :param name: 用例名，如 'model1.arima_path'
+    :param param: 规模参数名（SCALES 的键），None 表示与规模无关，只运行一次
+    """
+    def register(func):
+        CASES.append((name, param, func))
+        return func
+    return register
+
+
+def iter_cases(scale, keyword=None):
+    """
+    :return: [(结果名, 用例函数, 规模参数值或 None)]，结果名如 'model1.arima_path[years=20]'
+    """
+    for name, param, func in CASES:
+        values = SCALES[param][scale] if param else (None,)
+        for value in values:
+            full_name = f"{name}[{param}={value}]" if param else name
+            if keyword is None or keyword in full_name:
+                yield full_name, func, value
+
+
+def measure(func, after_each=None, repeat=5, max_seconds=30.0):
+    """
+    先预热一次，再重复计时；预热已超过 max_seconds 的用例直接以预热耗时作为唯一样本
+    :return: 各次耗时（秒）列表
+    """
+    start = time.perf_counter()
+    func()
+    first = time.perf_counter() - start
+    if after_each is not None:
+        after_each()
+    if first >= max_seconds:
+        return [first]
+    samples = []
+    budget_end = time.perf_counter() + max_seconds
+    while len(samples) < repeat and (not samples or time.perf_counter() < budget_end):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+        if after_each is not None:
+            after_each()
+    return samples
+
+
+def summarize(samples):
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "runs": len(samples),
+    }
+
+
+def environment():
+    """运行环境信息，随结果一起保存"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    versions = {}
+    for module in ('numpy', 'pandas', 'statsmodels', 'pulp', 'rasterio', 'fastapi'):
+        try:
+            versions[module] = __import__(module).__version__
+        except ImportError:
+            versions[module] = None
+    return {
+        "time": dt.datetime.now().isoformat(timespec='seconds'),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "versions": versions,
+    }
+
+
+def save_results(path, results):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+def compare(baseline, current, threshold=1.2):
+    """
+    与基线对比中位数耗时
+    :param threshold: 耗时超过基线的该倍数视为回退
+    :return: (对比行列表 [(结果名, 基线秒, 当前秒, 倍数)], 回退的结果名列表)
+    """
+    rows, regressions = [], []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        ratio = result["median"] / base["median"] if base["median"] > 0 else float('inf')
+        rows.append((name, base["median"], result["median"], ratio))
+        if ratio > threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+_client = None
+
+
+def get_client():
+    """
+    进程内的 TestClient（含服务的启动和关闭流程），等待后台预热完成后再返回，避免预热与计时争用CPU
+    """
+    global _client
+    if _client is None:
+        from fastapi.testclient import TestClient
+        from main import app
+        from utils.warmup import get_warm_up_status
+
+        _client = TestClient(app)
+        _client.__enter__()
+        while get_warm_up_status()["state"] == "running":
+            time.sleep(0.1)
+    return _client
+
+
+def close_client():
+    global _client
+    if _client is not None:
+        _client.__exit__(None, None, None)
+        _client = None
@@ -0,0 +1,214 @@
+"""
+多接口混合压测
+
+按权重混合请求 /model1/inflow_predict、/model2/water_predict、/model3/get_allocation_for_each_area、
+/model5/get_smi，并发数逐级递增（闭环：每个并发连接收到响应后立即发起下一个请求），
+每一级输出各接口的吞吐量与延迟百分位。请求数据由 benchmark/synthetic.py 生成，写入本机临时目录，
+inflow_predict / get_smi 按文件路径读取，因此服务需运行在本机。
+
+天气接口请使用本地模拟服务（benchmark/fake_weather.py），避免压测真实接口：
+把配置 hefeng.api-url 改为 http://127.0.0.1:8090 后启动服务，再执行
+    python benchmark/load_test.py --start-fake-weather --weather-latency-ms 150 --weather-error-rate 0.02
+    python benchmark/load_test.py --concurrency 1 4 16 --stage-seconds 60 --mix inflow=1 water=4 allocation=2 smi=3
+"""
+import argparse
+import datetime as dt
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+import numpy as np
+import requests
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+os.chdir(ROOT_DIR)
+
+import synthetic  # noqa: E402
+from utils.config import load_config  # noqa: E402
+
+DEFAULT_MIX = ('inflow=2', 'water=3', 'allocation=2', 'smi=3')
+PERCENTILES = (50, 90, 99)
+
+
+def build_requests(workdir, smi_scenes=2, smi_megapixels=1):
+    """
+    各接口的请求参数，get_smi 在若干景之间轮换（首次计算后命中结果缓存，与线上重复请求同一景的情况一致）
+    :return: {接口简称: [(方法, 路径, requests关键字参数)]}
+    """
+    today = dt.date.today()
+    inflow_file = os.path.join(workdir, 'monthly_inflow.csv')
+    # inflow_predict 从当月开始预测，历史数据需截止到上个月
+    synthetic.monthly_inflow(20, end=today.replace(day=1) - dt.timedelta(days=1)).to_csv(inflow_file, index=False)
+    water_params = {'plant_day': (today - dt.timedelta(days=60)).isoformat(), 'begin_day': today.isoformat(),
+                    'end_day': (today + dt.timedelta(days=20)).isoformat(), 'kind': 'wheat'}
+    with open(load_config('model3')['area-info-file'], 'r', encoding='utf-8') as f:
+        allocation_body = synthetic.allocation_request(list(json.load(f)))
+    smi = []
+    for i in range(smi_scenes):
+        red, nir = synthetic.write_band_rasters(workdir, smi_megapixels, name=f'LOAD{i}_')
+        smi.append(('GET', '/model5/get_smi', {'params': {'red_tif_dir': red, 'nir_tif_dir': nir}}))
+    return {
+        'inflow': [('GET', '/model1/inflow_predict', {'params': {'file_path': inflow_file}})],
+        'water': [('GET', '/model2/water_predict', {'params': water_params})],
+        'allocation': [('POST', '/model3/get_allocation_for_each_area', {'json': allocation_body})],
+        'smi': smi,
+    }
+
+
+def parse_mix(items, available):
+    """
+    :param items: ['inflow=2', 'water=3', ...]
+    :return: (接口简称列表, 权重列表)
+    """
+    names, weights = [], []
+    for item in items:
+        name, _, weight = item.partition('=')
+        if name not in available:
+            raise SystemExit(f"未知接口 {name}，可选：{list(available)}")
+        names.append(name)
+        weights.append(float(weight or 1))
+    return names, weights
+
+
+def worker(base_url, requests_by_name, names, weights, end_time, samples, seed):
+    """闭环发送请求直到 end_time，samples 追加 (接口简称, 延迟秒, 是否成功)"""
+    rng = random.Random(seed)
+    session = requests.Session()
+    counters = dict.fromkeys(names, 0)
+    while time.perf_counter() < end_time:
+        name = rng.choices(names, weights)[0]
+        method, path, kwargs = requests_by_name[name][counters[name] % len(requests_by_name[name])]
+        counters[name] += 1
+        start = time.perf_counter()
+        try:
+            ok = session.request(method, base_url + path, timeout=600, **kwargs).status_code < 400
+        except requests.RequestException:
+            ok = False
+        samples.append((name, time.perf_counter() - start, ok))
+
+
+def run_stage(base_url, requests_by_name, names, weights, concurrency, seconds):
+    samples = []
+    end_time = time.perf_counter() + seconds
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(base_url, requests_by_name, names, weights, end_time, samples, i))
+               for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return samples, time.perf_counter() - start  # 最后一批请求可能在 end_time 之后才返回
+
+
+def summarize_stage(samples, elapsed):
+    """
+    :return: {接口简称或 'all': {count, errors, rps, p50_ms, p90_ms, p99_ms, max_ms}}
+    """
+    groups = {}
+    for name, latency, ok in samples:
+        groups.setdefault(name, []).append((latency, ok))
+    groups['all'] = [(latency, ok) for _, latency, ok in samples]
+    summary = {}
+    for name, items in groups.items():
+        if not items:
+            continue
+        latencies = np.array([latency for latency, _ in items]) * 1000
+        summary[name] = {
+            'count': len(items),
+            'errors': sum(not ok for _, ok in items),
+            'rps': len(items) / elapsed,
+            **{f'p{p}_ms': float(np.percentile(latencies, p)) for p in PERCENTILES},
+            'max_ms': float(latencies.max()),
+        }
+    return summary
+
+
+def print_stage(concurrency, summary):
+    print(f"\n并发 {concurrency}")
+    print(f"  {'接口':<12}{'请求数':>8}{'错误':>6}{'吞吐 req/s':>12}"
+          + ''.join(f"{f'p{p} ms':>11}" for p in PERCENTILES) + f"{'max ms':>11}")
+    for name, s in summary.items():
+        print(f"  {name:<12}{s['count']:>8}{s['errors']:>6}{s['rps']:>12.2f}"
+              + ''.join(f"{s[f'p{p}_ms']:>11.1f}" for p in PERCENTILES) + f"{s['max_ms']:>11.1f}")
+
+
+def wait_for_service(base_url, timeout=120):
+    """等待服务可访问且后台预热结束"""
+    end = time.perf_counter() + timeout
+    while time.perf_counter() < end:
+        try:
+            if requests.get(base_url + '/utils/warm_up_status', timeout=5).json().get('state') != 'running':
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"服务 {base_url} 未就绪")
+
+
+def start_fake_weather(args):
+    """按配置 hefeng.api-url 的端口在本进程内启动模拟天气接口"""
+    import fake_weather
+
+    url = urlparse(load_config('hefeng').get('api-url', ''))
+    if url.hostname not in ('127.0.0.1', 'localhost') or url.scheme != 'http':
+        raise SystemExit(f"配置 hefeng.api-url 未指向本机（{url.geturl()}），服务仍会请求真实天气接口")
+    server = fake_weather.make_server(url.hostname, url.port or 80, fake_weather.load_responses(args.weather_replay),
+                                      args.weather_latency_ms, args.weather_jitter_ms, args.weather_error_rate)
+    fake_weather.serve_in_thread(server)
+    print(f"模拟天气接口已启动：{url.geturl()}")
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--base-url', default='http://127.0.0.1:8081')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--stage-seconds', type=float, default=30)
+    parser.add_argument('--mix', nargs='+', default=list(DEFAULT_MIX), help='接口简称=权重')
+    parser.add_argument('--smi-scenes', type=int, default=2)
+    parser.add_argument('--smi-megapixels', type=float, default=1)
+    parser.add_argument('--save', default=None, help='结果保存为JSON')
+    parser.add_argument('--start-fake-weather', action='store_true', help='在本进程内启动模拟天气接口')
+    parser.add_argument('--weather-replay', nargs='*', default=[], help='模拟天气接口回放的响应JSON')
+    parser.add_argument('--weather-latency-ms', type=float, default=100.0)
+    parser.add_argument('--weather-jitter-ms', type=float, default=20.0)
+    parser.add_argument('--weather-error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    fake_server = start_fake_weather(args) if args.start_fake_weather else None
+    results = []
+    try:
+        wait_for_service(args.base_url)
+        with tempfile.TemporaryDirectory(prefix='load-') as workdir:
+            requests_by_name = build_requests(workdir, args.smi_scenes, args.smi_megapixels)
+            names, weights = parse_mix(args.mix, requests_by_name)
+            # 预热：每个请求先发一次，排除首次导入模型与首次计算的耗时
+            for name in names:
+                for method, path, kwargs in requests_by_name[name]:
+                    status = requests.request(method, args.base_url + path, timeout=600, **kwargs).status_code
+                    print(f"预热 {name} {path}: {status}")
+            for concurrency in args.concurrency:
+                samples, elapsed = run_stage(args.base_url, requests_by_name, names, weights, concurrency,
+                                             args.stage_seconds)
+                summary = summarize_stage(samples, elapsed)
+                print_stage(concurrency, summary)
+                results.append({'concurrency': concurrency, 'seconds': elapsed, 'endpoints': summary})
+    finally:
+        if fake_server is not None:
+            fake_server.shutdown()
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'mix': dict(zip(names, weights)), 'stages': results}, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存：{args.save}")
+
+
+if __name__ == '__main__':
+    main()
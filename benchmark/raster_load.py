@@ -0,0 +1,70 @@
+"""
+栅格计算期间廉价接口的延迟测试
+
+先单独压测一个廉价接口得到基线延迟，再在 /model5/get_smi 运行期间重复压测，
+对比两次的 p50/p99。阻塞操作已卸载出事件循环时，两次的 p99 应基本持平。
+
+用法（需先启动服务）：
+    python benchmark/raster_load.py --red model5/smi_tifs/xxx_R.TIF --nir model5/smi_tifs/xxx_NIR.TIF
+"""
+import argparse
+import threading
+import time
+
+import numpy as np
+import requests
+
+
+def hammer(url, duration, latencies, stop_event=None):
+    """顺序请求廉价接口，记录每次请求的延迟（毫秒）"""
+    session = requests.Session()
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end and not (stop_event is not None and stop_event.is_set()):
+        start = time.perf_counter()
+        session.get(url)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+
+def summary(name, latencies):
+    latencies = np.array(latencies)
+    print(f"{name}: 请求数 {len(latencies)}, p50 {np.percentile(latencies, 50):.1f} ms, "
+          f"p99 {np.percentile(latencies, 99):.1f} ms, max {latencies.max():.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--base-url', default='http://127.0.0.1:8081')
+    parser.add_argument('--cheap-path', default='/')
+    parser.add_argument('--red', required=True, help='红波tif路径（服务器上）')
+    parser.add_argument('--nir', required=True, help='近红外tif路径（服务器上）')
+    parser.add_argument('--raster-jobs', type=int, default=2, help='同时发起的栅格请求数')
+    parser.add_argument('--duration', type=float, default=10, help='基线压测时长（秒）')
+    args = parser.parse_args()
+
+    cheap_url = args.base_url + args.cheap_path
+    baseline = []
+    hammer(cheap_url, args.duration, baseline)
+    summary("基线", baseline)
+
+    def raster_request():
+        requests.get(args.base_url + '/model5/get_smi',
+                     params={'red_tif_dir': args.red, 'nir_tif_dir': args.nir})
+
+    raster_threads = [threading.Thread(target=raster_request) for _ in range(args.raster_jobs)]
+    for t in raster_threads:
+        t.start()
+    stop_event = threading.Event()
+    during = []
+    cheap_thread = threading.Thread(target=hammer, args=(cheap_url, 3600, during, stop_event))
+    cheap_thread.start()
+    start = time.perf_counter()
+    for t in raster_threads:
+        t.join()
+    stop_event.set()
+    cheap_thread.join()
+    print(f"栅格请求耗时 {time.perf_counter() - start:.1f} s")
+    summary("栅格计算期间", during)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+全部模型函数与接口的基准测试
+
+数据全部由 benchmark/synthetic.py 按固定随机种子生成，规模分 small / medium / large 三档（见 harness.SCALES），
+结果连同运行环境保存为JSON，可与之前保存的基线对比，中位数耗时超过基线 --threshold 倍时以非零状态退出。
+依赖外部天气接口的接口不在此测试范围内（见压测脚本）；缺少可选依赖的用例记为跳过。
+
+用法（在项目根目录执行）：
+    python benchmark/suite.py
+    python benchmark/suite.py --scale medium -k model3
+    python benchmark/suite.py --save benchmark/results/baseline.json
+    python benchmark/suite.py --compare benchmark/results/baseline.json --threshold 1.3
+"""
+import argparse
+import datetime as dt
+import json
+import os
+import sys
+import tempfile
+import traceback
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+os.chdir(ROOT_DIR)  # 配置文件与数据文件均使用相对项目根目录的路径
+
+import harness  # noqa: E402
+import bench_model1  # noqa: E402,F401
+import bench_model2  # noqa: E402,F401
+import bench_model3  # noqa: E402,F401
+import bench_model5  # noqa: E402,F401
+
+
+def run_case(func, value, workdir, repeat, max_seconds):
+    prepared = func(value, workdir)
+    timed, after_each = prepared if isinstance(prepared, tuple) else (prepared, None)
+    return harness.summarize(harness.measure(timed, after_each, repeat, max_seconds))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', choices=('small', 'medium', 'large'), default='small')
+    parser.add_argument('-k', '--keyword', default=None, help='只运行名称包含该关键字的用例')
+    parser.add_argument('--repeat', type=int, default=5, help='每个用例预热后的计时次数')
+    parser.add_argument('--max-seconds', type=float, default=30.0, help='单个用例的计时时间上限')
+    parser.add_argument('--save', default=None, help='结果保存路径，默认 benchmark/results/<时间>.json')
+    parser.add_argument('--compare', default=None, help='基线结果JSON路径')
+    parser.add_argument('--threshold', type=float, default=1.2, help='中位数耗时超过基线该倍数视为回退')
+    args = parser.parse_args()
+
+    results, skipped, errors = {}, {}, {}
+    try:
+        with tempfile.TemporaryDirectory(prefix='bench-') as workdir:
+            for name, func, value in harness.iter_cases(args.scale, args.keyword):
+                try:
+                    results[name] = run_case(func, value, workdir, args.repeat, args.max_seconds)
+                except harness.Skip as e:
+                    skipped[name] = str(e)
+                    print(f"{name:<55} 跳过：{e}")
+                    continue
+                except Exception as e:
+                    errors[name] = f"{type(e).__name__}: {e}"
+                    print(f"{name:<55} 失败：{errors[name]}")
+                    traceback.print_exc()
+                    continue
+                r = results[name]
+                print(f"{name:<55} 中位数 {r['median'] * 1000:10.1f} ms  最小 {r['min'] * 1000:10.1f} ms"
+                      f"  ±{r['stdev'] * 1000:.1f} ms  ({r['runs']}次)")
+    finally:
+        harness.close_client()
+
+    current = {"scale": args.scale, "environment": harness.environment(), "results": results,
+               "skipped": skipped, "errors": errors}
+    save_path = args.save or os.path.join(BENCHMARK_DIR, 'results', f"{dt.datetime.now():%Y%m%d-%H%M%S}.json")
+    harness.save_results(save_path, current)
+    print(f"结果已保存：{save_path}")
+
+    failed = bool(errors)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        rows, regressions = harness.compare(baseline, current, args.threshold)
+        print(f"\n与基线对比（{baseline['environment'].get('commit')} → {current['environment'].get('commit')}）：")
+        for name, base, now, ratio in rows:
+            mark = '  回退' if name in regressions else ''
+            print(f"{name:<55} {base * 1000:10.1f} ms → {now * 1000:10.1f} ms  x{ratio:.2f}{mark}")
+        failed = failed or bool(regressions)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+基准测试与压测用的合成数据
+
+所有生成函数使用固定随机种子，同一规模每次生成的数据相同，不同机器、不同版本之间的结果可以比较。
+"""
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+SEED = 20250701
+RASTER_BLOCK_ROWS = 1024  # 生成大影像时每次写入的行数
+
+
+def _rng(*parts):
+    return np.random.default_rng([SEED, *parts])
+
+
+def daily_inflow(years, end=None):
+    """
+    逐日来水序列：年周期 + 随机扰动，结束于 end（默认昨天）
+    :param years: 年数
+    :return: DataFrame[time(%Y-%m-%d), inflow]
+    """
+    end = end or dt.date.today() - dt.timedelta(days=1)
+    dates = pd.date_range(end=end, periods=int(round(years * 365.25)), freq='D')
+    phase = 2 * np.pi * dates.dayofyear.to_numpy() / 365.25
+    rng = _rng(1, years)
+    inflow = np.maximum(0, 20 + 15 * np.sin(phase - np.pi / 2) + rng.gamma(2.0, 3.0, len(dates)))
+    return pd.DataFrame({'time': dates.strftime('%Y-%m-%d'), 'inflow': np.round(inflow, 2)})
+
+
+def monthly_inflow(years, end=None):
+    """
+    逐月来水序列，与 sum_monthly_series 的输出格式一致
+    :return: DataFrame[time(%Y-%m-01), inflow]
+    """
+    daily = daily_inflow(years, end)
+    months = daily['time'].str[:7]
+    monthly = daily.groupby(months, sort=True)['inflow'].sum().round(2)
+    return pd.DataFrame({'time': monthly.index + '-01', 'inflow': monthly.to_numpy()})
+
+
+def daily_records(value_name, year=2025, seed=0, scale=5.0):
+    """
+    一整年的逐日数据，sum_data_to_10days 的输入格式
+    :param value_name: 数据名称，如 'smi'、'precip'
+    :return: [{'date': '%Y-%m-%d', value_name: 值}]
+    """
+    dates = pd.date_range(f'{year}-01-01', f'{year}-12-31', freq='D')
+    values = np.round(_rng(2, seed).gamma(1.5, scale / 1.5, len(dates)), 2)
+    return [{'date': d, value_name: float(v)} for d, v in zip(dates.strftime('%Y-%m-%d'), values)]
+
+
+def irrigation_areas(n_areas, year=2025):
+    """
+    灌片需水、预测来水和灌区信息，get_allocation_for_each_area / rolling_plan 的输入格式
+    :param n_areas: 灌片数
+    :return: (water_demand_data, inflow_data, area_info)
+    """
+    rng = _rng(3, n_areas)
+    names = [f'灌片{i:04d}' for i in range(n_areas)]
+    water_demand_data = [{'area_name': name, 'water_demand': daily_records('smi', year, seed=i + 1)}
+                         for i, name in enumerate(names)]
+    inflow_data = {'forecast_inflow': daily_records('precip', year, seed=0, scale=3.0)}
+    area_info = {name: {'id': f'n{i + 1}', 'area': int(area), 'need-allocate': True, 'main-crops': ['']}
+                 for i, (name, area) in enumerate(zip(names, rng.integers(1000, 20000, n_areas)))}
+    return water_demand_data, inflow_data, area_info
+
+
+def allocation_request(area_names, year=2025):
+    """
+    /model3/get_allocation_for_each_area 的请求体，接口按配置中的灌区信息计算，只能使用已有的灌片名称
+    :param area_names: 灌片名称列表
+    :return: {'water_requirement_json': ..., 'predict_inflow': ...}
+    """
+    water_demand_data, inflow_data, _ = irrigation_areas(len(area_names), year)
+    for item, name in zip(water_demand_data, area_names):
+        item['area_name'] = name
+    return {'water_requirement_json': water_demand_data, 'predict_inflow': inflow_data}
+
+
+def canal_tree(n_nodes, branching=4):
+    """
+    渠系树：根节点为各水源对应的干渠，其余节点按层次挂在上一级节点下
+    :param n_nodes: 节点总数
+    :return: (树结构 DataFrame[ID, 上一节点ID], 各节点需水量 dict, 根节点列表)
+    """
+    rng = _rng(4, n_nodes)
+    ids = [f'c{i}' for i in range(n_nodes)]
+    n_roots = max(1, n_nodes // 50)
+    parents = [None] * n_roots
+    parents += [ids[(i - n_roots) // branching] for i in range(n_roots, n_nodes)]
+    tree = pd.DataFrame({'ID': ids, '上一节点ID': parents})
+    demand = dict(zip(ids, np.round(rng.gamma(2.0, 5.0, n_nodes), 2)))
+    return tree, demand, ids[:n_roots]
+
+
+def weather_forecast(days=30, start=None):
+    """
+    和风天气 /v7/weather/30d 格式的逐日预报
+    :param days: 天数
+    :param start: 第一天，默认今天
+    :return: 响应JSON dict，数值字段与真实接口一样为字符串
+    """
+    start = start or dt.date.today()
+    rng = _rng(5, days)
+    daily = []
+    for i in range(days):
+        date = start + dt.timedelta(days=i)
+        phase = 2 * np.pi * date.timetuple().tm_yday / 365.25
+        temp_max = int(round(18 + 12 * np.sin(phase - np.pi / 2) + rng.normal(0, 2)))
+        temp_min = temp_max - int(rng.integers(6, 12))
+        daily.append({
+            'fxDate': date.strftime('%Y-%m-%d'),
+            'sunrise': '05:45', 'sunset': '19:10',
+            'moonrise': '', 'moonset': '', 'moonPhase': '', 'moonPhaseIcon': '',
+            'tempMax': str(temp_max), 'tempMin': str(temp_min),
+            'iconDay': '100', 'textDay': '晴', 'iconNight': '150', 'textNight': '晴',
+            'wind360Day': '180', 'windDirDay': '南风', 'windScaleDay': '1-3',
+            'windSpeedDay': str(int(rng.integers(3, 16))),
+            'wind360Night': '180', 'windDirNight': '南风', 'windScaleNight': '1-3',
+            'windSpeedNight': str(int(rng.integers(3, 12))),
+            'humidity': str(int(rng.integers(30, 95))),
+            'precip': f'{rng.gamma(0.4, 4.0):.1f}',
+            'pressure': str(int(rng.integers(995, 1025))),
+            'vis': '25', 'cloud': str(int(rng.integers(0, 100))), 'uvIndex': str(int(rng.integers(1, 11))),
+        })
+    return {
+        'code': '200',
+        'updateTime': dt.datetime.now().strftime('%Y-%m-%dT%H:%M+08:00'),
+        'fxLink': '',
+        'daily': daily,
+        'refer': {'sources': ['synthetic'], 'license': ['synthetic']},
+    }
+
+
+def write_band_rasters(directory, megapixels, name='SYN'):
+    """
+    红波、近红外波 uint16 GeoTIFF，近红外与红波近似线性（存在土壤线），按行块写入，不占用整幅影像的内存
+    :param directory: 输出目录
+    :param megapixels: 像元数（百万）
+    :return: (红波路径, 近红外路径)，文件名符合 xxx_R.TIF / xxx_NIR.TIF
+    """
+    import rasterio
+    from rasterio.transform import from_origin
+    from rasterio.windows import Window
+
+    size = int(round(np.sqrt(megapixels * 1e6)))
+    paths = (f'{directory}/{name}{megapixels}_R.TIF', f'{directory}/{name}{megapixels}_NIR.TIF')
+    profile = {'driver': 'GTiff', 'width': size, 'height': size, 'count': 1, 'dtype': 'uint16', 'crs': 'EPSG:4326',
+               'transform': from_origin(116.7, 36.0, 1e-5, 1e-5), 'tiled': True, 'blockxsize': 256, 'blockysize': 256}
+    rng = _rng(6, int(megapixels * 100))
+    with rasterio.open(paths[0], 'w', **profile) as red_dst, rasterio.open(paths[1], 'w', **profile) as nir_dst:
+        x = np.arange(size, dtype=np.float32) / size
+        for row in range(0, size, RASTER_BLOCK_ROWS):
+            rows = min(RASTER_BLOCK_ROWS, size - row)
+            y = (np.arange(row, row + rows, dtype=np.float32) / size)[:, None]
+            red = 0.05 + 0.3 * x[None, :] + 0.02 * np.sin(12 * y)
+            nir = 1.3 * red + 0.02 + 0.2 * y + rng.gamma(1.5, 0.01, (rows, size)).astype(np.float32)
+            window = Window(0, row, size, rows)
+            red_dst.write((red * 1000).astype(np.uint16), 1, window=window)
+            nir_dst.write((nir * 1000).astype(np.uint16), 1, window=window)
+    return paths
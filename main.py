@@ -1,36 +1,106 @@
-import uvicorn
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, APIRouter
+from starlette.responses import JSONResponse, Response
 
 from model1.service import router_1
 from model2.service import router_2
 from model3.service import router_3
 from model5.service import router_5
+from utils.concurrency import shutdown_process_pool
+from utils.job_queue import shutdown_job_manager
+from utils.job_service import router_jobs
+from utils.metrics import PROMETHEUS_CONTENT_TYPE, render_prometheus
+from utils.profiling import MetricsMiddleware, ProfiledRoute
+from utils.warmup import get_warm_up_status, start_warm_up
+
+
+
+@asynccontextmanager
+async def lifespan(app):
+    start_warm_up()  # 按配置在后台预先导入各模型的依赖，不阻塞启动
+    yield
+    # 服务关闭时停止工作池
+    shutdown_job_manager()
+    shutdown_process_pool()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)  # 请求耗时统计，配置 metrics.profile 开启后 ?profile=1 返回性能分析报告
 
 
 
 router_4 = APIRouter(
     prefix="/model4",
-    tags=["输配水调度模型"]
+    tags=["输配水调度模型"],
+    route_class=ProfiledRoute,
 )
 
 router_default = APIRouter(
     prefix="/utils",
-    tags=["工具API"]
+    tags=["工具API"],
+    route_class=ProfiledRoute,
 )
 
 @router_default.get('/get_current_dir')
 def get_current_dir():
     return os.getcwd()
 
+
+@router_default.get('/warm_up_status')
+def warm_up_status():
+    """
+    后台预热状态
+    \n:return: state: idle（未开启）/ running / done，modules: 各模块导入耗时（秒），errors: 导入失败的模块
+    """
+    return get_warm_up_status()
+
+
+@router_default.get('/health')
+def health():
+    """
+    存活检查
+    \n:return: status: ok，pid: 处理本次请求的工作进程
+    """
+    return {"status": "ok", "pid": os.getpid()}
+
+
+@router_default.get('/ready')
+def ready():
+    """
+    就绪检查：后台预热已结束且共享缓存可访问时返回200，否则返回503
+    \n:return: ready，pid，workers: 工作进程数，warm_up: 预热状态，shared_cache: 各类缓存条目数
+    """
+    from utils.server import worker_count
+    from utils.shared_cache import get_shared_cache
+
+    warm_up = get_warm_up_status()
+    body = {"ready": warm_up["state"] != "running", "pid": os.getpid(), "workers": worker_count(),
+            "warm_up": warm_up["state"], "warm_up_errors": warm_up["errors"]}
+    try:
+        body["shared_cache"] = get_shared_cache().stats()
+    except Exception as e:  # 数据库文件不可读写等
+        body.update(ready=False, shared_cache={"error": repr(e)})
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+
+@router_default.get('/metrics')
+def metrics():
+    """
+    接口耗时与模型各阶段耗时，Prometheus 文本格式
+    \n:return: http_request_duration_seconds（按 method、route、status）和 stage_duration_seconds（按 stage）直方图
+    """
+    return Response(render_prometheus(), media_type=PROMETHEUS_CONTENT_TYPE)
+
 app.include_router(router_1)
 app.include_router(router_2)
 app.include_router(router_3)
 app.include_router(router_4)
 app.include_router(router_5)
+app.include_router(router_jobs)
 app.include_router(router_default)
 
+
 @app.get('/')
 def hello():
     return '欢迎来到我的fastAPI应用！'
@@ -54,4 +124,8 @@ if getattr(sys, 'frozen', False):
     os.environ['CPL_LOG'] = '/dev/null'
 
 if __name__ == '__main__':
-    uvicorn.run(app, port=8081, host='0.0.0.0',)
+    # 后台任务进程池使用spawn方式启动子进程，PyInstaller打包后需要
+    import multiprocessing
+    multiprocessing.freeze_support()
+    from utils.server import run
+    run(app)  # 地址、端口、工作进程数取配置 server 节
@@ -2,6 +2,8 @@ import numpy as np
 import pandas as pd
 from statsmodels.tsa.arima.model import ARIMA
 
+from utils.metrics import span
+
 
 def arima(data,steps=10):
     # 使用传入的数据
@@ -9,7 +11,8 @@ def arima(data,steps=10):
     time = data['time'].values
 
     model_inflow = ARIMA(inflow, order=(1, 0, 0))
-    model_inflow_fit = model_inflow.fit()
+    with span('model_fit'):
+        model_inflow_fit = model_inflow.fit()
 
     # 进行未来3年来水量的预测，并将预测结果保留一位小数
     forecast_inflow = np.round(model_inflow_fit.forecast(steps=steps), 1).tolist()
@@ -24,7 +27,8 @@ def arima(data,steps=10):
 
 def arima_path(file_path, predict_days=15):
     # 从文件中读取数据
-    data = pd.read_csv(file_path)
+    with span('csv_read'):
+        data = pd.read_csv(file_path)
 
     # 使用传入的数据
     # precipitation = data[0].values
@@ -40,7 +44,8 @@ def arima_path(file_path, predict_days=15):
 
     # 创建来水量的 ARIMA 模型并拟合数据
     model_inflow = ARIMA(inflow, order=(1, 0, 0))
-    model_inflow_fit = model_inflow.fit()
+    with span('model_fit'):
+        model_inflow_fit = model_inflow.fit()
 
     # 进行未来3年来水量的预测，并将预测结果保留一位小数
     forecast_inflow = np.round(model_inflow_fit.forecast(steps=predict_days), 3).tolist()
@@ -3,6 +3,8 @@ import datetime as dt
 import pandas as pd
 from statsmodels.tsa.statespace.sarimax import SARIMAX
 
+from utils.metrics import span
+
 
 # 用按周为周期的数据预测来水序列
 
@@ -24,11 +26,12 @@ def sarima_predict(data, predict_end_date):
     )
 
     # 拟合模型
-    fitted = model.fit(disp=False)  # disp=False 避免输出优化过程
+    with span('model_fit'):
+        fitted = model.fit(disp=False)  # disp=False 避免输出优化过程
     print(fitted.summary())
     # 计算未来多少周
-    weeks = (predict_end_date - dt.datetime.strptime(time[-1], "%Y-%m-%d")).days / 7 + 2
-    forecast_weeks = fitted.get_forecast(steps=int(weeks))
+    weeks = int((predict_end_date - dt.datetime.strptime(time[-1], "%Y-%m-%d")).days / 7 + 2)
+    forecast_weeks = fitted.get_forecast(steps=weeks)
 
     pred_weekly_mean = forecast_weeks.predicted_mean
 
@@ -45,7 +48,8 @@ def sarima_predict(data, predict_end_date):
 
     # 但这是“每周总量”分布在7天，我们希望是“每日趋势”，所以做线性插值平滑
     # 更合理的方式：在周边界之间插值
-    pred_daily_interpolated = pred_weekly.reindex(daily_index).interpolate(method='linear')
+    with span('disaggregate'):
+        pred_daily_interpolated = pred_weekly.reindex(daily_index).interpolate(method='linear')
 
     target_start = dt.datetime.now().strftime("%Y-%m-%d")
     target_end = predict_end_date.strftime("%Y-%m-%d")
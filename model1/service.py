@@ -1,44 +1,53 @@
 import datetime as dt
-import json
 import os
 import time
 from datetime import datetime
 from typing import Optional
 
-import pandas as pd
-import yaml
 from fastapi import APIRouter, UploadFile, File
 
 import utils
-from model1.inflow_ARIMA import arima_path
-from model1.inflow_SARIMA import sarima_path
-from model1.inflow_SARIMAX import sarimax_path
-from model1.sarima_predict import sarima_predict
-from model1.utils.construct_data_from_history import sum_monthly_series
-from model3.implement import sum_data_to_10days
-from utils.hefeng_weather_predict import request_weather
+from utils.concurrency import run_in_thread
+from utils.config import load_config
+from utils.metrics import span
+from utils.profiling import ProfiledRoute
+from utils.responses import check_format, date_strings, json_response, records_to_columns
+from utils.shared_cache import cached, file_signature, reference_table
+from utils.upload import UploadTooLarge, save_upload_file
 import utils.file_path_processor
+
+# 预测模型（statsmodels、pandas 等）在接口函数内导入，服务启动时不加载，首次调用对应接口时才导入
 router_1 = APIRouter(
     prefix="/model1",
-    tags=["来水预报模型"]
+    tags=["来水预报模型"],
+    route_class=ProfiledRoute,
 )
 
 
 @router_1.get('/inflow_predict')
 def inflow_predict(file_path, predict_steps: Optional[int] = 12,
-                   predict_begin_date: str = None):
+                   predict_begin_date: str = None, format: str = 'records'):
     """
     来水预报
     \n:param predict_begin_date: 可选 预测开始日期 %Y-%m-%d， 默认为当月一号, 尽量选当月第一天，若输入不为当月一号则采用默认
     \n:param file_path: csv文件路径, 文件包括两列，['inflow', 'time']分别代表[来水量， 时间戳（天）]
     \n:param predict_steps: 预测步数 int， 默认=12
+    \n:param format: records（默认，逐日 [{"date", "precip"}]）/ columns（按列 {"dates": [...], "precip": [...]}）
     \n:return: 从predict_begin_date开始的未来predict_days天的预测来水以及从当天开始的未来30天的降水预报
     """
-    with open("config/configuration_local.yaml", 'r', encoding='utf-8') as f:
-        config = yaml.safe_load(f)['model1']
-    modelname = config['default-method']
+    format_error = check_format(format)
+    if format_error:
+        return format_error
+    import pandas as pd
+    from model1.inflow_ARIMA import arima_path
+    from model1.inflow_SARIMA import sarima_path
+    from model1.inflow_SARIMAX import sarimax_path
+    from utils.hefeng_weather_predict import request_weather
+
+    modelname = load_config('model1')['default-method']
     start_time = time.perf_counter()  # 记录函数开始时间
-    df = pd.read_csv(file_path)
+    with span('csv_read'):
+        df = pd.read_csv(file_path)
     last_row = df.iloc[-1]
     last_date = last_row['time']  # 预测数据最后一天
     last_date = datetime.strptime(last_date, '%Y-%m-%d')
@@ -57,13 +66,15 @@ def inflow_predict(file_path, predict_steps: Optional[int] = 12,
 
     try:
         if modelname == 'arima':
-            result = arima_path(file_path, steps)  # 调用 arima_path 函数处理数据
+            fit = arima_path  # 调用 arima_path 函数处理数据
         elif modelname == 'sarimax':
-            result = sarimax_path(file_path, steps)  # 调用 sarimax_path 函数处理数据
+            fit = sarimax_path  # 调用 sarimax_path 函数处理数据
         elif modelname == 'sarima':
-            result = sarima_path(file_path, steps)  # 调用 sarima_path 函数处理数据
+            fit = sarima_path  # 调用 sarima_path 函数处理数据
         else:
             return {'error': 'Invalid model name'}
+        # 同一文件、同一预测步数的拟合结果在各工作进程间共享，文件修改后重新拟合
+        result = cached('inflow-fit', (modelname, file_signature(file_path), steps), lambda: fit(file_path, steps))
 
         end_time = time.perf_counter()  # 记录函数结束时间
         execution_time = end_time - start_time  # 计算函数执行时间（单位：秒）
@@ -84,22 +95,26 @@ def inflow_predict(file_path, predict_steps: Optional[int] = 12,
                 predict_begin_date = predict_begin_date.replace(year=predict_begin_date.year + 1)
 
         # 以下计算当月每一天的来水量
-        predict_precip_daily_list = cal_predict_precip_daily(result_list)
-        result['forecast_inflow'] = predict_precip_daily_list
-        return result
+        if format == 'columns':
+            dates, precip = cal_predict_precip_daily_columns(result_list)
+            result['forecast_inflow'] = {"dates": date_strings(dates), "precip": precip}
+            result['precipitation'] = records_to_columns(precip_list, ['precip'])
+        else:
+            result['forecast_inflow'] = cal_predict_precip_daily(result_list)
+        return json_response(result)
     except Exception as e:
         return {'error': str(e)}
 
 
+@span('disaggregate')
 def cal_predict_precip_daily(data_list):
     """计算逐日来水量"""
+    import pandas as pd
+
     result = []
     months = len(data_list)
-    with open("config/configuration_local.yaml", 'r', encoding='utf-8') as f:
-        config = yaml.safe_load(f)['model1']
-    with open(config['data-dir'], 'r', encoding="utf-8") as f:
-        rate_list_json = json.load(f)
-    df = pd.DataFrame(rate_list_json)
+    config = load_config('model1')
+    df = pd.DataFrame(reference_table(config['data-dir']))
     for i in data_list:
         precip = i["predict_precip"]
         day_i = dt.datetime.strptime(i["date"], '%Y-%m-%d').date()
@@ -116,24 +131,66 @@ def cal_predict_precip_daily(data_list):
     return result
 
 
+@span('disaggregate')
+def cal_predict_precip_daily_columns(data_list):
+    """
+    计算逐日来水量，按列返回，同 cal_predict_precip_daily
+    :return: (日期 datetime64[D] 数组, 来水量数组)
+    """
+    import numpy as np
+
+    rates = {i['date']: i['rate'] for i in reference_table(load_config('model1')['data-dir'])}
+    dates, precip = [], []
+    for i in data_list:
+        first_day = np.datetime64(i['date'], 'D')
+        days = np.arange(first_day, (first_day.astype('datetime64[M]') + 1).astype('datetime64[D]'))
+        month_rates = np.array([rates[day[5:]] for day in np.datetime_as_string(days)])
+        dates.append(days)
+        precip.append(i['predict_precip'] * month_rates)
+    return np.concatenate(dates), np.round(np.concatenate(precip), 2)
+
+
 @router_1.get('/weather_predict')
 def weather_predict():
     """
     返回未来30天的降水量，单位:mm
     \n:return:
     """
+    from utils.hefeng_weather_predict import request_weather
+
     precip_list = [{"date": i["fxDate"], "precip": i["precip"]} for i in request_weather()["daily"]]
     return {'precipitation': precip_list}
 
 
 @router_1.post('/mid_long_inflow_predict')
-def series_predict(upload_file: UploadFile, ):
+def series_predict(upload_file: UploadFile, format: str = 'records'):
     """
     中长期来水预报
     :param upload_file: csv文件， 包含'time', 'inflow', 代表日期，来水量单位"m³/s"
+    :param format: records（默认，[{"date", "inflow"}]）/ columns（按列 {"dates": [...], "inflow": [...]}）
     :return: 旬月年的中长期预测序列
     """
-    df = pd.read_csv(upload_file.file)
+    import pandas as pd
+
+    format_error = check_format(format)
+    if format_error:
+        return format_error
+    with span('csv_read'):
+        df = pd.read_csv(upload_file.file)
+    return json_response(predict_mid_long_series(df, format))
+
+
+def predict_mid_long_series(df, format='records'):
+    """
+    中长期来水预报，按周SARIMA拟合后汇总为旬月年序列
+    :param df: 历史数据，包含'time', 'inflow'两列
+    :param format: records / columns，见 utils.responses
+    :return: 旬月年的中长期预测序列
+    """
+    import pandas as pd
+    from model1.sarima_predict import sarima_predict
+    from model3.implement import sum_data_to_10days
+
     inflow_series = list(df['inflow'])
     time_series = list(df['time'])
     data = {
@@ -142,7 +199,9 @@ def series_predict(upload_file: UploadFile, ):
     }
     last_row = df.iloc[-1]
     predict_last_date = dt.datetime.now() + dt.timedelta(days=365)
-    result = sarima_predict(data, predict_last_date)
+    # 按周拟合耗时较长，同一份历史数据当天的预测结果在各工作进程间共享
+    result = cached('series-fit', (data, dt.date.today().isoformat()),
+                    lambda: sarima_predict(data, predict_last_date))
     predict_inflow_list = []
     now = dt.datetime.now()
     for i in result:
@@ -180,6 +239,8 @@ def series_predict(upload_file: UploadFile, ):
     result['旬数据（单位：m³）'] = inflow_pre_10days
     result['月数据（单位：m³）'] = inflow_monthly
     result['年数据（单位：m³）'] = inflow_yearly
+    if format == 'columns':
+        result = {key: records_to_columns(value, ['inflow']) for key, value in result.items()}
 
     return result
 
@@ -191,19 +252,20 @@ async def upload_data_file(upload_file: UploadFile = File(...)):
     \n:param upload_file: 选择文件
     \n:return: 上传成功的路径，用于未来来水的预测
     """
+    from model1.utils.construct_data_from_history import sum_monthly_series
+
     if not upload_file:
         return {'error': '请上传文件'}
-    content = await upload_file.read()
-    with open("config/configuration_local.yaml", 'r', encoding='utf-8') as f:
-        config = yaml.safe_load(f)['model1']
-    save_dir = config['data-dir']
-    if not os.path.exists(save_dir):
-        os.makedirs(save_dir)
+    save_dir = load_config('model1')['data-dir']
     # 如果是按天的数据，计算得到按月的数据：
     full_path = os.path.join(save_dir, upload_file.filename)
-    with open(full_path, 'wb') as f:
-        f.write(content)
+    try:
+        info = await run_in_thread('io', save_upload_file, upload_file, full_path)
+    except UploadTooLarge as e:
+        return {'error': str(e)}
+    if info["duplicate"]:  # 相同内容已上传并处理过
+        return {"file_dir": info["file_path"]}
     # 如果是天的，转化成按月的
-    sum_monthly_series(full_path)
+    await run_in_thread('io', sum_monthly_series, full_path)
 
     return {"file_dir": full_path}
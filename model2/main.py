@@ -1,15 +1,16 @@
 import datetime as dt
-import json
 import math
 import re
 from datetime import timedelta
 
 import pandas
 import pandas as pd
-import yaml
 
 import utils.file_path_processor
+from utils.config import load_config
 from utils.hefeng_weather_predict import request_weather
+from utils.metrics import span
+from utils.shared_cache import reference_table
 
 # 纬度
 LAT = 35.57
@@ -282,10 +283,8 @@ def predict_e(kind, plant_d, begin_d, end_d, datalist):
         return "数据长度小于预测天数，请检查上传的数据"
     E = 0
     E_list = []
-    with open("config/configuration_local.yaml", 'r', encoding='utf-8') as f:
-        config = yaml.safe_load(f)['model2']
-    with open(config['data-dir'], 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    config = load_config('model2')
+    data = reference_table(config['data-dir'])
     Kc_list = data["Kc"][kind]
     # Kc分界点
     date_split = [plant_d + timedelta(days=int(i)) for i in Kc_list]
@@ -332,16 +331,19 @@ def request_smi_predict(plant_d, begin_d, end_d, kind="wheat"):
     return res
 
 
+def _read_csv(file_path):
+    with span('csv_read'):
+        return pd.read_csv(file_path)
+
+
 def request_smi_experiential(plant_d, begin_d, end_d, kind="wheat"):
     if begin_d >= end_d:
         return "日期错误"
     if kind not in ["corn", "vegetable", "wheat", "peanut", "cotton"]:
         return "未知作物类型"
 
-    with open("config/configuration_local.yaml", 'r', encoding='utf-8') as f:
-        config = yaml.safe_load(f)['model2']
-    with open(config['data-dir'], 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    config = load_config('model2')
+    data = reference_table(config['data-dir'])
     Kc_list = data["Kc"][kind]
     days = grow_days(plant_d, end_d)
     # Kc分界点
@@ -351,8 +353,7 @@ def request_smi_experiential(plant_d, begin_d, end_d, kind="wheat"):
     kc_values = list(Kc_list.values())
     categories = pandas.cut(day_list, date_split).codes
     kc_for_days = [kc_values[i + 1] for i in categories]
-    with open(config['ave_e0_csv'], 'r', encoding='utf-8') as f:
-        df = pd.read_csv(f)
+    df = reference_table(config['ave_e0_csv'], _read_csv)
 
     plant_day = plant_d
     day_cursor = begin_d  # 从这一天开始计算
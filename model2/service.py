@@ -2,24 +2,33 @@ import datetime as dt
 
 from fastapi import APIRouter
 
-from model2.main import request_smi_predict, request_smi_experiential
+from utils.profiling import ProfiledRoute
+from utils.responses import check_format, json_response, records_to_columns
 
 router_2 = APIRouter(
     prefix="/model2",
-    tags=["需水预测模型"]
+    tags=["需水预测模型"],
+    route_class=ProfiledRoute,
 )
 
 
 @router_2.get('/water_predict')
-def water_predict(plant_day, begin_day, end_day, kind):
+def water_predict(plant_day, begin_day, end_day, kind, format: str = 'records'):
     """
     需水预测
     \n:param plant_day: 种植日期 格式为： %Y-%m-%d  下同
     \n:param begin_day: 开始日期
     \n:param end_day: 结束日期
     \n:param kind: 作物类型，枚举["wheat", "corn", "cotton", "vegetable", "peanut"]，依次是：【小麦， 玉米， 棉花， 蔬菜（以菠菜为代表）， 花生】
+    \n:param format: records（默认，smi_list 为 [{"date", "smi"}]）/ columns（按列 {"dates": [...], "smi": [...]}）
     \n:return: 给出单株植物每日需水序列以及总需水量， all（总需水量）: xx.xx mm（毫米）， smi-list(每日需水量)中的单元：{'date': xx.xx}单位：毫米
     """
+    from model2.main import request_smi_predict, request_smi_experiential  # 首次调用时导入，不拖慢服务启动
+
+    format_error = check_format(format)
+    if format_error:
+        return format_error
+
     plant_d = dt.datetime.strptime(plant_day, "%Y-%m-%d")
     begin_d = dt.datetime.strptime(begin_day, "%Y-%m-%d")
     ed = dt.datetime.strptime(end_day, "%Y-%m-%d")
@@ -49,8 +58,10 @@ def water_predict(plant_day, begin_day, end_day, kind):
         if type(i) is dict and 'smi' in i:
             sum_smi += float(i['smi'])
 
-    return {
+    if format == 'columns':
+        former_res_list = records_to_columns([i for i in former_res_list if type(i) is dict], ['smi'])
+    return json_response({
         "all": round(sum_smi, 1),
         "smi_list": former_res_list
-    }
+    })
 
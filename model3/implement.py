@@ -1,9 +1,13 @@
 import datetime as dt
 import json
 
+import numpy as np
 import pandas as pd
 
+from utils.metrics import span
 
+
+@span('allocation')
 def calculate_10days_allocation(water_demand_data, inflow_data, area_info):
     """
     计算逐旬各个灌区配水量
@@ -47,6 +51,25 @@ def calculate_10days_allocation(water_demand_data, inflow_data, area_info):
     return result
 
 
+@span('allocation')
+def calculate_allocation_columns(water_demand_data, inflow_data, area_info):
+    """
+    计算各灌片逐旬、逐月、逐年配水量，按列返回，数值同 calculate_10days_allocation 及其月、年汇总
+    :return: {"areas": 灌片名称列表,
+              "per_10days" / "monthly" / "yearly": {"dates": 时段列表, "allocation": 配水量 m³ 矩阵（灌片×时段）}}
+    """
+    from model3.rolling_plan import build_requirement_matrix, requirement_m3  # rolling_plan 依赖本模块
+
+    area_names, dekads, demand, precip, area = build_requirement_matrix(water_demand_data, inflow_data, area_info)
+    per_10days = np.round(requirement_m3(demand, precip, area), 1)
+    result = {"areas": area_names, "per_10days": {"dates": dekads, "allocation": per_10days}}
+    for name, prefix in (("monthly", 7), ("yearly", 4)):
+        periods, starts = np.unique([d[:prefix] for d in dekads], return_index=True)  # 旬按时间顺序排列
+        totals = np.add.reduceat(per_10days, starts, axis=1) if len(dekads) else per_10days
+        result[name] = {"dates": periods.tolist(), "allocation": np.round(totals, 1)}
+    return result
+
+
 def calculate_monthly_allocation(allocation_per_10days):
     """
     计算每月的配水量
@@ -0,0 +1,419 @@
+"""
+滚动时域动态配水（年度配置-动态调整抗旱应急）
+
+年度计划按旬建立一个整体LP模型：
+    决策变量: 各灌片逐旬配水量 allocation[a, t]、缺水量 shortage[a, t]、旬末蓄水量 storage[t]、弃水量 spill[t]
+    约束1: allocation[a, t] + shortage[a, t] = 需水量[a, t]
+    约束2: storage[t] = storage[t-1] + 可供水量[t] - Σ allocation[:, t] - spill[t]
+    目标:   最小化加权缺水量
+每当有新的一旬实测来水/需水到达时，只修改对应约束的右端项并把已执行的旬固定住，
+以上一次的最优解作为初值重新求解，剩余各旬的方案随之更新。
+"""
+import threading
+import uuid
+
+import numpy as np
+import pulp
+
+from model3.implement import sum_data_to_10days
+from utils.metrics import span
+from utils.shared_cache import get_shared_cache, get_ttl
+
+SHORTAGE_WEIGHT = 100  # 缺水惩罚权重，与配置模型保持一致
+
+
+def build_requirement_matrix(water_demand_data, inflow_data, area_info):
+    """
+    将各灌片需水数据与预测来水数据整理为 灌片×旬 的矩阵
+    :param water_demand_data: 各个灌片需水数据 list[dict]，同 get_allocation_for_each_area
+    :param inflow_data: 预测来水数据 dict，包含 forecast_inflow
+    :param area_info: 灌区信息 dict
+    :return: (灌片名称列表, 旬列表, 需水量矩阵 mm (A×T), 逐旬降水量 mm (T), 灌片面积 ㎡ (A))
+    """
+    inflow_per_10days = sum_data_to_10days(inflow_data['forecast_inflow'], 'precip')
+    precip_map = {i['date']: i['precip'] for i in inflow_per_10days}
+
+    area_names = []
+    demand_rows = []
+    dekads = None
+    for i in water_demand_data:
+        demand_per_10days = sum_data_to_10days(i["water_demand"], "smi")
+        demand_map = {x['date']: x['smi'] for x in demand_per_10days}
+        if dekads is None:
+            dekads = list(demand_map.keys())
+        area_names.append(i['area_name'])
+        demand_rows.append([demand_map.get(d, 0.0) for d in dekads])
+
+    dekads = dekads or []
+    demand = np.array(demand_rows, dtype=float).reshape(len(area_names), len(dekads))
+    precip = np.array([precip_map.get(d, 0.0) for d in dekads], dtype=float)
+    area = np.array([area_info[name]["area"] * 666.7 for name in area_names], dtype=float)
+    return area_names, dekads, demand, precip, area
+
+
+def requirement_m3(demand, precip, area):
+    """
+    计算灌片净需水量（m³）: max(0, 需水 - 来水) * 面积
+    :param demand: 需水量 mm，形状 (..., A, T)
+    :param precip: 来水量 mm，形状 (..., T)
+    :param area: 灌片面积 ㎡，形状 (A,)
+    :return: 净需水量 m³，形状 (..., A, T)
+    """
+    net = np.maximum(0, demand - precip[..., None, :])
+    return net * 0.001 * area[:, None]
+
+
+def align_supply(supply, dekads, demand, precip, area):
+    """
+    将 [{"date": 旬, "supply": m³}] 形式的可供水量对齐到旬列表
+    :return: 逐旬可供水量 m³ (T)，缺失的旬按该旬总净需水量计
+    """
+    supply_per_10days = requirement_m3(demand, precip, area).sum(axis=0)
+    if supply is not None:
+        supply_map = {i['date']: i['supply'] for i in supply}
+        supply_per_10days = np.array([supply_map.get(d, supply_per_10days[t]) for t, d in enumerate(dekads)])
+    return supply_per_10days
+
+
+def _to_float(value, name):
+    """:raise ValueError: 不是数值时"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name}应为数值：{value}") from None
+
+
+class RollingHorizonPlanner:
+    """
+    有状态的滚动时域配水计划
+    已执行（提交）的旬固定不变，每次更新只重新优化剩余各旬
+    """
+
+    def __init__(self, area_names, dekads, demand, precip, area, supply=None,
+                 initial_storage=0.0, storage_capacity=None):
+        """
+        :param area_names: 灌片名称列表
+        :param dekads: 旬列表，如 ["2025-07-上旬", ...]
+        :param demand: 需水量矩阵 mm (A×T)
+        :param precip: 逐旬来水（降水）量 mm (T)
+        :param area: 灌片面积 ㎡ (A)
+        :param supply: 逐旬可供水量 m³ (T)，默认等于逐旬总净需水量（即不缺水）
+        :param initial_storage: 初始蓄水量 m³
+        :param storage_capacity: 蓄水能力上限 m³，None 表示不限
+        """
+        self.area_names = list(area_names)
+        self.dekads = list(dekads)
+        self.demand = np.array(demand, dtype=float)
+        self.precip = np.array(precip, dtype=float)
+        self.area = np.array(area, dtype=float)
+        if supply is None:
+            supply = requirement_m3(self.demand, self.precip, self.area).sum(axis=0)
+        self.supply = np.array(supply, dtype=float)
+        self.initial_storage = float(initial_storage)
+        self.storage_capacity = storage_capacity
+        self.committed = 0  # 已提交（固定）的旬数
+        self.version = None  # 每次保存到共享缓存时生成的版本号，见 save_planner
+        self.lock = threading.Lock()
+        self._build_model()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    @span('lp_build')
+    def _build_model(self):
+        n_area, n_dekad = len(self.area_names), len(self.dekads)
+        self.model = pulp.LpProblem("Rolling_Water_Allocation", pulp.LpMinimize)
+        self.allocation = {}
+        self.shortage = {}
+        self.storage = {}
+        self.spill = {}
+        for t in range(n_dekad):
+            for a in range(n_area):
+                self.allocation[(a, t)] = pulp.LpVariable(f"Allocation_{a}_{t}", lowBound=0)
+                self.shortage[(a, t)] = pulp.LpVariable(f"Shortage_{a}_{t}", lowBound=0)
+            self.storage[t] = pulp.LpVariable(f"Storage_{t}", lowBound=0, upBound=self.storage_capacity)
+            self.spill[t] = pulp.LpVariable(f"Spill_{t}", lowBound=0)
+
+        self.model += pulp.lpSum([SHORTAGE_WEIGHT * v for v in self.shortage.values()])
+
+        requirement = requirement_m3(self.demand, self.precip, self.area)
+        for t in range(n_dekad):
+            # 约束1：每个灌片的配水量加上缺水量等于需水量
+            for a in range(n_area):
+                self.model += (self.allocation[(a, t)] + self.shortage[(a, t)] == requirement[a, t],
+                               f"demand_{a}_{t}")
+            # 约束2：蓄水量平衡，上一旬剩余水量可结转到下一旬
+            previous = self.storage[t - 1] if t > 0 else 0
+            self.model += (self.storage[t] - previous
+                           + pulp.lpSum([self.allocation[(a, t)] for a in range(n_area)])
+                           + self.spill[t] == self._balance_rhs(t),
+                           f"balance_{t}")
+
+    def _balance_rhs(self, t):
+        rhs = self.supply[t]
+        if t == 0:
+            rhs += self.initial_storage
+        return rhs
+
+    def _refresh_rhs(self, t):
+        """只更新第 t 旬相关约束的右端项，模型结构保持不变"""
+        requirement = requirement_m3(self.demand[:, t:t + 1], self.precip[t:t + 1], self.area)
+        for a in range(len(self.area_names)):
+            self.model.constraints[f"demand_{a}_{t}"].constant = -requirement[a, 0]
+        self.model.constraints[f"balance_{t}"].constant = -self._balance_rhs(t)
+
+    def set_inputs(self, demand=None, precip=None, supply=None):
+        """
+        替换整个计划的需水/来水/可供水数据，只更新约束右端项，不重新建立模型（用于多情景批量求解）
+        :param demand: 需水量矩阵 mm (A×T)
+        :param precip: 逐旬来水（降水）量 mm (T)
+        :param supply: 逐旬可供水量 m³ (T)
+        """
+        if demand is not None:
+            self.demand = np.array(demand, dtype=float)
+        if precip is not None:
+            self.precip = np.array(precip, dtype=float)
+        if supply is not None:
+            self.supply = np.array(supply, dtype=float)
+        for t in range(len(self.dekads)):
+            self._refresh_rhs(t)
+
+    def dekad_index(self, dekad=None):
+        """
+        :param dekad: 旬名称，None 表示下一个未提交的旬
+        :return: 旬序号
+        """
+        if dekad is None:
+            if self.committed >= len(self.dekads):
+                raise ValueError("年度计划的所有旬均已提交")
+            return self.committed
+        if dekad not in self.dekads:
+            raise ValueError(f"旬{dekad}不在计划范围内")
+        return self.dekads.index(dekad)
+
+    def update(self, dekad, precip=None, demand=None, supply=None):
+        """
+        更新某一旬的来水/需水/可供水数据
+        :param dekad: 旬名称
+        :param precip: 该旬来水（降水）量 mm
+        :param demand: 该旬各灌片需水量 mm，dict{灌片名称: 需水量}
+        :param supply: 该旬可供水量 m³
+        """
+        t = self.dekad_index(dekad)
+        if t < self.committed:
+            raise ValueError(f"旬{dekad}已提交，不能修改")
+        # 先检查全部参数再修改，参数有误时计划保持不变
+        precip = None if precip is None else _to_float(precip, "precip")
+        supply = None if supply is None else _to_float(supply, "supply")
+        demand_values = []
+        for name, value in (demand or {}).items():
+            if name not in self.area_names:
+                raise ValueError(f"灌片{name}不在计划中")
+            demand_values.append((self.area_names.index(name), _to_float(value, f"demand[{name}]")))
+        if precip is not None:
+            self.precip[t] = precip
+        for a, value in demand_values:
+            self.demand[a, t] = value
+        if supply is not None:
+            self.supply[t] = supply
+        self._refresh_rhs(t)
+
+    def solve(self):
+        """以上一次的解为初值重新求解，已提交的旬保持固定"""
+        with span('lp_solve'):
+            self.model.solve(pulp.PULP_CBC_CMD(msg=False, warmStart=True))
+        return pulp.LpStatus[self.model.status]
+
+    def _check_allocations(self, allocations):
+        """
+        :return: {灌片名称: 配水量 float}，None 时原样返回
+        :raise ValueError: 灌片不在计划中或配水量不是数值
+        """
+        if allocations is None:
+            return None
+        checked = {}
+        for name, value in allocations.items():
+            if name not in self.area_names:
+                raise ValueError(f"灌片{name}不在计划中")
+            checked[name] = _to_float(value, f"allocations[{name}]")
+        return checked
+
+    def commit(self, dekad=None, allocations=None):
+        """
+        提交（固定）一旬的配水方案，之后的求解不再改变该旬
+        :param dekad: 旬名称，None 表示下一个未提交的旬，只能按顺序提交
+        :param allocations: 实际执行的配水量 m³，dict{灌片名称: 配水量}，默认采用当前方案
+        """
+        t = self.dekad_index(dekad)
+        if t != self.committed:
+            raise ValueError(f"请先提交{self.dekads[self.committed]}")
+        allocations = self._check_allocations(allocations)
+        requirement = requirement_m3(self.demand[:, t:t + 1], self.precip[t:t + 1], self.area)
+        for a, name in enumerate(self.area_names):
+            var = self.allocation[(a, t)]
+            value = var.value() if allocations is None else allocations.get(name, var.value())
+            value = min(max(0.0, value or 0.0), requirement[a, 0])  # 超出需水的部分不计入配水
+            var.lowBound = value
+            var.upBound = value
+        self.committed += 1
+
+    def observe(self, dekad=None, precip=None, demand=None, supply=None, allocations=None):
+        """
+        新的一旬实测数据到达：更新该旬数据、提交该旬并重新优化剩余各旬
+        :return: 求解状态
+        """
+        t = self.dekad_index(dekad)
+        if t > self.committed:  # 与 commit 的检查相同，在修改数据前进行（已提交的旬由 update 检查）
+            raise ValueError(f"请先提交{self.dekads[self.committed]}")
+        allocations = self._check_allocations(allocations)
+        self.update(self.dekads[t], precip, demand, supply)
+        if allocations is not None:
+            self.commit(self.dekads[t], allocations)
+            return self.solve()
+        status = self.solve()
+        self.commit(self.dekads[t])
+        return status
+
+    def what_if(self, supply_scale=1.0, demand_scale=1.0, dekad=None):
+        """
+        情景分析：假设某一旬可供水量、需水量按比例变化，返回调整后的方案，不改变计划状态
+        :param supply_scale: 可供水量（m³）变化比例，如 0.8 表示可供水减少20%，与 model3.scenario 中同名参数含义一致
+        :param demand_scale: 需水量变化比例
+        :param dekad: 旬名称，默认为下一个未提交的旬
+        :return: (情景方案, 当前方案)
+        """
+        t = self.dekad_index(dekad)
+        baseline = self.result()
+        supply, demand = self.supply[t], self.demand[:, t].copy()
+        values = {v.name: v.varValue for v in self.model.variables()}
+        status = self.model.status
+        try:
+            self.supply[t] = supply * supply_scale
+            self.demand[:, t] = demand * demand_scale
+            self._refresh_rhs(t)
+            self.solve()
+            scenario = self.result()
+        finally:
+            self.supply[t], self.demand[:, t] = supply, demand
+            self._refresh_rhs(t)
+            for v in self.model.variables():
+                v.varValue = values.get(v.name)
+            self.model.status = status
+        return scenario, baseline
+
+    def allocation_matrix(self):
+        """当前方案的配水量矩阵 m³ (A×T)"""
+        n_area, n_dekad = len(self.area_names), len(self.dekads)
+        return np.array([[self.allocation[(a, t)].value() or 0.0 for t in range(n_dekad)]
+                         for a in range(n_area)])
+
+    def result(self):
+        """
+        整理当前方案
+        :return: {"status", "committed", "per_10days": [{"area_name", "allocations": [{"date", "allocation", "shortage", "committed"}]}]}
+        """
+        result = []
+        for a, name in enumerate(self.area_names):
+            result_i = []
+            for t, dekad in enumerate(self.dekads):
+                result_i.append({
+                    "date": dekad,
+                    "allocation": round(max(0.0, self.allocation[(a, t)].value() or 0.0), 1),
+                    "shortage": round(max(0.0, self.shortage[(a, t)].value() or 0.0), 1),
+                    "committed": t < self.committed,
+                })
+            result.append({
+                "area_name": name,
+                "allocations": result_i,
+            })
+        return {
+            "status": pulp.LpStatus[self.model.status],
+            "committed": self.dekads[:self.committed],
+            "storage": [round(self.storage[t].value() or 0.0, 1) for t in range(len(self.dekads))],
+            "per_10days": result,
+        }
+
+
+_planners = {}  # {计划ID: 计划}，本进程中的副本
+_planners_lock = threading.Lock()
+PLAN_NAMESPACE = 'rolling-plan'
+VERSION_NAMESPACE = 'rolling-plan-version'
+PLAN_LOCK_TIMEOUT = 120  # 等待其他工作进程修改同一计划的最长时间（秒）
+
+
+def create_planner(water_demand_data, inflow_data, area_info, supply=None, initial_storage=0.0,
+                   storage_capacity=None):
+    """
+    创建并求解滚动配水计划
+    :param supply: 逐旬可供水量 list[dict]，[{"date": "2025-07-上旬", "supply": m³}]，缺失的旬按净需水量计
+    :return: (计划ID, 计划)
+    """
+    area_names, dekads, demand, precip, area = build_requirement_matrix(water_demand_data, inflow_data, area_info)
+    supply_per_10days = align_supply(supply, dekads, demand, precip, area)
+    planner = RollingHorizonPlanner(area_names, dekads, demand, precip, area, supply_per_10days,
+                                    initial_storage, storage_capacity)
+    planner.solve()
+    plan_id = uuid.uuid4().hex
+    save_planner(plan_id, planner)
+    return plan_id, planner
+
+
+def save_planner(plan_id, planner):
+    """
+    保存计划：本进程中保留副本，同时写入共享缓存，其他工作进程和服务重启后均可读取
+    每次保存生成新的版本号（而不是在各进程的副本上递增），其他进程的副本版本号不同，下次读取时重新加载
+    修改已有计划需在 observe_planner 的跨进程锁内进行
+    """
+    planner.version = uuid.uuid4().hex
+    cache = get_shared_cache()
+    ttl = get_ttl(PLAN_NAMESPACE)
+    cache.set(PLAN_NAMESPACE, plan_id, planner, ttl)
+    cache.set(VERSION_NAMESPACE, plan_id, planner.version, ttl)
+    with _planners_lock:
+        _planners[plan_id] = planner
+
+
+def get_planner(plan_id):
+    """
+    获取计划，共享缓存中的版本号与本进程副本不同（其他工作进程修改过）时重新读取
+    """
+    cache = get_shared_cache()
+    version = cache.get(VERSION_NAMESPACE, plan_id)
+    with _planners_lock:
+        planner = _planners.get(plan_id)
+    if planner is not None and (version is None or planner.version == version):
+        return planner
+    planner = cache.get(PLAN_NAMESPACE, plan_id)
+    if planner is None:
+        raise KeyError(f"配水计划{plan_id}不存在")
+    with _planners_lock:
+        _planners[plan_id] = planner
+    return planner
+
+
+def observe_planner(plan_id, dekad=None, precip=None, demand=None, supply=None, allocations=None):
+    """
+    录入一旬实测数据并保存计划，见 RollingHorizonPlanner.observe
+    读取-修改-保存在跨进程锁内进行，多个工作进程同时修改同一计划时依次执行，每次修改都基于最新保存的计划
+    :return: 更新后的方案
+    """
+    cache = get_shared_cache()
+    with cache.lock(PLAN_NAMESPACE, plan_id, timeout=PLAN_LOCK_TIMEOUT):
+        planner = get_planner(plan_id)
+        with planner.lock:
+            try:
+                planner.observe(dekad, precip, demand, supply, allocations)
+            except Exception:
+                # 本进程副本可能已被部分修改，共享缓存中有该计划时丢弃副本，下次重新读取
+                if cache.get(VERSION_NAMESPACE, plan_id) is not None:
+                    with _planners_lock:
+                        _planners.pop(plan_id, None)
+                raise
+            save_planner(plan_id, planner)
+            return planner.result()
@@ -0,0 +1,122 @@
+"""
+多情景配水对比（枯水年/平水年/丰水年、不同作物种植结构等）
+
+需水、来水数据的解析与 灌片×旬 矩阵的组装只做一次，
+各情景只是在此基础上按比例扰动：
+    - 无可供水量约束时，所有情景一次性向量化计算，结果为 情景×灌片×旬 的张量
+    - 有可供水量约束时，滚动配水LP只建立一次，各情景只替换约束右端项后依次重新求解（以上一情景的解为初值）
+inflow_scale 缩放来水（降水量 mm），supply_scale 缩放可供水量（m³），与 RollingHorizonPlanner.what_if 一致
+"""
+import numpy as np
+
+from model3.rolling_plan import RollingHorizonPlanner, align_supply, build_requirement_matrix, requirement_m3
+
+
+def _scale_vector(value, size, name):
+    """情景扰动比例：数值或长度为 size 的列表"""
+    if value is None:
+        return np.ones(size)
+    if isinstance(value, (int, float)):
+        return np.full(size, float(value))
+    try:
+        value = np.array(value, dtype=float)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name}应为数值或长度为{size}的数值列表") from None
+    if value.shape != (size,):
+        raise ValueError(f"{name}长度应为{size}")
+    return value
+
+
+def _area_scale(value, area_names):
+    """需水扰动比例：数值，或 {灌片名称: 比例}（用于模拟作物种植结构变化）"""
+    if value is None or isinstance(value, (int, float)):
+        return np.full(len(area_names), 1.0 if value is None else float(value))
+    if not isinstance(value, dict):
+        raise ValueError("demand_scale应为数值或{灌片名称: 比例}")
+    unknown = [name for name in value if name not in area_names]
+    if unknown:
+        raise ValueError(f"demand_scale中的灌片不在需水数据中：{unknown}")
+    try:
+        return np.array([float(value.get(name, 1.0)) for name in area_names])
+    except (TypeError, ValueError):
+        raise ValueError("demand_scale的比例应为数值") from None
+
+
+def build_scenario_arrays(scenarios, area_names, dekads, demand, precip, supply):
+    """
+    组装所有情景的需水、来水、可供水数组
+    :param scenarios: 情景列表 list[dict]，每个情景可包含：
+                      name: 情景名称
+                      inflow_scale: 来水比例，数值或逐旬列表
+                      demand_scale: 需水比例，数值或 {灌片名称: 比例}
+                      supply_scale: 可供水量比例，数值或逐旬列表
+    :return: (情景名称, 需水 (S×A×T), 来水 (S×T), 可供水 (S×T) 或 None)
+    """
+    if not scenarios:
+        raise ValueError("scenarios不能为空，至少需要一个情景")
+    if supply is None and any(scenario.get("supply_scale") is not None for scenario in scenarios):
+        raise ValueError("supply_scale需要同时提供可供水量supply")
+    n_dekad = len(dekads)
+    names = []
+    demand_scales, inflow_scales, supply_scales = [], [], []
+    for i, scenario in enumerate(scenarios):
+        names.append(scenario.get("name", f"scenario_{i + 1}"))
+        demand_scales.append(_area_scale(scenario.get("demand_scale"), area_names))
+        inflow_scales.append(_scale_vector(scenario.get("inflow_scale"), n_dekad, "inflow_scale"))
+        supply_scales.append(_scale_vector(scenario.get("supply_scale"), n_dekad, "supply_scale"))
+
+    demand_s = demand[None, :, :] * np.array(demand_scales)[:, :, None]
+    precip_s = precip[None, :] * np.array(inflow_scales)
+    supply_s = None if supply is None else supply[None, :] * np.array(supply_scales)
+    return names, demand_s, precip_s, supply_s
+
+
+def _solve_constrained(area_names, dekads, demand_s, precip_s, area, supply_s, initial_storage, storage_capacity):
+    """可供水量约束下求解各情景：模型只建立一次，逐情景替换右端项后重新求解"""
+    planner = RollingHorizonPlanner(area_names, dekads, demand_s[0], precip_s[0], area, supply_s[0],
+                                    initial_storage, storage_capacity)
+    allocation = []
+    for s in range(len(demand_s)):
+        if s > 0:
+            planner.set_inputs(demand_s[s], precip_s[s], supply_s[s])
+        planner.solve()
+        allocation.append(planner.allocation_matrix())
+    allocation = np.array(allocation)
+    shortage = np.maximum(0, requirement_m3(demand_s, precip_s, area) - allocation)
+    return allocation, shortage
+
+
+def run_scenarios(water_demand_data, inflow_data, area_info, scenarios, supply=None, initial_storage=0.0,
+                  storage_capacity=None, percentiles=(10, 50, 90)):
+    """
+    批量计算多个情景下各灌片逐旬配水量
+    :param water_demand_data: 各个灌片需水数据 list[dict]
+    :param inflow_data: 预测来水数据 dict，包含 forecast_inflow
+    :param area_info: 灌区信息 dict
+    :param scenarios: 情景列表，见 build_scenario_arrays
+    :param supply: 可选 逐旬可供水量 list[dict]，[{"date": "2025-07-上旬", "supply": m³}]，缺省不限制供水
+    :param percentiles: 跨情景统计的百分位数
+    :return: 情景×灌片×旬 的配水量/缺水量张量，以及各百分位下 灌片×旬 的配水量 m³
+    """
+    area_names, dekads, demand, precip, area = build_requirement_matrix(water_demand_data, inflow_data, area_info)
+    supply_per_10days = None if supply is None else align_supply(supply, dekads, demand, precip, area)
+
+    names, demand_s, precip_s, supply_s = build_scenario_arrays(scenarios, area_names, dekads, demand, precip,
+                                                                supply_per_10days)
+    if supply_s is None:
+        allocation = requirement_m3(demand_s, precip_s, area)
+        shortage = np.zeros_like(allocation)
+    else:
+        allocation, shortage = _solve_constrained(area_names, dekads, demand_s, precip_s, area, supply_s,
+                                                  initial_storage, storage_capacity)
+
+    percentile_values = np.percentile(allocation, list(percentiles), axis=0)
+    return {
+        "scenarios": names,
+        "areas": area_names,
+        "dates": dekads,
+        "allocation": np.round(allocation, 1).tolist(),
+        "shortage": np.round(shortage, 1).tolist(),
+        "total": np.round(allocation.sum(axis=(1, 2)), 1).tolist(),
+        "percentiles": {f"p{p:g}": np.round(v, 1).tolist() for p, v in zip(percentiles, percentile_values)},
+    }
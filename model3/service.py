@@ -1,42 +1,167 @@
-import json
+from typing import Optional
 
-import yaml
 from fastapi import APIRouter
 
-from model3.implement import calculate_10days_allocation, calculate_monthly_allocation, calculate_yearly_allocation
 import utils.file_path_processor
+from utils.config import load_config
+from utils.profiling import ProfiledRoute
+from utils.responses import check_format, json_response
+from utils.shared_cache import reference_table
+
+# 配水模型（pandas、pulp 等）在接口函数内导入，服务启动时不加载，首次调用对应接口时才导入
 router_3 = APIRouter(
     prefix="/model3",
-    tags=["水资源配置模型"]
+    tags=["水资源配置模型"],
+    route_class=ProfiledRoute,
 )
 
 
 @router_3.post("/get_allocation_for_each_area")
-def get_allocation_for_each_area(water_requirement_json: list[dict], predict_inflow: dict):
+def get_allocation_for_each_area(water_requirement_json: list[dict], predict_inflow: dict, format: str = 'records'):
     """
     获取每个灌片的配水量
     \n:param predict_inflow: 预测的未来12个月每天的降雨量list[dict]
     \n:param water_requirement_json: 各个灌片需水的数据list[dict]
+    \n:param format: records（默认，每个灌片 [{"date", "allocation"}]）/
+    columns（按列 {"areas": [...], "per_10days": {"dates": [...], "allocation": 灌片×旬矩阵}, "monthly": ..., "yearly": ...}）
     \n 注意： 需水数据需要和来水数据的日期对应起来。没有来水默认来水为0
     \n:return: 旬、月、年度每个灌片所需的配水量
     """
+    from model3.implement import calculate_10days_allocation, calculate_allocation_columns, \
+        calculate_monthly_allocation, calculate_yearly_allocation
+
+    format_error = check_format(format)
+    if format_error:
+        return format_error
+
     # 确定好时间段， 以旬为单位~！！！！
     # 灌区信息： 灌区名称，ID，灌区需水量 mm， 灌区面积 ㎡， 灌区每日降水量 mm,
     # 最后根据计算每旬的得到每月，每年的配水量信息。
     # 灌区配水量 = （灌区需水量（mm） - 灌区来水量（mm）） * 灌区面积 = m³
-    with open("config/configuration_local.yaml", 'r', encoding='utf-8') as f:
-        config = yaml.safe_load(f)['model3']
-
-    area_info_file = config['area-info-file']
-    with open(area_info_file, 'r', encoding='utf-8') as f:
-        area = json.load(f)
+    area = _load_area_info()
+    if format == 'columns':
+        return json_response(calculate_allocation_columns(water_requirement_json, predict_inflow, area))
 
     # 计算来水
     allocations_10days = calculate_10days_allocation(water_requirement_json, predict_inflow, area)
     allocations_monthly = calculate_monthly_allocation(allocations_10days)
     allocations_yearly = calculate_yearly_allocation(allocations_10days)
-    return {
+    return json_response({
         "per_10days": allocations_10days,
         "monthly": allocations_monthly,
         "yearly": allocations_yearly,
-    }
+    })
+
+
+def _load_area_info():
+    return reference_table(load_config('model3')['area-info-file'])
+
+
+@router_3.post("/rolling_plan")
+def create_rolling_plan(water_requirement_json: list[dict], predict_inflow: dict,
+                        supply: Optional[list[dict]] = None, initial_storage: float = 0.0,
+                        storage_capacity: Optional[float] = None):
+    """
+    创建年度滚动配水计划（年度配置-动态调整抗旱应急）
+    \n:param water_requirement_json: 各个灌片需水的数据list[dict]，同 get_allocation_for_each_area
+    \n:param predict_inflow: 预测的未来12个月每天的降雨量，同 get_allocation_for_each_area
+    \n:param supply: 可选 逐旬可供水量list[dict]，[{"date": "2025-07-上旬", "supply": 可供水量 m³}]，缺省为逐旬净需水量
+    \n:param initial_storage: 初始蓄水量 m³
+    \n:param storage_capacity: 可选 蓄水能力上限 m³
+    \n:return: plan_id 以及逐旬每个灌片的配水量 m³
+    """
+    from model3.rolling_plan import create_planner
+
+    plan_id, planner = create_planner(water_requirement_json, predict_inflow, _load_area_info(), supply,
+                                      initial_storage, storage_capacity)
+    return {"plan_id": plan_id, **planner.result()}
+
+
+@router_3.get("/rolling_plan/{plan_id}")
+def get_rolling_plan(plan_id: str):
+    """
+    获取滚动配水计划的当前方案
+    \n:param plan_id: 计划ID
+    """
+    from model3.rolling_plan import get_planner
+
+    try:
+        planner = get_planner(plan_id)
+    except KeyError as e:
+        return {"error": str(e)}
+    with planner.lock:
+        return {"plan_id": plan_id, **planner.result()}
+
+
+@router_3.post("/rolling_plan/{plan_id}/observe")
+def observe_rolling_plan(plan_id: str, date: Optional[str] = None, precip: Optional[float] = None,
+                         supply: Optional[float] = None, demand: Optional[dict] = None,
+                         allocations: Optional[dict] = None):
+    """
+    录入一旬的实测来水/需水，提交该旬并重新优化剩余各旬，已提交的旬保持不变
+    \n:param plan_id: 计划ID
+    \n:param date: 旬，如"2025-07-上旬"，默认为下一个未提交的旬
+    \n:param precip: 该旬实测来水（降水）量 mm
+    \n:param supply: 该旬实测可供水量 m³
+    \n:param demand: 该旬各灌片实测需水量 mm，{灌片名称: 需水量}
+    \n:param allocations: 该旬各灌片实际配水量 m³，{灌片名称: 配水量}，默认按当前方案执行
+    \n:return: 更新后的方案
+    """
+    from model3.rolling_plan import observe_planner
+
+    try:
+        return {"plan_id": plan_id, **observe_planner(plan_id, date, precip, demand, supply, allocations)}
+    except (KeyError, ValueError, TimeoutError) as e:
+        return {"error": str(e)}
+
+
+@router_3.post("/rolling_plan/{plan_id}/what_if")
+def what_if_rolling_plan(plan_id: str, supply_scale: float = 1.0, demand_scale: float = 1.0,
+                         date: Optional[str] = None):
+    """
+    情景分析，如"下一旬可供水量减少20%"：supply_scale=0.8，不改变计划本身
+    \n:param plan_id: 计划ID
+    \n:param supply_scale: 该旬可供水量变化比例
+    \n:param demand_scale: 该旬需水量变化比例
+    \n:param date: 旬，默认为下一个未提交的旬
+    \n:return: 情景方案以及与当前方案相比各灌片逐旬配水量的变化 m³
+    """
+    from model3.rolling_plan import get_planner
+
+    try:
+        planner = get_planner(plan_id)
+        with planner.lock:
+            scenario, baseline = planner.what_if(supply_scale, demand_scale, date)
+    except (KeyError, ValueError) as e:
+        return {"error": str(e)}
+    changes = []
+    for s_area, b_area in zip(scenario["per_10days"], baseline["per_10days"]):
+        changes.append({
+            "area_name": s_area["area_name"],
+            "allocations": [{"date": s["date"], "change": round(s["allocation"] - b["allocation"], 1)}
+                            for s, b in zip(s_area["allocations"], b_area["allocations"])],
+        })
+    return {"plan_id": plan_id, "scenario": scenario, "changes": changes}
+
+
+@router_3.post("/allocation_scenarios")
+def allocation_scenarios(water_requirement_json: list[dict], predict_inflow: dict, scenarios: list[dict],
+                         supply: Optional[list[dict]] = None, initial_storage: float = 0.0,
+                         storage_capacity: Optional[float] = None, percentiles: Optional[list[float]] = None):
+    """
+    多情景配水对比，所有情景共用一次数据解析与矩阵组装
+    \n:param water_requirement_json: 各个灌片需水的数据list[dict]，同 get_allocation_for_each_area
+    \n:param predict_inflow: 预测的未来12个月每天的降雨量，同 get_allocation_for_each_area
+    \n:param scenarios: 情景列表list[dict]，每个情景：{"name": 名称, "inflow_scale": 来水（降水 mm）比例(数值或逐旬列表),
+    "demand_scale": 需水比例(数值或{灌片名称: 比例}), "supply_scale": 可供水量比例(数值或逐旬列表，需同时提供supply)}
+    \n:param supply: 可选 逐旬可供水量list[dict]，[{"date": "2025-07-上旬", "supply": 可供水量 m³}]，缺省不限制供水
+    \n:param percentiles: 跨情景统计的百分位数，默认[10, 50, 90]
+    \n:return: allocation/shortage 为 情景×灌片×旬 的配水量/缺水量 m³，percentiles 为各百分位下 灌片×旬 的配水量
+    """
+    from model3.scenario import run_scenarios
+
+    try:
+        return run_scenarios(water_requirement_json, predict_inflow, _load_area_info(), scenarios, supply,
+                             initial_storage, storage_capacity, tuple(percentiles or (10, 50, 90)))
+    except ValueError as e:
+        return {"error": str(e)}
@@ -2,31 +2,42 @@ import datetime as dt
 import json
 import math
 import os.path
+import time
 import zipfile
 import utils.file_path_processor
 
 import geopandas as gpd
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import yaml
-
-from model5.togeoJSON import generate_geoJSON
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.shutil import copy as rio_copy
+from rasterio.windows import Window
+
+from model5.forecast import calibrate, decay
+from model5.heatmap import DEFAULT_MAX_SIZE as DEFAULT_HEATMAP_SIZE, render_heatmap
+from model5.precip_index import get_precip_index
+from model5.result_cache import cached_file_sha256, get_result_cache, make_key
+from model5.togeoJSON import generate_geoJSON, get_classes, vector_options, write_features, write_flatgeobuf
+from utils.config import load_config
 from utils.hefeng_weather_predict import request_weather
+from utils.metrics import SpanTotals, span
 
-plt.rcParams['font.sans-serif'] = ['SimHei']
-plt.rcParams['axes.unicode_minus'] = False
-plt.rcParams.update({'font.size': 10})  # 设置字体大小
-
-from PIL import Image
 from osgeo import gdal
-from scipy.stats import linregress
-import seaborn as sns
 
-MINUS_RATE = 1.08
+TILE_SIZE = 1024  # 分块处理栅格时的分块大小（像元）
+SOIL_LINE_METHODS = ('exact', 'sample')  # 土壤线提取方法：全部像元 / 分层抽样近似
+SMI_ALGORITHM_VERSION = 5  # 修改SMMRS计算或矢量化逻辑时加1，使已缓存的结果失效
+COG_OPTIONS = {  # 土壤含水量tif输出为 Cloud-Optimized GeoTIFF 的默认创建选项，可在配置 model5.tiff-options 中覆盖
+    'blocksize': 256,
+    'compress': 'DEFLATE',
+    'predictor': 'YES',
+    'overview_resampling': 'AVERAGE',
+    'bigtiff': 'IF_SAFER',
+}
+SMI_NODATA = {'float32': -9999.0, 'uint8': 255}  # 各输出数据类型的nodata值
+SMI_UINT8_SCALE = 0.01  # SMMRS保留两位小数，uint8按0.01量化为0~100，不损失精度
 HEATMAP_DIR = "model5/heatmap/"
-with open("config/configuration_local.yaml", 'r', encoding='utf-8') as f:
-    config = yaml.safe_load(f)['model5']
 
 
 def create_example(is_write=False):
@@ -60,76 +71,111 @@ def init(data):
     return adjusted_data
 
 
-def adjust(data, true_points):
-    diff_num = len(true_points)
-    sum = 0
-    for i in true_points:
-        x = i['x']
-        y = i['y']
-        humidity = i['true_humidity']
-        sum += humidity
-        sum -= data[x][y]
-    ave = sum / diff_num
-    # for i in range(len(data)):
-    #     for j in range(len(data[0])):
-    #         data[i][j] -=ave
-    array = np.array(data)
-    array = array - ave
-    for i in true_points:
-        x = i['x']
-        y = i['y']
-        humidity = i['true_humidity']
-        array[x][y] = humidity
-    return array
+def adjust(data, true_points, method=None):
+    """
+    用实测点校正土壤含水量网格，见 model5.forecast.calibrate
+    :param data: 二维网格
+    :param true_points: [{"x": 行号, "y": 列号, "true_humidity": 实测值}]
+    :param method: 'offset' 整体平移 / 'idw' 反距离加权插值残差，默认取配置
+    :return: 校正后的数组
+    """
+    return calibrate(data, true_points, method)
 
 
 def predict(data, days):
-    array = np.array(data)
-    array = array - days * MINUS_RATE
-    for i in range(len(array)):
-        for j in range(len(array[i])):
-            if array[i][j] < 0:
-                array[i][j] = 0
-    return array
+    """
+    按天数衰减土壤含水量，负值截断为0
+    :return: 预报数组
+    """
+    return decay(data, days)
 
 
-def extract_soil_line(red_band, nir_band, num_bins=256):
+def _bin_index(red_flat, bin_edges):
     """
-    输入：
-        red_path: 红光波段文件路径 (GeoTIFF)
-        nir_path: 近红外波段文件路径 (GeoTIFF)
-        num_bins: 分组数量，默认为256
-    输出：
-        a, b: 拟合出的土壤线方程参数：NIR = a * Red + b
+    计算每个像元所在的 Red 分组，与 np.digitize(red_flat, bin_edges) - 1 的结果一致
+    按等间距直接换算分组号，再用分组边界修正浮点误差，避免对每个像元做二分查找
+    :return: 分组号，不在 [bin_edges[0], bin_edges[-1]) 内的像元为 num_bins
     """
+    num_bins = len(bin_edges) - 1
+    scale = float(num_bins / (bin_edges[-1] - bin_edges[0]))
+    idx = ((red_flat - float(bin_edges[0])) * scale).astype(np.intp)
+    np.clip(idx, 0, num_bins - 1, out=idx)
+    idx -= red_flat < bin_edges[idx]
+    idx += red_flat >= bin_edges[idx + 1]
+    idx[idx < 0] = num_bins
+    return idx
 
-    # 展平为一维数组，并过滤无效值
-    valid_mask = (red_band > 0) & (nir_band > 0)
-    red_flat = red_band[valid_mask]
-    nir_flat = nir_band[valid_mask]
 
-    # Step 3: 按 Red 分组，每组取 NIR 最小值作为初始土壤点
-    red_min, red_max = np.min(red_flat), np.max(red_flat)
-    bin_edges = np.linspace(red_min, red_max, num_bins + 1)
+def _bin_minima(red_flat, nir_flat, bin_edges):
+    """
+    按 Red 分组，每组取 NIR 最小值的点（同一组有多个最小值时取第一个）
+    :param red_flat: 有效像元的红光反射率（一维）
+    :param nir_flat: 有效像元的近红外反射率（一维）
+    :param bin_edges: 分组边界，长度为 num_bins + 1
+    :return: (每组最小点的Red, 每组最小点的NIR)，长度均为 num_bins，空组为 nan
+    """
+    num_bins = len(bin_edges) - 1
+    soil_points_x = np.full(num_bins, np.nan)
+    soil_points_y = np.full(num_bins, np.nan)
+    if red_flat.size == 0 or not bin_edges[-1] > bin_edges[0]:
+        return soil_points_x, soil_points_y
+
+    # 每组的 NIR 最小值（多出的一组收集范围外的像元），再找出每组第一个取到最小值的像元
+    idx = _bin_index(red_flat, bin_edges)
+    bin_min = np.full(num_bins + 1, np.inf, dtype=nir_flat.dtype)
+    np.minimum.at(bin_min, idx, nir_flat)
+    hit = np.flatnonzero(nir_flat == bin_min[idx])
+    bins, first = np.unique(idx[hit], return_index=True)
+    first = first[bins < num_bins]
+    bins = bins[bins < num_bins]
+    soil_points_x[bins] = red_flat[hit[first]]
+    soil_points_y[bins] = nir_flat[hit[first]]
+    return soil_points_x, soil_points_y
+
+
+def _line_from_sums(sums):
+    """
+    由累加和计算最小二乘直线，结果与 scipy.stats.linregress 一致
+    :param sums: [n, Σx, Σy, Σx², Σxy, Σy²]
+    :return: (slope, intercept, r²)
+    """
+    n, sx, sy, sxx, sxy, syy = sums
+    ssxm = sxx - sx * sx / n
+    ssxym = sxy - sx * sy / n
+    ssym = syy - sy * sy / n
+    slope = ssxym / ssxm
+    intercept = (sy - slope * sx) / n
+    if ssxm <= 0 or ssym <= 0:
+        return slope, intercept, 0.0
+    r = min(1.0, max(-1.0, ssxym / math.sqrt(ssxm * ssym)))
+    return slope, intercept, r ** 2
 
-    soil_points_x = []
-    soil_points_y = []
 
-    for i in range(num_bins):
-        in_bin = (red_flat >= bin_edges[i]) & (red_flat < bin_edges[i + 1])
-        if np.any(in_bin):
-            min_nir_idx = np.argmin(nir_flat[in_bin])
-            soil_points_x.append(red_flat[in_bin][min_nir_idx])
-            soil_points_y.append(nir_flat[in_bin][min_nir_idx])
+def _point_sums(x, y):
+    """每个点对累加和的贡献，列依次为 1, x, y, x², xy, y²"""
+    return np.column_stack((np.ones_like(x), x, y, x * x, x * y, y * y))
 
-    soil_points_x = np.array(soil_points_x)
-    soil_points_y = np.array(soil_points_y)
+
+def fit_soil_line(soil_points_x, soil_points_y):
+    """
+    由初始土壤点拟合土壤线：选择相关性最好的子集，再迭代剔除垂直偏差最大的点
+    子集与迭代过程中只增减累加和，不重复拟合、不复制数组
+    :param soil_points_x: 初始土壤点 Red
+    :param soil_points_y: 初始土壤点 NIR
+    :return: a, b: 土壤线方程参数：NIR = a * Red + b
+    """
+    soil_points_x = np.asarray(soil_points_x, dtype=np.float64)
+    soil_points_y = np.asarray(soil_points_y, dtype=np.float64)
 
     # Step 4: 分割子集并计算相关系数，选择最优子集
     n = len(soil_points_x)
     indices = np.argsort(soil_points_x)
-    sorted_x = soil_points_x[indices]
-    sorted_y = soil_points_y[indices]
+    # 减去均值后再累加，减小累加和相减时的舍入误差
+    x_mean, y_mean = soil_points_x.mean(), soil_points_y.mean()
+    sorted_x = soil_points_x[indices] - x_mean
+    sorted_y = soil_points_y[indices] - y_mean
+    point_sums = _point_sums(sorted_x, sorted_y)
+    prefix = np.vstack((np.zeros(6), np.cumsum(point_sums, axis=0)))
 
     subsets = [
         (0, int(0.75 * n)),  # 0% ~ 75%
@@ -141,109 +187,294 @@ def extract_soil_line(red_band, nir_band, num_bins=256):
     best_subset = None
 
     for start, end in subsets:
-        x_sub = sorted_x[start:end]
-        y_sub = sorted_y[start:end]
-        if len(x_sub) < 2:
+        if end - start < 2:
             continue
-        slope, intercept, r_value, p_value, std_err = linregress(x_sub, y_sub)
-        if r_value ** 2 > best_corr:
-            best_corr = r_value ** 2
-            best_subset = (x_sub, y_sub)
+        _, _, r2 = _line_from_sums(prefix[end] - prefix[start])
+        if r2 > best_corr:
+            best_corr = r2
+            best_subset = (start, end)
 
-    x_eff, y_eff = best_subset
+    start, end = best_subset
+    x_eff, y_eff = sorted_x[start:end], sorted_y[start:end]
 
     # Step 5: 迭代剔除垂直偏差最大的点
     max_iter = 100
     threshold = 0.95  # 相关系数阈值，也可自定义迭代次数
-    current_x, current_y = x_eff.copy(), y_eff.copy()
+    sums = prefix[end] - prefix[start]
+    residuals = np.empty_like(x_eff)
+    removed = np.zeros(len(x_eff), dtype=bool)
 
     for _ in range(max_iter):
-        slope, intercept, _, _, _ = linregress(current_x, current_y)
-        pred_y = slope * current_x + intercept
-        residuals = np.abs(pred_y - current_y)
+        slope, intercept, _ = _line_from_sums(sums)
+        np.abs(slope * x_eff + intercept - y_eff, out=residuals)
+        residuals[removed] = -1
         max_res_idx = np.argmax(residuals)
-        current_x = np.delete(current_x, max_res_idx)
-        current_y = np.delete(current_y, max_res_idx)
-        if len(current_x) < 2:
+        removed[max_res_idx] = True
+        sums = sums - point_sums[start + max_res_idx]
+        if sums[0] < 2:
             break
-        slope_new, intercept_new, r_new, _, _ = linregress(current_x, current_y)
-        if r_new ** 2 < threshold:
+        _, _, r2_new = _line_from_sums(sums)
+        if r2_new < threshold:
             break
 
-    final_x, final_y = current_x, current_y
-
-    # Step 6: 最终拟合土壤线
-    slope_final, intercept_final, r_final, _, _ = linregress(final_x, final_y)
+    # Step 6: 最终拟合土壤线（还原中心化前的截距）
+    slope_final, intercept_final, r2_final = _line_from_sums(sums)
+    intercept_final = intercept_final + y_mean - slope_final * x_mean
     print(f"最终拟合土壤线方程：NIR = {slope_final:.4f} * Red + {intercept_final:.4f}")
-    print(f"相关系数 R² = {r_final ** 2:.4f}")
-
-    # # 可视化最终结果
-    # x_plot = np.array([red_min, red_max])
-    # y_plot = slope_final * x_plot + intercept_final
-    #
-    # plt.plot(x_plot, y_plot, 'r-', linewidth=2, label=f'Soil Line\nNIR={slope_final:.2f}*Red+{intercept_final:.4f}')
-    # plt.scatter(final_x, final_y, s=20, color='green', label='Final Soil Points')
-    # plt.xlabel('Red Reflectance')
-    # plt.ylabel('NIR Reflectance')
-    # plt.title('Soil Line Extraction in NIR-Red Feature Space')
-    # plt.legend()
-    # plt.grid(True)
-    # plt.show()
+    print(f"相关系数 R² = {r2_final:.4f}")
 
     return slope_final, intercept_final
 
 
+def extract_soil_line(red_band, nir_band, num_bins=256):
+    """
+    输入：
+        red_band: 红光波段反射率数组
+        nir_band: 近红外波段反射率数组
+        num_bins: 分组数量，默认为256
+    输出：
+        a, b: 拟合出的土壤线方程参数：NIR = a * Red + b
+    """
+
+    # 展平为一维数组，并过滤无效值
+    valid_mask = (red_band > 0) & (nir_band > 0)
+    red_flat = red_band[valid_mask]
+    nir_flat = nir_band[valid_mask]
+
+    # Step 3: 按 Red 分组，每组取 NIR 最小值作为初始土壤点
+    red_min, red_max = np.min(red_flat), np.max(red_flat)
+    bin_edges = np.linspace(red_min, red_max, num_bins + 1)
+    soil_points_x, soil_points_y = _bin_minima(red_flat, nir_flat, bin_edges)
+    found = ~np.isnan(soil_points_x)
+
+    return fit_soil_line(soil_points_x[found], soil_points_y[found])
+
+
+def _iter_windows(width, height, tile_size):
+    """按行优先顺序生成分块窗口"""
+    for row_off in range(0, height, tile_size):
+        for col_off in range(0, width, tile_size):
+            yield Window(col_off, row_off, min(tile_size, width - col_off), min(tile_size, height - row_off))
+
+
+def _read_reflectance(src, window, sample_step=1):
+    """
+    读取一个分块的反射率，float32
+    :param sample_step: 抽样间隔，大于1时每 sample_step×sample_step 个像元取一个（最近邻），有金字塔时直接读取金字塔
+    """
+    if sample_step <= 1:
+        return src.read(1, window=window, out_dtype=np.float32) * np.float32(10e-4)
+    out_shape = (max(1, math.ceil(window.height / sample_step)), max(1, math.ceil(window.width / sample_step)))
+    return src.read(1, window=window, out_shape=out_shape, out_dtype=np.float32,
+                    resampling=Resampling.nearest) * np.float32(10e-4)
+
+
+def soil_line_tiled(red_src, nir_src, num_bins=256, tile_size=TILE_SIZE):
+    """
+    分块统计提取土壤线，内存占用只与分块大小有关
+    先分块统计有效像元 Red 的最小/最大值确定分组边界，再分块求每组 NIR 最小点并合并
+    :param red_src: rasterio 打开的红波数据集
+    :param nir_src: rasterio 打开的近红外数据集
+    :return: a, b: 土壤线方程参数：NIR = a * Red + b
+    """
+    width, height = red_src.width, red_src.height
+    red_min, red_max = np.inf, -np.inf
+    for window in _iter_windows(width, height, tile_size):
+        red = _read_reflectance(red_src, window)
+        nir = _read_reflectance(nir_src, window)
+        red_valid = red[(red > 0) & (nir > 0)]
+        if red_valid.size > 0:
+            red_min = min(red_min, float(red_valid.min()))
+            red_max = max(red_max, float(red_valid.max()))
+    if not np.isfinite(red_min):
+        raise ValueError("影像中没有有效像元")
+
+    bin_edges = np.linspace(red_min, red_max, num_bins + 1)
+    soil_points_x = np.full(num_bins, np.nan)
+    soil_points_y = np.full(num_bins, np.inf)
+    for window in _iter_windows(width, height, tile_size):
+        red = _read_reflectance(red_src, window)
+        nir = _read_reflectance(nir_src, window)
+        valid_mask = (red > 0) & (nir > 0)
+        block_x, block_y = _bin_minima(red[valid_mask], nir[valid_mask], bin_edges)
+        better = block_y < soil_points_y  # nan 比较结果为 False，空组不会覆盖
+        soil_points_x[better] = block_x[better]
+        soil_points_y[better] = block_y[better]
+
+    found = ~np.isnan(soil_points_x)
+    return fit_soil_line(soil_points_x[found], soil_points_y[found])
+
+
+def soil_line_sampled(red_src, nir_src, sample_step, num_bins=256, tile_size=TILE_SIZE):
+    """
+    按规则网格分层抽样提取土壤线（近似），只读取 1/sample_step² 的像元
+    抽样后的像元量较小，一次读完后直接按整幅影像的方法拟合
+    :param sample_step: 抽样间隔（像元）
+    :return: a, b: 土壤线方程参数：NIR = a * Red + b
+    """
+    red_samples, nir_samples = [], []
+    for window in _iter_windows(red_src.width, red_src.height, tile_size):
+        red = _read_reflectance(red_src, window, sample_step)
+        nir = _read_reflectance(nir_src, window, sample_step)
+        valid_mask = (red > 0) & (nir > 0)
+        red_samples.append(red[valid_mask])
+        nir_samples.append(nir[valid_mask])
+    red_flat = np.concatenate(red_samples)
+    if red_flat.size == 0:
+        raise ValueError("影像中没有有效像元")
+    return extract_soil_line(red_flat, np.concatenate(nir_samples), num_bins)
+
+
+def estimate_soil_line(red_src, nir_src, method='exact', sample_step=None, compare=False, tile_size=TILE_SIZE):
+    """
+    按指定方法提取土壤线
+    :param method: 'exact' 使用全部有效像元；'sample' 分层抽样近似，速度约提高 sample_step² 倍
+    :param sample_step: 抽样间隔，默认取配置 model5.soil-line-sample-step
+    :param compare: 近似方法下是否同时计算精确土壤线，给出斜率偏差
+    :return: 土壤线信息 {"method", "slope", "intercept", "seconds", ...}，
+             compare 时包含 exact_slope、slope_deviation（相对偏差）
+    """
+    if method not in SOIL_LINE_METHODS:
+        raise ValueError(f"未知土壤线提取方法{method}，可选：{list(SOIL_LINE_METHODS)}")
+    start = time.perf_counter()
+    if method == 'sample':
+        sample_step = int(sample_step or load_config('model5').get('soil-line-sample-step', 4))
+        k, b = soil_line_sampled(red_src, nir_src, sample_step, tile_size=tile_size)
+    else:
+        k, b = soil_line_tiled(red_src, nir_src, tile_size=tile_size)
+    soil_line = {"method": method, "slope": float(k), "intercept": float(b),
+                 "seconds": round(time.perf_counter() - start, 3)}
+    if method == 'sample':
+        soil_line["sample_step"] = sample_step
+        if compare:
+            start = time.perf_counter()
+            exact_k, exact_b = soil_line_tiled(red_src, nir_src, tile_size=tile_size)
+            soil_line["exact_seconds"] = round(time.perf_counter() - start, 3)
+            soil_line["exact_slope"] = float(exact_k)
+            soil_line["exact_intercept"] = float(exact_b)
+            soil_line["slope_deviation"] = float(abs(k - exact_k) / abs(exact_k))
+    return soil_line
+
+
+def tiff_output_options():
+    """
+    土壤含水量tif的输出数据类型和COG创建选项
+    :return: (数据类型 'float32' / 'uint8', 创建选项dict)，取配置 model5.tiff-dtype、model5.tiff-options
+    """
+    config = load_config('model5')
+    dtype = config.get('tiff-dtype', 'float32')
+    if dtype not in SMI_NODATA:
+        raise ValueError(f"tiff-dtype可选：{list(SMI_NODATA)}")
+    options = dict(COG_OPTIONS)
+    options.update({key.lower(): value for key, value in (config.get('tiff-options') or {}).items()})
+    return dtype, options
+
+
+def encode_smi(smi, valid_mask, dtype):
+    """
+    按输出数据类型编码土壤含水量，无效像元写为nodata
+    :param smi: 土壤含水量 0~1
+    :param valid_mask: 有效像元掩膜
+    :param dtype: 'float32' / 'uint8'，uint8 按 SMI_UINT8_SCALE 量化
+    :return: 编码后的数组
+    """
+    if dtype == 'uint8':
+        encoded = np.round(np.nan_to_num(smi) / SMI_UINT8_SCALE).astype(np.uint8)
+    else:
+        encoded = np.asarray(smi, dtype=np.float32).copy()
+    encoded[~valid_mask] = SMI_NODATA[dtype]
+    return encoded
+
+
+def nir_red_to_smi_tiled(red_band_file, nir_band_file, output_file, tile_size=TILE_SIZE, soil_line_method='exact',
+                         sample_step=None, compare=False):
+    """
+    分块计算土壤含水量并直接写入 float32 GeoTIFF，不把整幅影像读入内存
+    :param red_band_file: 红波tif文件路径
+    :param nir_band_file: 近红外波tif文件路径
+    :param output_file: 输出tif文件路径
+    :param tile_size: 分块大小（像元）
+    :param soil_line_method: 土壤线提取方法，见 estimate_soil_line
+    :return: (输出tif文件路径, 土壤线信息)
+    """
+    with rasterio.open(red_band_file) as red_src, rasterio.open(nir_band_file) as nir_src:
+        with span('soil_line'):
+            soil_line = estimate_soil_line(red_src, nir_src, soil_line_method, sample_step, compare, tile_size)
+        k, b = soil_line["slope"], soil_line["intercept"]
+        print(f'土壤线：NIR={k:.2f}RED+{b:.4f}')
+
+        dtype, options = tiff_output_options()
+        profile = {
+            'driver': 'GTiff',
+            'width': red_src.width,
+            'height': red_src.height,
+            'count': 1,
+            'dtype': dtype,
+            'nodata': SMI_NODATA[dtype],
+            'crs': red_src.crs,
+            'transform': red_src.transform,
+            'tiled': True,
+            'blockxsize': 256,
+            'blockysize': 256,
+        }
+        # 先分块写入临时GTiff，再转换为带金字塔的COG（COG驱动不支持逐块写入）
+        temp_file = output_file + '.part.tif'
+        totals = SpanTotals()
+        try:
+            with rasterio.open(temp_file, 'w', **profile) as dst:
+                if dtype == 'uint8':
+                    dst.scales = (SMI_UINT8_SCALE,)
+                    dst.offsets = (0.0,)
+                for window in _iter_windows(red_src.width, red_src.height, tile_size):
+                    with totals.span('raster_read'):
+                        red = _read_reflectance(red_src, window)
+                        nir = _read_reflectance(nir_src, window)
+                    with totals.span('raster_compute'):
+                        valid_mask = (red > 0) & (nir > 0)
+                        encoded = encode_smi(smmrs(red, nir, k), valid_mask, dtype)
+                    with totals.span('raster_write'):
+                        dst.write(encoded, 1, window=window)
+            with totals.span('raster_write'):
+                rio_copy(temp_file, output_file, driver='COG', **options)
+        finally:
+            totals.record()
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+    return output_file, soil_line
+
+
 def nir_red_to_smi(red_band_file, nir_band_file):
     """
     利用红波和近红外波对土壤含水量反射率变化率的不同计算土壤含水量
+    整幅影像读入内存，大影像请使用 nir_red_to_smi_tiled
     :param red_band_file: 红波tif文件路径
     :param nir_band_file: 近红外波tif文件路径
     :return: 计算完土壤含水量的二维数组
     """
-    height, width = Image.open(nir_band_file).size
     # 加载 Red 和 NIR 波段
-    red_file = gdal.Open(red_band_file)
-    red_band = red_file.GetRasterBand(1)
-    red = red_band.ReadAsArray().astype(float) * 10e-4
-    nir_file = gdal.Open(nir_band_file)
-    nir_band = nir_file.GetRasterBand(1)
-    nir = nir_band.ReadAsArray().astype(float) * 10e-4
-    example = gdal.Open(red_band_file, gdal.GA_ReadOnly)
-    width = example.RasterXSize
-    height = example.RasterYSize
-    bands = example.RasterCount
-
-    geotransform = example.GetGeoTransform()
-    projection = example.GetProjection()
+    with span('raster_read'):
+        red_file = gdal.Open(red_band_file, gdal.GA_ReadOnly)
+        red_band = red_file.GetRasterBand(1)
+        red = red_band.ReadAsArray().astype(np.float32) * np.float32(10e-4)
+        nir_file = gdal.Open(nir_band_file, gdal.GA_ReadOnly)
+        nir_band = nir_file.GetRasterBand(1)
+        nir = nir_band.ReadAsArray().astype(np.float32) * np.float32(10e-4)
 
     data_info = {
-        'height': height,
-        'width': width,
-        'bands': bands,
-        'geotransform': geotransform,
-        'projection': projection,
+        'height': red_file.RasterYSize,
+        'width': red_file.RasterXSize,
+        'bands': red_file.RasterCount,
+        'geotransform': red_file.GetGeoTransform(),
+        'projection': red_file.GetProjection(),
     }
 
-    # 掩膜处理：去除无效值（如云、水体）
-    mask = (red > 0) & (nir > 0)
-    red_masked = red[mask]
-    nir_masked = nir[mask]
-
-    # 绘制散点图
-    # plt.scatter(red_masked, nir_masked, s=1, c='gray', alpha=0.5)
-
     # 土壤线
-    x = np.linspace(0, 0.5, 400)
-    k, b = extract_soil_line(red, nir)
-    # plt.plot(x, x * k + b, 'r-', label='soil Edge')
+    with span('soil_line'):
+        k, b = extract_soil_line(red, nir)
     print(f'土壤线：NIR={k:.2f}RED+{b:.4f}')
 
-    smi = np.zeros_like(red)
-    # for i in range(width):
-    #     for j in range(height):
-    #         smi[i, j] = smmrs(red_masked[i * width + j], nir_masked[i * width + j], k)
-    smi = smmrs(red, nir, k)
-    # plt.scatter(red_masked, smi, c='red', alpha=0.5)
+    with span('raster_compute'):
+        smi = smmrs(red, nir, k)
     return smi, data_info
 
 
@@ -288,48 +519,208 @@ def normalized(data):
     return normalized
 
 
-def plot_heatmap(smi_2d, filename="test"):
+def plot_heatmap(smi_2d, filename="test", max_size=DEFAULT_HEATMAP_SIZE):
     """
-    绘制土壤含水量热度图
+    绘制土壤含水量热度图，块均值降采样后直接着色编码为PNG，见 model5.heatmap
     :param filename: 希望保存的文件名
     :param smi_2d: 土壤含水量2d数组
+    :param max_size: 图片长边的最大像素数
     :return: 文件路径
     """
-    plt.figure()
+    png = render_heatmap(smi_2d, max_size)
+    os.makedirs(HEATMAP_DIR, exist_ok=True)
+    filename = f"{HEATMAP_DIR}{filename}.png"
+    with open(filename, 'wb') as f:
+        f.write(png)
+    return filename
 
-    # 使用 seaborn 的 heatmap 函数进行绘图
-    sns.heatmap(smi_2d, annot=False, cmap='viridis', cbar=True)
 
-    plt.title(f"{filename}含水量分布图")
-    plt.tight_layout()
-    filename = f"../{HEATMAP_DIR}{filename}.png"
-    plt.savefig(filename)
-    # plt.show()
-    return filename
+def smi_cache_key(red_tif_dir, nir_tif_dir, soil_line_method='exact', sample_step=None):
+    """
+    土壤含水量tif的缓存键，由输入影像内容、算法版本、土壤线提取方法和输出数据类型决定
+    :return: 缓存键
+    """
+    return make_key(cached_file_sha256(red_tif_dir), cached_file_sha256(nir_tif_dir), SMI_ALGORITHM_VERSION,
+                    soil_line_method, sample_step, tiff_output_options()[0])
 
 
-def get_dynamic_smi(file_list):
+def geojson_cache_key(smi_key, options):
     """
+    geojson的缓存键，由土壤含水量tif的缓存键、分级阈值和矢量化参数决定
+    :return: 缓存键
+    """
+    return make_key(smi_key, get_classes(options.get('region')), options)
 
-    :param file_list:
-    :return: 存放geojson文件夹路径
+
+def _soil_line_options(soil_line_method=None, sample_step=None):
+    """补全土壤线提取方法的默认值，精确方法不使用抽样间隔"""
+    config = load_config('model5')
+    soil_line_method = soil_line_method or config.get('soil-line-method', 'exact')
+    if soil_line_method != 'sample':
+        return soil_line_method, None
+    return soil_line_method, int(sample_step or config.get('soil-line-sample-step', 4))
+
+
+def resolve_smi_key(red_tif_dir, nir_tif_dir, soil_line_method=None, sample_step=None):
+    """
+    按默认参数补全后的土壤含水量tif缓存键，用于 /model5/tiles 等按键访问缓存结果的接口
+    :return: 缓存键
     """
-    geojson_save_dir = config['geojson-save-dir']
+    soil_line_method, sample_step = _soil_line_options(soil_line_method, sample_step)
+    return smi_cache_key(red_tif_dir, nir_tif_dir, soil_line_method, sample_step)
+
+
+def _usable(meta, soil_line_method, compare):
+    """缓存的土壤线信息是否满足请求（要求对比精确方法时需已有斜率偏差）"""
+    return meta is not None and not (compare and soil_line_method == 'sample'
+                                     and 'slope_deviation' not in meta['soil_line'])
+
+
+def lookup_smi_geojson(red_tif_dir, nir_tif_dir, soil_line_method=None, sample_step=None, compare=False,
+                       vector=None):
+    """
+    查询缓存中已有的结果，不做任何计算
+    :return: (geojson文件路径, 土壤线信息)，未命中返回 None
+    """
+    soil_line_method, sample_step = _soil_line_options(soil_line_method, sample_step)
+    cache = get_result_cache()
+    smi_key = smi_cache_key(red_tif_dir, nir_tif_dir, soil_line_method, sample_step)
+    key = geojson_cache_key(smi_key, vector_options(**(vector or {})))
+    meta = cache.get(key, ('.geojson',))
+    if not _usable(meta, soil_line_method, compare):
+        return None
+    return cache.path(key, '.geojson'), meta['soil_line']
 
-    folder_name = dt.datetime.now().strftime("%Y%m%d%H%M%S")  # 存放到这个文件夹
-    os.makedirs(os.path.join(geojson_save_dir, folder_name), exist_ok=True)
-    for i in file_list:
-        red_file = i["red_dir"]
-        nir_file = i["nir_dir"]
-        smi, data_info = nir_red_to_smi(red_file, nir_file)
 
-        tiff_path = get_file_name(red_file)
-        write_tiff_file(smi, data_info, tiff_path)  # 写入
+def get_smi_tif(red_tif_dir, nir_tif_dir, soil_line_method=None, sample_step=None, compare=False):
+    """
+    计算遥感图像的土壤含水量tif，同一组影像直接返回缓存中的tif
+    :param red_tif_dir: 红波tif路径
+    :param nir_tif_dir: 近红外tif路径
+    :param soil_line_method: 土壤线提取方法 'exact' / 'sample'，默认取配置 model5.soil-line-method
+    :param sample_step: 抽样间隔，仅 'sample' 方法有效
+    :param compare: 是否同时计算精确土壤线并给出斜率偏差
+    :return: (缓存中的tif路径, 土壤线信息)
+    """
+    soil_line_method, sample_step = _soil_line_options(soil_line_method, sample_step)
+    cache = get_result_cache()
+    smi_key = smi_cache_key(red_tif_dir, nir_tif_dir, soil_line_method, sample_step)
+    smi_meta = cache.get(smi_key, ('.tif',))
+    if _usable(smi_meta, soil_line_method, compare):
+        return cache.path(smi_key, '.tif'), smi_meta['soil_line']
+
+    tiff_path = cache.temp_path('.tif')
+    try:
+        _, soil_line = nir_red_to_smi_tiled(red_tif_dir, nir_tif_dir, tiff_path, soil_line_method=soil_line_method,
+                                            sample_step=sample_step, compare=compare)  # 分块计算并写入
+        smi_tif = cache.put(smi_key, {'.tif': tiff_path},
+                            {"red": red_tif_dir, "nir": nir_tif_dir, "soil_line": soil_line})['.tif']
+    finally:
+        if os.path.exists(tiff_path):
+            os.remove(tiff_path)
+    return smi_tif, soil_line
+
+
+def get_smi_geojson(red_tif_dir, nir_tif_dir, soil_line_method=None, sample_step=None, compare=False, vector=None):
+    """
+    计算遥感图像的土壤含水量并矢量化为geojson
+    土壤含水量tif与geojson分别缓存，同一组影像只改变矢量化参数时不再重新计算tif
+    :param red_tif_dir: 红波tif路径
+    :param nir_tif_dir: 近红外tif路径
+    :param soil_line_method: 土壤线提取方法 'exact' / 'sample'，默认取配置 model5.soil-line-method
+    :param sample_step: 抽样间隔，仅 'sample' 方法有效
+    :param compare: 是否同时计算精确土壤线并给出斜率偏差
+    :param vector: 矢量化参数 {"sieve_pixels", "dissolve", "simplify_tolerance", "region"}，见 vector_options
+    :return: (是否成功, geojson文件路径, 土壤线信息)
+    """
+    hit = lookup_smi_geojson(red_tif_dir, nir_tif_dir, soil_line_method, sample_step, compare, vector)
+    if hit is not None:
+        return True, hit[0], hit[1]
+
+    soil_line_method, sample_step = _soil_line_options(soil_line_method, sample_step)
+    options = vector_options(**(vector or {}))
+    smi_tif, soil_line = get_smi_tif(red_tif_dir, nir_tif_dir, soil_line_method, sample_step, compare)
+
+    cache = get_result_cache()
+    key = geojson_cache_key(smi_cache_key(red_tif_dir, nir_tif_dir, soil_line_method, sample_step), options)
+    geojson_path = cache.temp_path('.geojson')
+    try:
+        success = generate_geoJSON(smi_tif, geojson_path, **options)
+        if not success:
+            return False, geojson_path, soil_line
+        paths = cache.put(key, {'.geojson': geojson_path},
+                          {"red": red_tif_dir, "nir": nir_tif_dir, "soil_line": soil_line, "vector": options})
+    finally:
+        if os.path.exists(geojson_path):
+            os.remove(geojson_path)
+    return True, paths['.geojson'], soil_line
+
+
+def prepare_smi_vector(red_tif_dir, nir_tif_dir, fmt='ndjson', soil_line_method=None, sample_step=None,
+                       sieve_pixels=None, region=None):
+    """
+    计算（或复用）土壤含水量tif并查询要素文件缓存，需在栅格计算进程池中调用
+    :param fmt: ndjson（每行一个GeoJSON要素）/ geojson（FeatureCollection）/ fgb（带空间索引的FlatGeobuf）
+    :param region: 干旱分级所属区域，见 togeoJSON.get_classes
+    :return: 矢量化参数dict，其中 path 为已缓存的要素文件路径，未命中时为 None，交给 write_smi_vector 生成
+    """
+    soil_line_method, sample_step = _soil_line_options(soil_line_method, sample_step)
+    sieve_pixels = vector_options(sieve_pixels=sieve_pixels)['sieve_pixels']
+    smi_tif, soil_line = get_smi_tif(red_tif_dir, nir_tif_dir, soil_line_method, sample_step)
+
+    cache = get_result_cache()
+    suffix = '.' + fmt
+    smi_key = smi_cache_key(red_tif_dir, nir_tif_dir, soil_line_method, sample_step)
+    key = geojson_cache_key(smi_key, {"format": fmt, "sieve_pixels": sieve_pixels, "region": region})
+    return {
+        "red": red_tif_dir,
+        "nir": nir_tif_dir,
+        "fmt": fmt,
+        "sieve_pixels": sieve_pixels,
+        "region": region,
+        "smi_tif": smi_tif,
+        "soil_line": soil_line,
+        "smi_key": smi_key,
+        "key": key,
+        "path": cache.path(key, suffix) if cache.get(key, (suffix,)) is not None else None,
+    }
 
-        output_geojson_path = geojson_save_dir + folder_name + '/' + tiff_path.split('/')[-1].replace('.tif',
-                                                                                                      '.geojson')
-        success = generate_geoJSON(tiff_path, output_geojson_path)
-    return geojson_save_dir + folder_name
+
+def write_smi_vector(vector, out_path):
+    """
+    重分类、去碎斑并矢量化，完成后把要素文件移入结果缓存，需在栅格计算进程池中调用
+    ndjson / geojson 的要素边生成边写入 out_path，调用方可在写入过程中读取该文件实现流式输出
+    :param vector: prepare_smi_vector 的返回值
+    :param out_path: 结果缓存的临时文件路径，见 ResultCache.temp_path
+    :return: 缓存中的要素文件路径
+    """
+    suffix = '.' + vector["fmt"]
+    try:
+        if vector["fmt"] == 'fgb':
+            write_flatgeobuf(vector["smi_tif"], out_path, vector["sieve_pixels"], vector["region"])
+        else:
+            write_features(vector["smi_tif"], out_path, vector["fmt"], vector["sieve_pixels"], vector["region"])
+        paths = get_result_cache().put(vector["key"], {suffix: out_path},
+                                       {"red": vector["red"], "nir": vector["nir"], "soil_line": vector["soil_line"]})
+    finally:
+        if os.path.exists(out_path):
+            os.remove(out_path)
+    return paths[suffix]
+
+
+def get_dynamic_smi(file_list, progress=None):
+    """
+    多期影像土壤含水量，同一组影像的结果直接复用
+    在任务队列的工作进程中执行，各景在本进程中逐个处理，不再嵌套创建进程池（任务之间已由任务队列并行）
+    :param file_list: [{"red_dir": "", "nir_dir": ""}]
+    :param progress: 可选 进度回调 progress(fraction, message)
+    :return: 存放geojson文件夹路径
+    """
+    from model5.pipeline import collect_scenes  # pipeline 依赖本模块，在此处导入
+
+    geojson_save_dir = load_config('model5')['geojson-save-dir']
+    folder_name = dt.datetime.now().strftime("%Y%m%d%H%M%S")  # 存放到这个文件夹
+    return collect_scenes(file_list, geojson_save_dir + folder_name, progress=progress)
 
 
 def get_continuous_dry_day() -> dict:
@@ -347,79 +738,72 @@ def get_continuous_dry_day() -> dict:
     }
 
 
-def get_rain_avg_lap_rate(span: str, present_inflow: float, date: dt.datetime, history_file_name: str = None):
+def get_rain_avg_lap_rate(span: str, present_inflow: float, date: dt.datetime, history_file_name: str = None,
+                          baseline: str = 'last_year'):
+    """
+    降雨距平：当前时段降雨量与历史同期降雨量比较
+    :param span: 'year' 年初至今 / 'month' 月初至今 / 'xun' 当旬
+    :param present_inflow: 当前时段降雨量（毫米）
+    :param date: 日期
+    :param history_file_name: 历史数据目录或CSV，默认取配置 model5.history-data-dir
+    :param baseline: 'last_year' 与去年同期比较 / 'mean' 与多年同期平均比较
+    :return: 描述文字
+    """
     present_inflow = float(present_inflow)
-    year = date.year
-    month = date.month
-    with open("config/configuration_local.yaml", 'r', encoding='utf-8') as f:
-        config = yaml.safe_load(f)['model5']
-    data_dir = config['history-data-dir']
-    if history_file_name is None:
-        history_file_name = data_dir
-    with open(history_file_name, 'r', encoding='utf-8') as f:
-        df = pd.read_csv(f)
-    if span == "year":
-        rows = df[df["DATE"].map(
-            lambda x: dt.datetime.strptime(x, "%Y/%m/%d") < dt.datetime(year - 1, date.month, date.day)
-        )]
-        all_precip_list = list(rows["PRCP"])
-        valid_precip_list = [i * 25.4 if abs(i - 99.99) > 0.1 else 0 for i in all_precip_list]
-        all_precip = round(sum(valid_precip_list), 1)
-
-    elif span == "month":
-        rows = df[df["DATE"].map(
-            lambda x: dt.datetime.strptime(x, "%Y/%m/%d") < dt.datetime(year - 1, month, date.day)
-                      and dt.datetime.strptime(x, "%Y/%m/%d").month == date.month
-        )]
-        all_precip_list = list(rows["PRCP"])
-        valid_precip_list = [i * 25.4 if abs(i - 99.99) > 0.1 else 0 for i in all_precip_list]
-        all_precip = round(sum(valid_precip_list), 1)
+    index = get_precip_index(history_file_name)
+    if baseline == 'mean':
+        all_precip = index.climatology(span, date)
+        label = "多年同期平均"
     else:
-        # 先计算处于哪一旬
-        day = date.day
-        flag = 1
-        if 1 <= day < 11:
-            flag = 0
-        elif 11 <= day < 21:
-            flag = 1
-        else:
-            flag = 2
-        if flag != 2:
-            rows = df[df["DATE"].map(
-                lambda x: dt.datetime(year - 1, month, 10 * flag + 1) <=
-                          dt.datetime.strptime(x, "%Y/%m/%d") <
-                          dt.datetime(year - 1, month, (flag + 1) * 10 + 1))]
-        else:
-            rows = df[df["DATE"].map(
-                lambda x: dt.datetime.strptime(x, "%Y/%m/%d") >= dt.datetime(year - 1, month, 21)
-            )]
-        all_precip_list = list(rows["PRCP"])
-        valid_precip_list = [i * 25.4 if abs(i - 999.9) > 0.1 else 0 for i in all_precip_list]
-        all_precip = round(sum(valid_precip_list), 1)
+        all_precip = index.period_total(span, date, date.year - 1)
+        label = "去年同比"
+    if not all_precip:
+        return f"缺少{label}降雨数据，无法计算"
+    all_precip = round(all_precip, 1)
 
     rate = round((present_inflow - all_precip) / all_precip, 3)
     if rate < 0:
-        res = f"相比去年同比下降{round(abs(rate) * 100, 1)} %"
+        res = f"相比{label}下降{round(abs(rate) * 100, 1)} %"
     else:
-        res = f"相比去年同比上升{round(abs(rate) * 100, 1)} %"
+        res = f"相比{label}上升{round(abs(rate) * 100, 1)} %"
 
     return res
 
 
-def write_tiff_file(smi_list, data_info, filename):
+@span('raster_write')
+def write_tiff_file(smi_list, data_info, filename, dtype=None, options=None):
+    """
+    把二维数组写为 Cloud-Optimized GeoTIFF（分块、压缩、内部金字塔），网页地图和下载时可按需读取
+    :param smi_list: 二维数组，NaN 写为nodata
+    :param data_info: nir_red_to_smi 返回的影像信息（宽、高、geotransform、projection）
+    :param filename: 输出tif路径
+    :param dtype: 'float32' / 'uint8'（按 SMI_UINT8_SCALE 量化并写入scale/offset），默认取配置 model5.tiff-dtype
+    :param options: COG创建选项，如 {"compress": "ZSTD", "level": 9}，默认取配置 model5.tiff-options
+    :return: 输出tif路径
+    """
     width = data_info['width']
     height = data_info['height']
     geotransform = data_info['geotransform']
     projection = data_info['projection']
+    default_dtype, default_options = tiff_output_options()
+    dtype = dtype or default_dtype
+    options = default_options if options is None else {**COG_OPTIONS, **options}
 
-    driver = gdal.GetDriverByName('GTiff')
-    dataset = driver.Create(filename, width, height, 1, gdal.GDT_Float32)
+    smi = np.asarray(smi_list, dtype=np.float32)
+    gdal_type = gdal.GDT_Byte if dtype == 'uint8' else gdal.GDT_Float32
+    # COG驱动只能由已有数据集复制生成，先在内存中建立数据集
+    dataset = gdal.GetDriverByName('MEM').Create('', width, height, 1, gdal_type)
 
     band = dataset.GetRasterBand(1)
     dataset.SetGeoTransform(geotransform)
     dataset.SetProjection(projection)
-    band.WriteArray(smi_list)
-    dataset.FlushCache()
+    band.SetNoDataValue(SMI_NODATA[dtype])
+    if dtype == 'uint8':
+        band.SetScale(SMI_UINT8_SCALE)
+        band.SetOffset(0.0)
+    band.WriteArray(encode_smi(smi, np.isfinite(smi), dtype))
+    gdal.GetDriverByName('COG').CreateCopy(filename, dataset,
+                                           options=[f'{key.upper()}={value}' for key, value in options.items()])
     dataset = None
     return filename
 
@@ -431,13 +815,22 @@ def read_my_tiff(file_dir):
     print(array.shape)
 
 
-def get_file_name(file_dir):
-    filename = file_dir.split("/")[-1]
+def smi_file_stem(file_dir):
+    """
+    由红波文件名得到结果文件名（不含扩展名），去掉最后的波段标识：
+    xxx_R.TIF → xxxsmi，DJI_20230215103951_R.TIF → DJI_20230215103951smi
+    """
+    filename = os.path.splitext(file_dir.split("/")[-1])[0]
     filename_part = filename.split("_")
-    filename = filename_part[0] + 'smi.tif'
-    with open("config/configuration_local.yaml", 'r', encoding='utf-8') as file:
-        config = yaml.safe_load(file)['model5']
-    if not os.path.exists(config['smi-save-dir']):
+    if len(filename_part) > 1:
+        filename = "_".join(filename_part[:-1])
+    return filename + 'smi'
+
+
+def get_file_name(file_dir):
+    filename = smi_file_stem(file_dir) + '.tif'
+    config = load_config('model5')
+    if config['smi-save-dir'] and not os.path.exists(config['smi-save-dir']):
         os.makedirs(config['smi-save-dir'])
     full_path = config['smi-save-dir'] + filename
     return full_path
@@ -0,0 +1,130 @@
+"""
+土壤含水量网格的校正与多日预报
+
+实测点校正：先用花式索引一次取出各实测点处的网格值，得到残差（实测 - 网格），
+再把残差插值到整个网格上：
+    - offset：整体加上平均残差
+    - idw：反距离加权，用 KD 树查询每个网格最近的若干实测点，离实测点越近校正越接近该点的残差
+两种方法校正后实测点处都等于实测值。
+预报按天数线性衰减，负值截断为0，多日预报一次广播计算。
+"""
+import numpy as np
+from scipy.spatial import cKDTree
+
+from utils.config import load_config
+
+MINUS_RATE = 1.08  # 每天土壤含水量的减少量
+CALIBRATION_METHODS = ('offset', 'idw')
+IDW_CHUNK = 1 << 20  # 反距离加权时每次查询的网格数
+
+
+def point_residuals(grid, true_points):
+    """
+    实测点处的残差
+    :param grid: 二维网格
+    :param true_points: [{"x": 行号, "y": 列号, "true_humidity": 实测值}]
+    :return: (行号数组, 列号数组, 残差数组)，同一网格有多个实测点时取平均
+    """
+    rows = np.array([point['x'] for point in true_points], dtype=np.intp)
+    cols = np.array([point['y'] for point in true_points], dtype=np.intp)
+    truth = np.array([point['true_humidity'] for point in true_points], dtype=np.float64)
+    if rows.size and (rows.min() < 0 or cols.min() < 0 or rows.max() >= grid.shape[0] or cols.max() >= grid.shape[1]):
+        raise ValueError(f"实测点超出网格范围 {grid.shape}")
+    residuals = truth - grid[rows, cols]
+    cells, inverse = np.unique(rows * grid.shape[1] + cols, return_inverse=True)
+    if len(cells) < len(rows):
+        residuals = np.bincount(inverse, residuals) / np.bincount(inverse)
+        rows, cols = np.divmod(cells, grid.shape[1])
+    return rows, cols, residuals
+
+
+def idw_field(shape, rows, cols, residuals, neighbors=8, power=2.0, max_distance=np.inf):
+    """
+    反距离加权插值
+    :param shape: 网格形状 (行数, 列数)
+    :param rows: 实测点行号
+    :param cols: 实测点列号
+    :param residuals: 实测点残差
+    :param neighbors: 每个网格参与插值的最近实测点数
+    :param power: 距离的幂次
+    :param max_distance: 只使用该距离（网格数）以内的实测点，范围内没有实测点的网格不校正
+    :return: 插值结果网格（float64）
+    """
+    points = np.column_stack((rows, cols)).astype(np.float64)
+    tree = cKDTree(points)
+    k = min(neighbors, len(points))
+    values = np.append(residuals, 0.0)  # 超出 max_distance 时 cKDTree 返回的下标为 len(points)
+    field = np.empty(shape[0] * shape[1])
+    for start in range(0, field.size, IDW_CHUNK):
+        cells = np.arange(start, min(start + IDW_CHUNK, field.size))
+        queries = np.column_stack(np.divmod(cells, shape[1])).astype(np.float64)
+        distances, index = tree.query(queries, k=k, distance_upper_bound=max_distance, workers=-1)
+        distances, index = distances.reshape(len(cells), k), index.reshape(len(cells), k)
+        with np.errstate(divide='ignore'):
+            weights = np.where(np.isinf(distances), 0.0, 1.0 / distances ** power)
+        exact = distances[:, 0] == 0  # 网格恰好是实测点
+        weights[exact] = 0.0
+        weights[exact, 0] = 1.0
+        total = weights.sum(axis=1)
+        chunk = (weights * values[index]).sum(axis=1)
+        field[start:start + len(cells)] = np.divide(chunk, total, out=np.zeros_like(chunk), where=total > 0)
+    return field.reshape(shape)
+
+
+def calibrate(grid, true_points, method=None, neighbors=None, power=None, max_distance=None):
+    """
+    用实测点校正网格
+    :param grid: 二维网格
+    :param true_points: [{"x": 行号, "y": 列号, "true_humidity": 实测值}]
+    :param method: 'offset' / 'idw'，默认取配置 model5.calibration-method
+    :param neighbors: idw 最近实测点数，默认取配置
+    :param power: idw 距离幂次，默认取配置
+    :param max_distance: idw 最大距离（网格数），默认不限
+    :return: 校正后的网格（float64）
+    """
+    config = load_config('model5')
+    method = method or config.get('calibration-method', 'idw')
+    if method not in CALIBRATION_METHODS:
+        raise ValueError(f"method可选：{list(CALIBRATION_METHODS)}")
+    grid = np.asarray(grid, dtype=np.float64)
+    if not true_points:
+        return grid.copy()
+    rows, cols, residuals = point_residuals(grid, true_points)
+    if method == 'offset':
+        calibrated = grid + residuals.mean()
+    else:
+        neighbors = int(config.get('idw-neighbors', 8) if neighbors is None else neighbors)
+        power = float(config.get('idw-power', 2.0) if power is None else power)
+        if neighbors < 1:
+            raise ValueError("neighbors需为正整数")
+        if power <= 0:
+            raise ValueError("power需大于0")
+        calibrated = grid + idw_field(grid.shape, rows, cols, residuals, neighbors, power,
+                                      np.inf if max_distance is None else float(max_distance))
+    calibrated[rows, cols] = grid[rows, cols] + residuals  # 实测点处等于实测值
+    return calibrated
+
+
+def decay(grid, days, rate=MINUS_RATE):
+    """
+    按天数衰减并截断负值
+    :param grid: 网格
+    :param days: 天数，可为数组，结果在最前面增加一维
+    :return: 衰减后的网格
+    """
+    grid = np.asarray(grid, dtype=np.float64)
+    days = np.asarray(days, dtype=np.float64)
+    return np.maximum(grid - days.reshape(days.shape + (1,) * grid.ndim) * rate, 0)
+
+
+def forecast(grid, days, true_points=None, method=None, neighbors=None, power=None, max_distance=None,
+             rate=MINUS_RATE):
+    """
+    校正后的多日预报
+    :param grid: 二维网格
+    :param days: 预报天数列表，如 [1, 2, 3]
+    :param true_points: 可选 实测点，见 calibrate
+    :return: 数组 (天数, 行数, 列数)
+    """
+    calibrated = calibrate(grid, true_points or [], method, neighbors, power, max_distance)
+    return decay(calibrated, np.atleast_1d(days), rate)
@@ -0,0 +1,164 @@
+"""
+土壤含水量热度图
+
+不经过 pyplot：先按输出尺寸对数组做块均值降采样，再用色带查找表直接映射为 uint8 RGBA，由 Pillow 编码为PNG。
+没有全局绘图状态，可在多个线程中同时调用；渲染结果按数组内容哈希缓存在进程内的LRU缓存中。
+"""
+import hashlib
+import io
+import math
+import threading
+
+import numpy as np
+import rasterio
+from PIL import Image
+from rasterio.enums import Resampling
+
+from model5.result_cache import get_result_cache
+from model5.tiles import TileCache
+from model5.togeoJSON import decode_smi
+from utils.config import load_config
+
+DEFAULT_MAX_SIZE = 1024  # 输出图片长边的像素数
+DEFAULT_CMAP = 'viridis'
+DEFAULT_CACHE_SIZE = 256  # 缓存的图片数量
+
+_luts = {}
+_luts_lock = threading.Lock()
+
+
+def colormap_lut(name=DEFAULT_CMAP):
+    """
+    色带查找表，第 0~254 项为色带，第 255 项为透明（无效值）
+    :param name: matplotlib 色带名称
+    :return: uint8 数组 (256, 4)
+    """
+    with _luts_lock:
+        lut = _luts.get(name)
+        if lut is None:
+            from matplotlib import colormaps  # 只取色带数据，不导入 pyplot
+            lut = np.zeros((256, 4), dtype=np.uint8)
+            lut[:255] = colormaps[name](np.linspace(0, 1, 255), bytes=True)
+            _luts[name] = lut
+        return lut
+
+
+def output_shape(shape, max_size=DEFAULT_MAX_SIZE):
+    """
+    :return: 长边不超过 max_size 的输出尺寸，不放大
+    """
+    scale = min(1.0, max_size / max(shape))
+    return max(1, int(round(shape[0] * scale))), max(1, int(round(shape[1] * scale)))
+
+
+def block_mean(array, max_size=DEFAULT_MAX_SIZE):
+    """
+    块均值降采样，NaN 不参与平均，整块都是 NaN 时结果为 NaN
+    :param array: 二维数组
+    :param max_size: 输出长边的最大像素数
+    :return: float32 数组
+    """
+    array = np.asarray(array, dtype=np.float32)
+    factor = math.ceil(max(array.shape) / max_size)
+    if factor <= 1:
+        return array
+    height, width = math.ceil(array.shape[0] / factor), math.ceil(array.shape[1] / factor)
+    total = np.zeros((height * factor, width * factor), dtype=np.float32)
+    count = np.zeros(total.shape, dtype=np.uint8)
+    valid = ~np.isnan(array)
+    np.copyto(total[:array.shape[0], :array.shape[1]], array, where=valid)
+    count[:array.shape[0], :array.shape[1]] = valid
+    # 先按行、再按列求块内和，都是连续内存上的归约
+    total = total.reshape(height, factor, -1).sum(axis=1, dtype=np.float64).reshape(height, width, factor).sum(axis=2)
+    count = count.reshape(height, factor, -1).sum(axis=1, dtype=np.int32).reshape(height, width, factor).sum(axis=2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (total / count).astype(np.float32)
+
+
+def colorize(array, vmin=None, vmax=None, cmap=DEFAULT_CMAP):
+    """
+    按色带着色
+    :param vmin: 色带下限，默认取有效值最小值
+    :param vmax: 色带上限，默认取有效值最大值
+    :return: uint8 RGBA 数组，NaN 为透明
+    """
+    valid = ~np.isnan(array)
+    values = array[valid]
+    if vmin is None:
+        vmin = float(values.min()) if values.size else 0.0
+    if vmax is None:
+        vmax = float(values.max()) if values.size else 1.0
+    scale = 254.0 / (vmax - vmin) if vmax > vmin else 0.0
+    index = np.full(array.shape, 255, dtype=np.uint8)
+    index[valid] = np.clip((array[valid] - vmin) * scale, 0, 254).astype(np.uint8)
+    return colormap_lut(cmap)[index]
+
+
+def encode_png(rgba):
+    buffer = io.BytesIO()
+    Image.fromarray(rgba, 'RGBA').save(buffer, format='PNG', compress_level=1)  # 编码速度优先
+    return buffer.getvalue()
+
+
+def render_heatmap(array, max_size=DEFAULT_MAX_SIZE, vmin=None, vmax=None, cmap=DEFAULT_CMAP):
+    """
+    二维数组渲染为热度图PNG，按数组内容和渲染参数缓存
+    :param array: 二维数组，无效值为 NaN
+    :param max_size: 输出长边的最大像素数
+    :return: PNG字节
+    """
+    array = np.ascontiguousarray(array)
+    digest = hashlib.sha256(array.view(np.uint8).reshape(-1))
+    digest.update(repr((array.shape, array.dtype.str)).encode())
+    key = ('array', digest.hexdigest(), max_size, vmin, vmax, cmap)
+    cache = _get_heatmap_cache()
+    png = cache.get(key)
+    if png is None:
+        png = encode_png(colorize(block_mean(array, max_size), vmin, vmax, cmap))
+        cache.put(key, png)
+    return png
+
+
+def render_smi_heatmap(smi_tif, max_size=DEFAULT_MAX_SIZE, vmin=0.0, vmax=1.0, cmap=DEFAULT_CMAP):
+    """
+    土壤含水量tif（COG）渲染为热度图PNG，按输出尺寸读取金字塔层，不读全分辨率数据
+    :param smi_tif: 土壤含水量tif路径
+    :return: PNG字节
+    """
+    with rasterio.open(smi_tif) as src:
+        height, width = output_shape((src.height, src.width), max_size)
+        nodata = src.nodata if src.nodata is not None else -9999.0
+        raw = src.read(1, out_shape=(height, width), resampling=Resampling.average)
+        data = decode_smi(raw, nodata, src.scales[0], src.offsets[0])
+    return encode_png(colorize(data, vmin, vmax, cmap))
+
+
+def get_smi_heatmap(smi_key, max_size=DEFAULT_MAX_SIZE, cmap=DEFAULT_CMAP):
+    """
+    获取结果缓存中土壤含水量tif的热度图，先查LRU缓存
+    :param smi_key: 土壤含水量tif的缓存键（/model5/get_smi 响应头 X-SMI-Key）
+    :return: PNG字节
+    """
+    cache = _get_heatmap_cache()
+    key = ('smi', smi_key, max_size, cmap)
+    png = cache.get(key)
+    if png is not None:
+        return png
+    result_cache = get_result_cache()
+    if result_cache.get(smi_key, ('.tif',)) is None:
+        raise FileNotFoundError(f"未找到土壤含水量结果{smi_key}，请先调用 /model5/get_smi")
+    png = render_smi_heatmap(result_cache.path(smi_key, '.tif'), max_size, cmap=cmap)
+    cache.put(key, png)
+    return png
+
+
+_heatmap_cache = None
+_heatmap_cache_lock = threading.Lock()
+
+
+def _get_heatmap_cache():
+    global _heatmap_cache
+    with _heatmap_cache_lock:
+        if _heatmap_cache is None:
+            _heatmap_cache = TileCache(int(load_config('heatmap').get('cache-size', DEFAULT_CACHE_SIZE)))
+        return _heatmap_cache
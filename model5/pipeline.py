@@ -0,0 +1,145 @@
+"""
+多期影像土壤含水量的并行处理
+
+每组红波/近红外影像（一景）的 SMMRS 计算 → 写入tif → 矢量化为geojson 在进程池中执行，
+多景之间并行，先完成的景立即写入zip，压缩与其他景的栅格计算、矢量化同时进行。
+接口中各景通过 run_in_process('raster', ...) 提交，与其他栅格接口共用并发上限，
+同时在途的景不超过该上限，一次多景请求不会把整批影像排在其他请求前面。
+每景的结果保存在按内容寻址的结果缓存中（见 model5.result_cache），同一组影像再次提交时直接复用。
+"""
+import asyncio
+import io
+import json
+import os
+import shutil
+import zipfile
+
+from model5.algorithm import get_smi_geojson, lookup_smi_geojson, smi_file_stem
+from utils.concurrency import get_limit, run_in_process, run_in_thread
+
+
+def process_scene(red_file, nir_file):
+    """
+    处理一景影像，在子进程中执行
+    :param red_file: 红波tif路径
+    :param nir_file: 近红外tif路径
+    :return: {"geojson": geojson路径, "reused": 是否复用已有结果}
+    """
+    hit = lookup_smi_geojson(red_file, nir_file)
+    if hit is not None:
+        return {"geojson": hit[0], "reused": True}
+    success, geojson_path, _ = get_smi_geojson(red_file, nir_file)
+    if not success:
+        raise RuntimeError(f"{red_file}生成geojson失败")
+    return {"geojson": geojson_path, "reused": False}
+
+
+def run_scenes(file_list):
+    """
+    在当前进程中逐景处理多景影像，供任务队列的工作进程使用（不再嵌套进程池）
+    :param file_list: [{"red_dir": "", "nir_dir": ""}]
+    :return: 生成器，依次产生 (序号, 结果 或 None, 异常 或 None)
+    """
+    for index, item in enumerate(file_list):
+        try:
+            result = process_scene(item["red_dir"], item["nir_dir"])
+        except Exception as e:
+            yield index, None, e
+        else:
+            yield index, result, None
+
+
+async def run_scenes_async(file_list):
+    """
+    在栅格计算进程池中并行处理多景影像，同时在途的景数不超过 concurrency.raster
+    :param file_list: [{"red_dir": "", "nir_dir": ""}]
+    :return: 异步生成器，按完成顺序依次产生 (序号, 结果 或 None, 异常 或 None)
+    """
+    limit = get_limit('raster')
+    pending = {}
+    next_index = 0
+    try:
+        while pending or next_index < len(file_list):
+            # 一景完成后才提交下一景，期间到达的其他栅格请求按先后顺序排在它前面
+            while next_index < len(file_list) and len(pending) < limit:
+                item = file_list[next_index]
+                task = asyncio.ensure_future(run_in_process('raster', process_scene, item["red_dir"], item["nir_dir"]))
+                pending[task] = next_index
+                next_index += 1
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                index = pending.pop(task)
+                error = task.exception()
+                yield index, (None if error else task.result()), error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def _entry_name(file_list, index, used_names):
+    """zip中的文件名，与原结果文件名一致，重名时加上序号"""
+    name = smi_file_stem(file_list[index]["red_dir"]) + '.geojson'
+    if name in used_names:
+        name = f"{index + 1:02d}_{name}"
+    used_names.add(name)
+    return name
+
+
+class _ZipStreamBuffer(io.RawIOBase):
+    """zipfile 写入的不可seek缓冲区，已写入的字节随时取出发送"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def stream_scenes_zip(file_list):
+    """
+    并行处理多景影像，每完成一景就把它的geojson写入zip并发送已压缩的字节
+    :param file_list: [{"red_dir": "", "nir_dir": ""}]
+    :return: zip字节流异步生成器，处理失败的景记录在 errors.json 中
+    """
+    buffer = _ZipStreamBuffer()
+    used_names = set()
+    errors = []
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        async for index, result, error in run_scenes_async(file_list):
+            if error is not None:
+                errors.append({"index": index, **file_list[index], "error": str(error)})
+                continue
+            # 读取并压缩geojson是阻塞操作，在线程中执行
+            await run_in_thread('io', zf.write, result["geojson"], _entry_name(file_list, index, used_names))
+            yield buffer.pop()
+        if errors:
+            zf.writestr('errors.json', json.dumps(errors, ensure_ascii=False, indent=4))
+    yield buffer.pop()
+
+
+def collect_scenes(file_list, folder_path, progress=None):
+    """
+    逐景处理多景影像，结果复制到同一文件夹
+    :param folder_path: 结果文件夹
+    :param progress: 可选 进度回调 progress(fraction, message)
+    :return: 结果文件夹路径
+    """
+    os.makedirs(folder_path, exist_ok=True)
+    used_names = set()
+    for done, (index, result, error) in enumerate(run_scenes(file_list), start=1):
+        if error is not None:
+            raise error
+        shutil.copyfile(result["geojson"], os.path.join(folder_path, _entry_name(file_list, index, used_names)))
+        if progress is not None:
+            progress(done / len(file_list), f"已完成{done}/{len(file_list)}组影像")
+    return folder_path
@@ -0,0 +1,306 @@
+"""
+历史降水索引
+
+历史数据目录下每年一个 GSOD 格式的日值CSV（PRCP 单位为英寸，99.99 表示缺测），
+索引一次读入全部年份，换算为毫米后按日期排成连续的逐日序列并保存累计和：
+任意时段 [start, end) 的降水量为两个累计值之差，年、月、旬合计以及多年同期平均都不再逐行扫描。
+目录中新增年份文件或文件被修改后，下次查询时自动重新加载。
+"""
+import calendar
+import datetime as dt
+import glob
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from utils.config import load_config
+from utils.metrics import span
+
+SPANS = ('year', 'month', 'xun')  # 年初至今 / 月初至今 / 当旬
+PRCP_MISSING = 99.99  # GSOD 降水缺测值（英寸）
+INCH_TO_MM = 25.4
+DAY_SLOTS = 366  # 按闰年日历排列的日序，平年的2月29日降水为0
+MONTH_SLOTS = np.cumsum([0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])  # 各月第一天的日序
+
+
+def read_precip_csv(path):
+    """
+    读取一个GSOD日值CSV，日期和缺测值向量化处理
+    :param path: CSV路径，日期可为 2024-01-01 或 2024/1/1
+    :return: DataFrame[DATE(datetime64), PRCP(毫米，缺测为0)]
+    """
+    with span('csv_read'):
+        df = pd.read_csv(path, usecols=['DATE', 'PRCP'], dtype={'DATE': str})
+    dates = pd.to_datetime(df['DATE'].str.strip().str.replace('/', '-', regex=False), format='%Y-%m-%d')
+    prcp = pd.to_numeric(df['PRCP'], errors='coerce').to_numpy(dtype=np.float64, copy=True)
+    prcp[np.isnan(prcp) | np.isclose(prcp, PRCP_MISSING)] = 0.0
+    return pd.DataFrame({'DATE': dates, 'PRCP': prcp * INCH_TO_MM})
+
+
+def _same_day(date, year):
+    """其他年份的同一天，2月29日在平年取2月28日"""
+    return date.replace(year=year, day=min(date.day, calendar.monthrange(year, date.month)[1]))
+
+
+def span_period(span, date):
+    """
+    统计时段
+    :param span: 'year' 年初至当日（不含当日）/ 'month' 月初至当日（不含当日）/
+                 'xun' 当日所在旬（上旬1~10日、中旬11~20日、下旬21日至月末）
+    :param date: 日期
+    :return: (起始日期, 结束日期)，左闭右开
+    """
+    if span == 'year':
+        return date.replace(month=1, day=1), date
+    if span == 'month':
+        return date.replace(day=1), date
+    if span == 'xun':
+        if date.day <= 20:
+            start = date.replace(day=(date.day - 1) // 10 * 10 + 1)
+            return start, start + dt.timedelta(days=10)
+        month_days = calendar.monthrange(date.year, date.month)[1]
+        return date.replace(day=21), date.replace(day=month_days) + dt.timedelta(days=1)
+    raise ValueError(f"span可选：{list(SPANS)}")
+
+
+class PrecipIndex:
+    """逐日降水累计和索引"""
+
+    def __init__(self, source):
+        """
+        :param source: 历史数据目录（读取其中全部 *.csv）或单个CSV路径
+        """
+        self.source = source
+        self._lock = threading.Lock()
+        self._signature = None
+        self._data = (None, np.zeros(1))  # (第一天, 累计和)，整体替换，查询时无需加锁
+        self._by_year = (np.zeros(0, dtype=int), np.zeros((0, DAY_SLOTS + 1)), np.zeros((0, 2), dtype=int))
+
+    def _files(self):
+        if os.path.isdir(self.source):
+            return sorted(glob.glob(os.path.join(self.source, '*.csv')))
+        return [self.source]
+
+    def refresh(self):
+        """
+        文件列表、大小或修改时间变化时重新加载
+        :return: 是否重新加载
+        """
+        files = self._files()
+        signature = tuple((path, os.stat(path).st_size, os.stat(path).st_mtime_ns) for path in files)
+        with self._lock:
+            if signature == self._signature:
+                return False
+            self._data, self._by_year = self._load(files)
+            self._signature = signature
+            return True
+
+    @staticmethod
+    def _load(files):
+        """
+        :return: ((第一天, 逐日累计和), (年份, 各年按日序的累计和, 各年有数据的日序范围))
+        """
+        if not files:
+            return (None, np.zeros(1)), (np.zeros(0, dtype=int), np.zeros((0, DAY_SLOTS + 1)), np.zeros((0, 2), int))
+        df = pd.concat([read_precip_csv(path) for path in files], ignore_index=True)
+        df = df.drop_duplicates('DATE', keep='last')  # 多个文件含同一天时以后读入的为准
+        first = df['DATE'].min()
+        days = (df['DATE'] - first).dt.days.to_numpy()
+        daily = np.zeros(days.max() + 1)
+        daily[days] = df['PRCP'].to_numpy()  # 文件中没有的日期按0计
+
+        # 年份 × 日序 矩阵，各年同一时段的降水量为同一对列的累计和之差
+        all_days = pd.date_range(first, periods=len(daily), freq='D')
+        years = np.arange(all_days.year.min(), all_days.year.max() + 1)
+        rows = all_days.year.to_numpy() - years[0]
+        slots = day_slot(all_days.month.to_numpy(), all_days.day.to_numpy())
+        by_year = np.zeros((len(years), DAY_SLOTS))
+        by_year[rows, slots] = daily
+        year_cumsum = np.concatenate((np.zeros((len(years), 1)), np.cumsum(by_year, axis=1)), axis=1)
+        slot_range = np.tile([0, DAY_SLOTS], (len(years), 1))
+        slot_range[0, 0] = slots[0]  # 第一年、最后一年只覆盖部分日序
+        slot_range[-1, 1] = slots[-1] + 1
+        return (first.date(), np.concatenate(([0.0], np.cumsum(daily)))), (years, year_cumsum, slot_range)
+
+    def coverage(self):
+        """
+        :return: (第一天, 最后一天的下一天)，没有数据时为 (None, None)
+        """
+        first, cumsum = self._data
+        if first is None:
+            return None, None
+        return first, first + dt.timedelta(days=len(cumsum) - 1)
+
+    def total(self, start, end):
+        """
+        [start, end) 的降水量（毫米），超出数据范围的部分按0计
+        """
+        first, cumsum = self._data
+        if first is None:
+            return 0.0
+        n = len(cumsum) - 1
+        i = min(max((start - first).days, 0), n)
+        j = min(max((end - first).days, 0), n)
+        return float(cumsum[j] - cumsum[i]) if j > i else 0.0
+
+    def period_total(self, span, date, year=None):
+        """
+        某年同期降水量
+        :param span: 'year' / 'month' / 'xun'，见 span_period
+        :param date: 日期
+        :param year: 统计的年份，默认为 date 所在年份
+        :return: 降水量（毫米），该时段超出历史数据范围时为 None
+        """
+        start, end = span_period(span, _same_day(_as_date(date), year or date.year))
+        first, last = self.coverage()
+        if first is None or start < first or end > last:
+            return None
+        return self.total(start, end)
+
+    def climatology(self, span, date, normal_years=None):
+        """
+        多年同期平均降水量
+        :param normal_years: 参与平均的年数，默认为 date 之前数据完整覆盖该时段的全部年份
+        :return: 平均降水量（毫米），没有可比数据时为 None
+        """
+        normal_years = normal_years or len(self._by_year[0])
+        normal = self.anomaly_batch([span], [date], [0.0], normal_years)['normal'][0]
+        return None if np.isnan(normal) else float(normal)
+
+    def anomaly(self, span, value, date):
+        """
+        降水距平百分率 (value - 多年同期平均) / 多年同期平均
+        :param value: 当前时段降水量（毫米）
+        :return: 距平百分率，没有可比数据或平均值为0时为 None
+        """
+        mean = self.climatology(span, date)
+        if not mean:
+            return None
+        return (value - mean) / mean
+
+
+    def anomaly_batch(self, spans, dates, values, normal_years=30, reference=None):
+        """
+        批量计算降水距平和历史百分位，全部查询一次向量化完成
+        常年值取查询年份之前数据完整覆盖该时段的最近 normal_years 年的平均；
+        历史数据年数少于 normal_years 且少于参考常年值的年数时，改用参考常年值
+        :param spans: 时段列表，见 span_period
+        :param dates: 日期列表
+        :param values: 当前时段降水量（毫米）列表
+        :param normal_years: 常年值的年数，如 10 / 20 / 30
+        :param reference: 可选 参考常年值 (按日序的多年平均日降水累计和, 年数)，见 load_reference_normal
+        :return: dict，每项为与查询等长的数组：start/end（日期）、normal（常年值，毫米）、
+                 anomaly_pct（距平百分率）、percentile（在历史同期中的百分位）、years（历史年数）、normal_source
+        """
+        spans = np.asarray(spans, dtype=object)
+        if not np.isin(spans, SPANS).all():
+            raise ValueError(f"span可选：{list(SPANS)}")
+        dates = pd.DatetimeIndex(pd.to_datetime(list(dates)))
+        values = np.asarray(values, dtype=np.float64)
+        month, day = dates.month.to_numpy(), dates.day.to_numpy()
+
+        # 各查询的日序范围 [start_slot, end_slot)
+        end_slot = day_slot(month, day)
+        start_slot = np.where(spans == 'year', 0, MONTH_SLOTS[month - 1])
+        is_xun = spans == 'xun'
+        xun_start = MONTH_SLOTS[month - 1] + np.minimum((day - 1) // 10, 2) * 10
+        start_slot = np.where(is_xun, xun_start, start_slot)
+        end_slot = np.where(is_xun, np.where(day <= 20, xun_start + 10, MONTH_SLOTS[month]), end_slot)
+
+        # 年份 × 查询：各年同期降水量，以及该年是否参与统计
+        years, year_cumsum, slot_range = self._by_year
+        totals = year_cumsum[:, end_slot] - year_cumsum[:, start_slot]
+        usable = (slot_range[:, :1] <= start_slot) & (end_slot <= slot_range[:, 1:]) \
+            & (years[:, None] < dates.year.to_numpy())
+        recent = np.cumsum(usable[::-1], axis=0)[::-1]  # 从最近一年往前数第几个可用年份
+        usable &= recent <= normal_years
+        count = usable.sum(axis=0)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            normal = np.where(usable, totals, 0.0).sum(axis=0) / count
+            percentile = 100.0 * ((totals <= values) & usable).sum(axis=0) / count
+            source = np.full(len(values), 'history', dtype=object)
+            if reference is not None:
+                reference_cumsum, reference_years = reference
+                use_reference = count < min(normal_years, reference_years)
+                normal = np.where(use_reference, reference_cumsum[end_slot] - reference_cumsum[start_slot], normal)
+                source[use_reference] = 'reference'
+            anomaly_pct = np.where(normal > 0, 100.0 * (values - normal) / normal, np.nan)
+
+        year_start = dates.normalize() - pd.to_timedelta(dates.dayofyear - 1, unit='D')
+        return {
+            "start": _slot_dates(year_start, start_slot),
+            "end": _slot_dates(year_start, end_slot),
+            "normal": normal,
+            "anomaly_pct": anomaly_pct,
+            "percentile": percentile,
+            "years": count,
+            "normal_source": source,
+        }
+
+
+def day_slot(month, day):
+    """
+    按闰年日历的日序（0~365），平年与闰年同一月日的日序相同
+    """
+    return MONTH_SLOTS[np.asarray(month) - 1] + np.asarray(day) - 1
+
+
+def _slot_dates(year_start, slots):
+    """日序换算回查询年份的日期，平年跳过2月29日"""
+    leap = year_start.is_leap_year
+    offset = np.where(~leap & (slots > MONTH_SLOTS[2] - 1), slots - 1, slots)
+    return [d.date() for d in year_start + pd.to_timedelta(offset, unit='D')]
+
+
+def load_reference_normal(path=None, years=None):
+    """
+    读取参考常年值：按月日给出的多年平均日降水（毫米），如 model1/data/ave_precip.json
+    :param path: json路径，默认取配置 model5.precip-reference-normal
+    :param years: 参考常年值的年数，默认取配置 model5.precip-reference-years
+    :return: (按日序的累计和, 年数)，文件不存在时为 None
+    """
+    config = load_config('model5')
+    path = path or config.get('precip-reference-normal')
+    if not path or not os.path.exists(path):
+        return None
+    years = int(years or config.get('precip-reference-years', 20))
+    mtime = os.path.getmtime(path)
+    memo = _reference_memo.get(path)
+    if memo is None or memo[0] != mtime:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        month_day = np.array([[int(part) for part in key.split('-')] for key in data])
+        daily = np.zeros(DAY_SLOTS)
+        daily[day_slot(month_day[:, 0], month_day[:, 1])] = list(data.values())
+        daily[MONTH_SLOTS[2] - 1] /= 4  # 文件中2月29日为闰年的平均值，按四年一闰折算为所有年份的平均
+        _reference_memo[path] = memo = (mtime, np.concatenate(([0.0], np.cumsum(daily))))
+    return memo[1], years
+
+
+_reference_memo = {}
+
+
+def _as_date(date):
+    return date.date() if isinstance(date, dt.datetime) else date
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_precip_index(source=None):
+    """
+    获取历史降水索引，同一数据源只加载一次，数据文件变化时自动刷新
+    :param source: 历史数据目录或CSV路径，默认取配置 model5.history-data-dir
+    """
+    source = source or load_config('model5')['history-data-dir']
+    with _indexes_lock:
+        index = _indexes.get(source)
+        if index is None:
+            index = _indexes[source] = PrecipIndex(source)
+    index.refresh()
+    return index
@@ -0,0 +1,222 @@
+"""
+按内容寻址的计算结果缓存
+
+结果以输入内容决定的键保存（如 红波哈希 + 近红外哈希 + 算法版本 + 分级阈值），
+同一组输入再次请求时直接返回已有文件，不再重新计算：
+    - 一个键对应一组文件（如 .tif、.geojson）和一个元数据 .json，元数据最后写入，存在即表示该条目完整
+    - 所有文件先写入缓存目录下的临时文件再原子重命名，并发请求或多进程之间不会读到写了一半的文件
+    - 缓存总大小超过上限时，按最近使用时间淘汰最久未用的条目；最近 EVICT_GRACE_SECONDS 秒内用过的条目不淘汰，
+      命中后到 FileResponse 打开文件之间文件不会被删除（打开之后再删除不影响正在发送的响应）
+"""
+import functools
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+from utils.config import load_config
+from utils.upload import file_sha256
+
+DEFAULT_CACHE_DIR = 'model5/cache/'
+DEFAULT_MAX_SIZE = 10 * 1024 ** 3  # 10 GiB
+META_SUFFIX = '.json'
+HASH_MEMO_SIZE = 4096  # 文件哈希记忆的条目数上限，长期运行的进程中不会无限增长
+EVICT_GRACE_SECONDS = 60
+KEY_PATTERN = re.compile(r'[0-9a-f]{64}')  # make_key 生成的十六进制sha256
+
+
+@functools.lru_cache(maxsize=HASH_MEMO_SIZE)
+def _memo_file_sha256(file_path, size, mtime_ns):
+    return file_sha256(file_path)
+
+
+def cached_file_sha256(file_path):
+    """
+    文件内容哈希，文件大小和修改时间不变时直接使用上次计算的结果
+    :param file_path: 文件路径
+    :return: 十六进制sha256
+    """
+    stat = os.stat(file_path)
+    return _memo_file_sha256(os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+
+
+def make_key(*parts):
+    """
+    由若干可JSON序列化的部分生成缓存键
+    :return: 十六进制sha256
+    """
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """磁盘上按大小上限做LRU淘汰的结果缓存"""
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        """
+        :param cache_dir: 缓存目录
+        :param max_size: 缓存总大小上限（字节）
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, key, suffix):
+        """
+        :return: 条目中某个文件的路径，按键的前两位分目录
+        """
+        # 键可能来自请求参数（如 /model5/tiles 的 key），不是sha256的键可能指向缓存目录以外的文件
+        if not isinstance(key, str) or KEY_PATTERN.fullmatch(key) is None:
+            raise ValueError(f"无效的缓存键：{key}")
+        return os.path.join(self.cache_dir, key[:2], key + suffix)
+
+    def get(self, key, suffixes=()):
+        """
+        查询缓存，命中时刷新最近使用时间
+        :param suffixes: 条目中必须存在的文件后缀
+        :return: 元数据dict，未命中返回 None
+        """
+        meta_path = self.path(key, META_SUFFIX)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not all(os.path.exists(self.path(key, suffix)) for suffix in suffixes):
+            return None
+        try:
+            os.utime(meta_path)
+        except OSError:
+            return None  # 刚被淘汰
+        return meta
+
+    def temp_path(self, suffix=''):
+        """
+        :return: 缓存目录下的临时文件路径（文件尚未创建），与缓存文件在同一文件系统，可原子重命名
+        """
+        temp_dir = os.path.join(self.cache_dir, 'tmp')
+        os.makedirs(temp_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=temp_dir, suffix=suffix)
+        os.close(fd)
+        os.remove(temp_path)  # 部分驱动（如GeoJSON）不能覆盖已有文件
+        return temp_path
+
+    def put(self, key, files, meta):
+        """
+        写入一个条目
+        :param files: {后缀: 已生成的临时文件路径}，临时文件会被移动到缓存目录
+        :param meta: 元数据dict
+        :return: {后缀: 缓存文件路径}
+        """
+        entry_dir = os.path.dirname(self.path(key, META_SUFFIX))
+        os.makedirs(entry_dir, exist_ok=True)
+        paths = {}
+        for suffix, temp_path in files.items():
+            paths[suffix] = self.path(key, suffix)
+            os.replace(temp_path, paths[suffix])
+        fd, meta_temp = tempfile.mkstemp(dir=entry_dir, prefix='.meta-')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(meta_temp, self.path(key, META_SUFFIX))
+        self.evict(keep=key)
+        return paths
+
+    def _entries(self):
+        """
+        :return: {键: [最近使用时间, 总大小, 文件列表]}
+        """
+        entries = {}
+        for entry_dir in os.listdir(self.cache_dir):
+            entry_path = os.path.join(self.cache_dir, entry_dir)
+            if entry_dir == 'tmp' or not os.path.isdir(entry_path):
+                continue
+            for filename in os.listdir(entry_path):
+                if filename.startswith('.'):
+                    continue
+                file_path = os.path.join(entry_path, filename)
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                key = filename.split('.')[0]
+                entry = entries.setdefault(key, [0.0, 0, []])
+                # 元数据最后写入、命中时刷新，一般即为最近使用时间；尚未写入元数据的条目按其文件的写入时间
+                entry[0] = max(entry[0], stat.st_mtime)
+                entry[1] += stat.st_size
+                entry[2].append(file_path)
+        return entries
+
+    def keys(self):
+        """
+        :return: 缓存中全部条目的键
+        """
+        return set(self._entries())
+
+    def remove(self, key):
+        """删除一个条目"""
+        with self._lock:
+            entry = self._entries().get(key)
+            if entry is not None:
+                _remove_entry_files(entry[2])
+
+    def size(self):
+        """
+        :return: 缓存总大小（字节）
+        """
+        return sum(entry[1] for entry in self._entries().values())
+
+    def evict(self, keep=None):
+        """
+        淘汰最久未使用的条目，直到总大小不超过上限，最近 EVICT_GRACE_SECONDS 秒内用过的条目不淘汰（可能正在发送）
+        :param keep: 不淘汰的键（刚写入的条目）
+        :return: 被淘汰的键列表
+        """
+        with self._lock:
+            entries = self._entries()
+            total = sum(entry[1] for entry in entries.values())
+            recent = time.time() - EVICT_GRACE_SECONDS
+            evicted = []
+            for key, (last_used, size, file_paths) in sorted(entries.items(), key=lambda item: item[1][0]):
+                if total <= self.max_size or last_used > recent:
+                    break  # 按使用时间排序，之后的条目都是最近用过的
+                if key == keep:
+                    continue
+                _remove_entry_files(file_paths)
+                total -= size
+                evicted.append(key)
+            return evicted
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+
+def _remove_entry_files(file_paths):
+    # 先删元数据，其他请求立即视为未命中
+    for file_path in sorted(file_paths, key=lambda p: not p.endswith(META_SUFFIX)):
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """
+    获取全局结果缓存，按配置文件 cache 节创建
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            config = load_config('cache')
+            _cache = ResultCache(config.get('dir', DEFAULT_CACHE_DIR), int(config.get('max-size', DEFAULT_MAX_SIZE)))
+        return _cache
@@ -1,63 +1,277 @@
+import asyncio
 import datetime as dt
+import math
 import os
 from typing import List, Optional
 import utils.file_path_processor
 
-import yaml
 from fastapi import APIRouter, UploadFile, File
-from pydantic import BaseModel
-from starlette.responses import FileResponse
+from pydantic import BaseModel, Field
+from starlette.responses import FileResponse, Response, StreamingResponse
 
-from model5.algorithm import nir_red_to_smi, get_dynamic_smi, get_continuous_dry_day, \
-    get_rain_avg_lap_rate, write_tiff_file, get_file_name, zipDir
-from model5.togeoJSON import generate_geoJSON
+from utils.concurrency import run_in_process, run_in_thread
+from utils.config import load_config
+from utils.profiling import ProfiledRoute
+from utils.upload import UploadTooLarge, save_upload_file
+
+# 模型模块（GDAL、rasterio、geopandas 等）在接口函数内导入，服务启动时不加载，首次调用对应接口时才导入
 
 router_5 = APIRouter(
     prefix="/model5",
-    tags=["水旱灾害防御模型"]
+    tags=["水旱灾害防御模型"],
+    route_class=ProfiledRoute,
 )
 
 
+STREAM_MEDIA_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'geojson': 'application/geo+json',
+    'fgb': 'application/flatgeobuf',
+}
+STREAM_POLL_SECONDS = 0.05  # 流式输出时等待子进程写入新数据的间隔
+
+
 class FileInfo(BaseModel):
     filename: str
     file_extension: str
     file_size: int
 
 
-with open("config/configuration_local.yaml", 'r', encoding='utf-8') as f:
-    config = yaml.safe_load(f)['model5']
+class RainAnomalyQuery(BaseModel):
+    span: str
+    date: dt.date
+    value: float
+
+
+class RainAnomalyBatch(BaseModel):
+    items: List[RainAnomalyQuery]
+    normal_years: Optional[int] = None
+    history_file_dir: Optional[str] = None
+
+
+class TruePoint(BaseModel):
+    x: int
+    y: int
+    true_humidity: float
+
+
+class SmiForecastRequest(BaseModel):
+    humidity: List[List[float]]
+    days: List[int] = [1]
+    true_points: List[TruePoint] = []
+    method: Optional[str] = None
+    neighbors: Optional[int] = Field(default=None, ge=1)
+    power: Optional[float] = Field(default=None, gt=0)
+    max_distance: Optional[float] = None
+
+
+def _soil_line_headers(soil_line):
+    """土壤线信息响应头：方法、斜率、截距、耗时，对比精确方法时包含斜率偏差"""
+    headers = {
+        "X-Soil-Line-Method": soil_line["method"],
+        "X-Soil-Line-Slope": f"{soil_line['slope']:.6f}",
+        "X-Soil-Line-Intercept": f"{soil_line['intercept']:.6f}",
+        "X-Soil-Line-Seconds": str(soil_line["seconds"]),
+    }
+    if "slope_deviation" in soil_line:
+        headers["X-Soil-Line-Exact-Slope"] = f"{soil_line['exact_slope']:.6f}"
+        headers["X-Soil-Line-Slope-Deviation"] = f"{soil_line['slope_deviation']:.6f}"
+    return headers
+
+
+def _check_region(region):
+    """区域未配置干旱分级时返回错误信息"""
+    from model5.togeoJSON import get_classes
+
+    try:
+        get_classes(region)
+    except ValueError as e:
+        return {"error": str(e)}
+    return None
 
 
 @router_5.get('/get_smi')
-async def flood_drought_defend_get_smi(red_tif_dir: str, nir_tif_dir: str) :
+async def flood_drought_defend_get_smi(red_tif_dir: str, nir_tif_dir: str, soil_line_method: Optional[str] = None,
+                                       sample_step: Optional[int] = None, compare_exact: bool = False,
+                                       sieve_pixels: Optional[int] = None, dissolve: Optional[bool] = None,
+                                       simplify_tolerance: Optional[float] = None, region: Optional[str] = None):
     """
     获取对应遥感图像的土壤含水量
     \n:param red_tif_dir: 红波tif路径
     \n:param nir_tif_dir: 近红外tif路径
-    \n:return: geojson文件
+    \n:param soil_line_method: 土壤线提取方法 exact（全部像元）/ sample（分层抽样近似，多景拼接大影像时更快），默认取配置
+    \n:param sample_step: sample 方法的抽样间隔，每 sample_step×sample_step 个像元取一个
+    \n:param compare_exact: sample 方法下是否同时计算精确土壤线，在响应头中给出斜率偏差
+    \n:param sieve_pixels: 最小图斑面积（像元数），矢量化前把更小的碎斑并入相邻图斑，默认取配置
+    \n:param dissolve: 是否按干旱等级合并图斑，默认取配置
+    \n:param simplify_tolerance: 多边形简化容差（像元），相邻图斑的公共边保持一致，默认取配置
+    \n:param region: 干旱分级所属区域，对应配置 model5.drought-classes，默认 default
+    \n:return: geojson文件，响应头 X-Soil-Line-* 为土壤线方法、斜率、截距及偏差，X-SMI-Key 用于请求 /model5/tiles 瓦片
     """
-    with open("config/configuration_local.yaml", 'r', encoding='utf-8') as f:
-        config = yaml.safe_load(f)['model5']
-    geojson_save_dir = config['geojson-save-dir']
-    if not os.path.exists(geojson_save_dir):
-        os.makedirs(geojson_save_dir)
-    smi, data_info = nir_red_to_smi(red_tif_dir, nir_tif_dir)
+    from model5.algorithm import SOIL_LINE_METHODS, get_smi_geojson, lookup_smi_geojson, resolve_smi_key, \
+        smi_file_stem
 
-    tiff_path = get_file_name(red_tif_dir)
-    write_tiff_file(smi, data_info, tiff_path)
-
-    output_geojson_path = geojson_save_dir + tiff_path.split('/')[-1].replace('.tif', '.geojson')
-    success = generate_geoJSON(tiff_path, output_geojson_path)
-    headers = {"Content-Disposition": f"attachment; filename={output_geojson_path.split('/')[-1]}"}
+    if soil_line_method is not None and soil_line_method not in SOIL_LINE_METHODS:
+        return {"error": f"soil_line_method可选：{list(SOIL_LINE_METHODS)}"}
+    region_error = _check_region(region)
+    if region_error:
+        return region_error
+    vector = {"sieve_pixels": sieve_pixels, "dissolve": dissolve, "simplify_tolerance": simplify_tolerance,
+              "region": region}
+    # 同一组影像已计算过时直接返回缓存结果，不占用栅格计算进程
+    hit = await run_in_thread('io', lookup_smi_geojson, red_tif_dir, nir_tif_dir, soil_line_method, sample_step,
+                              compare_exact, vector)
+    if hit is not None:
+        success, (output_geojson_path, soil_line) = True, hit
+    else:
+        # 栅格计算在进程池中执行，不阻塞事件循环
+        success, output_geojson_path, soil_line = await run_in_process('raster', get_smi_geojson, red_tif_dir,
+                                                                       nir_tif_dir, soil_line_method, sample_step,
+                                                                       compare_exact, vector)
+    smi_key = await run_in_thread('io', resolve_smi_key, red_tif_dir, nir_tif_dir, soil_line_method, sample_step)
+    headers = {
+        "Content-Disposition": f"attachment; filename={smi_file_stem(red_tif_dir)}.geojson",
+        "X-Cache": "HIT" if hit is not None else "MISS",
+        "X-SMI-Key": smi_key,
+        **_soil_line_headers(soil_line),
+    }
     if success:
         return FileResponse(output_geojson_path, media_type="application/geo+json", headers=headers)
     else:
         return "Error"
 
 
+async def _follow_vector_file(vector, out_path):
+    """
+    在栅格计算进程池中矢量化，同时读取子进程正在写入的要素文件并逐块发送，子进程结束后发送剩余部分
+    :param vector: prepare_smi_vector 的返回值
+    :param out_path: 子进程写入的临时文件路径
+    :return: 字节流异步生成器，矢量化失败时抛出异常中断响应
+    """
+    from model5.algorithm import write_smi_vector
+    from model5.togeoJSON import STREAM_CHUNK_SIZE
+
+    task = asyncio.ensure_future(run_in_process('raster', write_smi_vector, vector, out_path))
+    # 客户端断开后子进程仍会写完并放入缓存，这里只取出异常，避免未处理异常的警告
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    f = None
+    try:
+        while True:
+            if f is None:
+                try:
+                    # 打开之后文件即使被移入缓存，仍可继续读到全部内容
+                    f = await run_in_thread('io', open, out_path, 'rb')
+                except FileNotFoundError:
+                    if task.done():
+                        # 打开前已写完并移入缓存；失败时临时文件已删除，result() 抛出异常
+                        f = await run_in_thread('io', open, task.result(), 'rb')
+                    else:
+                        await asyncio.wait({task}, timeout=STREAM_POLL_SECONDS)
+                    continue
+            finished = task.done()  # 在读取前判断，之后读到文件末尾即为全部内容
+            chunk = await run_in_thread('io', f.read, STREAM_CHUNK_SIZE)
+            if chunk:
+                yield chunk
+            elif finished:
+                task.result()
+                return
+            else:
+                await asyncio.wait({task}, timeout=STREAM_POLL_SECONDS)
+    finally:
+        if f is not None:
+            f.close()
+
+
+@router_5.get('/get_smi_stream')
+async def get_smi_stream(red_tif_dir: str, nir_tif_dir: str, format: str = 'ndjson',
+                         soil_line_method: Optional[str] = None, sample_step: Optional[int] = None,
+                         sieve_pixels: Optional[int] = None, region: Optional[str] = None):
+    """
+    获取土壤含水量分级多边形，ndjson / geojson 边矢量化边发送，服务端内存占用与要素数量无关
+    fgb 的空间索引需在写入要素前建立，是唯一在矢量化完成后才整体返回的格式
+    \n:param red_tif_dir: 红波tif路径
+    \n:param nir_tif_dir: 近红外tif路径
+    \n:param format: ndjson（每行一个GeoJSON要素）/ geojson（FeatureCollection）/ fgb（带空间索引的FlatGeobuf）
+    \n:param soil_line_method: 土壤线提取方法 exact / sample，默认取配置
+    \n:param sample_step: sample 方法的抽样间隔
+    \n:param sieve_pixels: 最小图斑面积（像元数），默认取配置
+    \n:param region: 干旱分级所属区域，默认 default
+    \n:return: 要素文件，响应头 X-SMI-Key 用于请求 /model5/tiles 瓦片
+    """
+    from model5.algorithm import SOIL_LINE_METHODS, prepare_smi_vector, smi_file_stem, write_smi_vector
+    from model5.result_cache import get_result_cache
+
+    if format not in STREAM_MEDIA_TYPES:
+        return {"error": f"format可选：{list(STREAM_MEDIA_TYPES)}"}
+    if soil_line_method is not None and soil_line_method not in SOIL_LINE_METHODS:
+        return {"error": f"soil_line_method可选：{list(SOIL_LINE_METHODS)}"}
+    region_error = _check_region(region)
+    if region_error:
+        return region_error
+    # 土壤含水量计算、重分类、去碎斑和矢量化都在进程池中执行，受栅格计算并发上限约束，结果按输入缓存
+    vector = await run_in_process('raster', prepare_smi_vector, red_tif_dir, nir_tif_dir, format, soil_line_method,
+                                  sample_step, sieve_pixels, region)
+    headers = {
+        "Content-Disposition": f"attachment; filename={smi_file_stem(red_tif_dir)}.{format}",
+        "X-SMI-Key": vector["smi_key"],
+        **_soil_line_headers(vector["soil_line"]),
+    }
+    media_type = STREAM_MEDIA_TYPES[format]
+    if vector["path"] is not None:
+        return FileResponse(vector["path"], media_type=media_type, headers=headers)
+    out_path = await run_in_thread('io', get_result_cache().temp_path, '.' + format)
+    if format == 'fgb':
+        vector_path = await run_in_process('raster', write_smi_vector, vector, out_path)
+        return FileResponse(vector_path, media_type=media_type, headers=headers)
+    return StreamingResponse(_follow_vector_file(vector, out_path), media_type=media_type, headers=headers)
+
+
+@router_5.get('/tiles/{z}/{x}/{y}')
+async def get_smi_tile(z: int, x: int, y: int, key: str, region: Optional[str] = None):
+    """
+    土壤含水量分级图的PNG地图瓦片（Web Mercator z/x/y），按需生成并缓存
+    \n:param key: 土壤含水量结果的缓存键，即 /model5/get_smi 响应头 X-SMI-Key
+    \n:param region: 干旱分级所属区域，默认 default
+    \n:return: 256×256 PNG，影像范围外为透明瓦片
+    """
+    from model5.tiles import get_tile
+
+    region_error = _check_region(region)
+    if region_error:
+        return region_error
+    try:
+        png = await run_in_thread('io', get_tile, key, z, x, y, region)
+    except (ValueError, FileNotFoundError) as e:
+        return {"error": str(e)}
+    return Response(png, media_type="image/png", headers={"Cache-Control": "public, max-age=86400"})
+
+
+@router_5.get('/heatmap')
+async def get_smi_heatmap_image(key: str, size: Optional[int] = None, cmap: str = 'viridis'):
+    """
+    土壤含水量热度图PNG，按图片尺寸读取金字塔层并缓存
+    \n:param key: 土壤含水量结果的缓存键，即 /model5/get_smi 响应头 X-SMI-Key
+    \n:param size: 图片长边的最大像素数，默认1024
+    \n:param cmap: matplotlib 色带名称，如 viridis、RdYlGn
+    \n:return: PNG，无效值为透明
+    """
+    from model5.heatmap import DEFAULT_MAX_SIZE, get_smi_heatmap
+
+    size = size or DEFAULT_MAX_SIZE
+    if not 1 <= size <= 8192:
+        return {"error": "size需在1~8192之间"}
+    try:
+        png = await run_in_thread('io', get_smi_heatmap, key, size, cmap)
+    except KeyError:
+        return {"error": f"未知色带{cmap}"}
+    except (ValueError, FileNotFoundError) as e:
+        return {"error": str(e)}
+    return Response(png, media_type="image/png")
+
+
 @router_5.get('/download_file')
 async def download_file(file_path):
-    if os.path.exists(file_path):
+    if await run_in_thread('io', os.path.isfile, file_path):
         filename = file_path.split('/')[-1]
         headers = {"Content-Disposition": f"attachment; filename={filename}"}
         return FileResponse(file_path, media_type="image/tiff", headers=headers)
@@ -66,17 +280,20 @@ async def download_file(file_path):
 
 
 @router_5.get('/dynamic_smi')
-def dynamic_smi(data: dict):
+async def dynamic_smi(data: dict):
     """
     获取连续多个tif土壤含水量数组，以得到动态土壤水分演变
+    各景在栅格计算进程池中并行处理（与其他栅格接口共用并发上限），每完成一景就写入zip并开始发送，已处理过的影像直接复用结果
     \n:param data: 包含一个file_list数组，数组中每个json对象都是{"red_dir":"","nir_dir":""}
-    \n:return: smi_list
+    \n:return: 各景geojson的zip，处理失败的景记录在 errors.json 中
     """
+    from model5.pipeline import stream_scenes_zip
+
     file_list = data["file_list"]
-    folder_path = get_dynamic_smi(file_list)
-    output_dir = folder_path + '.zip'
-    zipDir(folder_path, output_dir)
-    return FileResponse(output_dir, media_type="application/zip")
+    filename = dt.datetime.now().strftime("%Y%m%d%H%M%S") + '.zip'
+    headers = {"Content-Disposition": f"attachment; filename={filename}"}
+    return StreamingResponse(stream_scenes_zip(file_list), media_type="application/zip",
+                             headers=headers)
 
 @router_5.get('/get_continuous_no_rain_day')
 def get_continuous_no_rain_day():
@@ -84,40 +301,131 @@ def get_continuous_no_rain_day():
     获得连续无雨日
     \n:return: 连续无语日列表和无雨天数
     """
+    from model5.algorithm import get_continuous_dry_day
+
     encoded_data = get_continuous_dry_day()
     return encoded_data
 
 
 @router_5.get('/get_rain_avg_lap_rate')
-def get_rain_avg_lap_rate_service(span: str, stage_inflow, date=None, history_file_dir: Optional[str] = None) -> str:
+def get_rain_avg_lap_rate_service(span: str, stage_inflow, date=None, history_file_dir: Optional[str] = None,
+                                  baseline: str = 'last_year') -> str:
     """
     计算降雨距平指数
     \n:param span: 时间跨度['year', 'month', 'xun']
     \n:param stage_inflow: 当前阶段降雨量，单位：毫米mm
     \n:param date: 日期，默认为当前日期
+    \n:param history_file_dir: 历史数据目录或CSV，默认取配置
+    \n:param baseline: 比较基准 last_year（去年同期）/ mean（多年同期平均）
     \n:return: 降雨平均指数
     """
+    from model5.algorithm import get_rain_avg_lap_rate
+    from model5.precip_index import SPANS
+
     if date is None:
         date = dt.datetime.now()
     if type(date) == str:
         date = dt.datetime.strptime(date, "%Y-%m-%d")
-    if not span in ['year', 'month', 'xun']:
+    if not span in SPANS:
         return "span输入错误"
-    rate = get_rain_avg_lap_rate(span, stage_inflow, date, history_file_dir)
+    if baseline not in ('last_year', 'mean'):
+        return "baseline输入错误"
+    rate = get_rain_avg_lap_rate(span, stage_inflow, date, history_file_dir, baseline)
     return rate
 
 
+@router_5.post('/rain_anomaly_batch')
+def rain_anomaly_batch(data: RainAnomalyBatch):
+    """
+    批量计算降雨距平（相对常年值的偏多/偏少百分率）及在历史同期中的百分位
+    \n:param items: [{"span": "year"/"month"/"xun", "date": "2025-07-15", "value": 当前时段降雨量(mm)}]
+    \n:param normal_years: 常年值年数，如 10/20/30，默认取配置；历史数据不足时使用参考常年值（model1/data/ave_precip.json）
+    \n:param history_file_dir: 历史数据目录或CSV，默认取配置
+    \n:return: 与 items 一一对应的 [{"span", "date", "value", "start", "end", "normal", "anomaly_pct", "percentile",
+    "years", "normal_source"}]，无可比数据时对应数值为 null
+    """
+    from model5.precip_index import SPANS, get_precip_index, load_reference_normal
+
+    normal_years = data.normal_years or int(load_config('model5').get('rain-anomaly-normal-years', 30))
+    if normal_years <= 0:
+        return {"error": "normal_years需大于0"}
+    spans = [item.span for item in data.items]
+    if any(span not in SPANS for span in spans):
+        return {"error": f"span可选：{list(SPANS)}"}
+    if not data.items:
+        return []
+    index = get_precip_index(data.history_file_dir)
+    result = index.anomaly_batch(spans, [item.date for item in data.items], [item.value for item in data.items],
+                                 normal_years, load_reference_normal())
+    return [{
+        "span": item.span,
+        "date": item.date.isoformat(),
+        "value": item.value,
+        "start": result["start"][i].isoformat(),
+        "end": result["end"][i].isoformat(),
+        "normal": _finite(result["normal"][i], 1),
+        "anomaly_pct": _finite(result["anomaly_pct"][i], 1),
+        "percentile": _finite(result["percentile"][i], 1),
+        "years": int(result["years"][i]),
+        "normal_source": result["normal_source"][i],
+    } for i, item in enumerate(data.items)]
+
+
+def _finite(value, ndigits):
+    """NaN（无可比数据）转换为 None"""
+    return None if math.isnan(value) else round(float(value), ndigits)
+
+
+@router_5.post('/smi_forecast')
+async def smi_forecast(data: SmiForecastRequest):
+    """
+    用实测点校正土壤含水量网格，并给出多日预报
+    \n:param humidity: 二维土壤含水量网格
+    \n:param days: 预报天数列表，如 [1, 2, 3]
+    \n:param true_points: 实测点 [{"x": 行号, "y": 列号, "true_humidity": 实测值}]
+    \n:param method: 校正方法 offset（整体平移）/ idw（反距离加权插值残差），默认取配置
+    \n:param neighbors: idw 每个网格使用的最近实测点数，默认取配置
+    \n:param power: idw 距离幂次，默认取配置
+    \n:param max_distance: idw 只使用该距离（网格数）以内的实测点，默认不限
+    \n:return: {"days": 预报天数, "forecast": [天数][行][列]}
+    """
+    import numpy as np
+    from model5.forecast import CALIBRATION_METHODS, forecast
+
+    if data.method is not None and data.method not in CALIBRATION_METHODS:
+        return {"error": f"method可选：{list(CALIBRATION_METHODS)}"}
+    grid = np.asarray(data.humidity, dtype=np.float64)
+    if grid.ndim != 2:
+        return {"error": "humidity需为二维数组"}
+    true_points = [point.model_dump() for point in data.true_points]
+    try:
+        result = await run_in_process('raster', forecast, grid, data.days, true_points, data.method, data.neighbors,
+                                      data.power, data.max_distance)
+    except ValueError as e:
+        return {"error": str(e)}
+    return {"days": data.days, "forecast": np.round(result, 2).tolist()}
+
+
 @router_5.post('/upload_file')
 async def upload_file(files: List[UploadFile] = File(...)):
+    """
+    上传红波段和近红外波段tif文件，分块写入磁盘，内容相同的文件不会重复保存
+    \n:param files: 选择文件
+    \n:return: file_path: 保存路径列表，files: 每个文件的路径、sha256、大小以及是否为重复上传
+    """
     full_path_list = []
+    file_info_list = []
     for file in files:
-        file_content = await file.read()  # 读取文件
-        save_file = config['upload-save-dir']
+        save_file = load_config('model5')['upload-save-dir']
         filename = file.filename
         full_path = os.path.join(save_file, filename)
-        with open(full_path, "wb") as tiff:
-            tiff.write(file_content)
-        full_path_list.append(full_path)
+        try:
+            info = await run_in_thread('io', save_upload_file, file, full_path)  # 在线程中写入文件
+        except UploadTooLarge as e:
+            return {"error": f"{filename}: {e}"}
+        full_path_list.append(info["file_path"])
+        file_info_list.append(info)
     return {
         "file_path": full_path_list,
+        "files": file_info_list,
     }
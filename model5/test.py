@@ -26,18 +26,11 @@ with rasterio.open(input_tif) as src:
     if nodata is not None:
         band[band == nodata] = np.nan
     
-    # 创建重分类后的数组
-    classified = np.full(band.shape, np.nan)  # 初始化为NaN
-    
-    # 2. 重分类：将连续值映射到等级
-    for min_val, max_val, code, name in classes:
-        if min_val == 0.0:
-            # 重旱: < 0.25
-            mask = (band < max_val)
-        else:
-            # 其他区间: [min_val, max_val)
-            mask = (band >= min_val) & (band < max_val)
-        classified[mask] = code
+    # 2. 重分类：按各等级上限分组，一次 np.digitize 查表得到等级代码（uint8），NaN 与 ≥1.0 落在最后一组
+    ordered = sorted(classes, key=lambda c: c[1])
+    edges = np.array([c[1] for c in ordered], dtype=np.float32)
+    level_lut = np.array([c[2] for c in ordered] + [0], dtype=np.uint8)  # 0 表示无效
+    classified = level_lut[np.digitize(band, edges)]
     
     # 设置仿射变换（用于坐标转换）
     transform = src.transform
@@ -46,7 +39,7 @@ with rasterio.open(input_tif) as src:
 # 3. 矢量化：将栅格转为多边形
 results = (
     {'properties': {'DN': v}, 'geometry': s}
-    for s, v in shapes(classified.astype(np.float32), mask=np.isfinite(classified), transform=transform)
+    for s, v in shapes(classified, mask=classified > 0, transform=transform)
 )
 
 # 4. 转换为GeoJSON格式
@@ -0,0 +1,207 @@
+"""
+土壤含水量分级图的地图瓦片
+
+网页地图按 Web Mercator (EPSG:3857) 的 z/x/y 瓦片请求可见范围，
+瓦片由结果缓存中的土壤含水量COG按需生成：只读取瓦片范围内、与缩放级别相当的金字塔层，
+重投影后按干旱等级着色为PNG。生成的瓦片保存在进程内的LRU缓存中。
+"""
+import io
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import rasterio
+from PIL import Image
+from affine import Affine
+from rasterio.enums import Resampling
+from rasterio.warp import reproject, transform_bounds
+from rasterio.windows import from_bounds
+
+from model5.result_cache import get_result_cache
+from model5.togeoJSON import decode_smi, get_classes, reclassify
+from utils.config import load_config
+
+TILE_SIZE = 256
+WEB_MERCATOR = 'EPSG:3857'
+ORIGIN_SHIFT = 2 * math.pi * 6378137 / 2.0  # Web Mercator 半周长（米）
+NODATA = -9999.0
+DEFAULT_CACHE_SIZE = 4096  # 缓存的瓦片数量
+
+CLASS_COLORS = {  # 默认分级表各等级代码的颜色 RGBA
+    2: (26, 150, 65, 200),  # 湿润
+    3: (255, 255, 128, 200),  # 轻旱
+    4: (253, 174, 97, 200),  # 中旱
+    5: (215, 25, 28, 200),  # 重旱
+}
+PALETTE_STOPS = [CLASS_COLORS[code] for code in sorted(CLASS_COLORS)]  # 生成其他等级颜色的色带：湿润 → 重旱
+
+
+def parse_color(value):
+    """
+    :param value: '#rrggbb' / '#rrggbbaa' 或 [r, g, b] / [r, g, b, a]
+    :return: (r, g, b, a)，未指定透明度时为 200
+    """
+    if isinstance(value, str):
+        value = value.lstrip('#')
+        if len(value) not in (6, 8):
+            raise ValueError(f"无效的颜色：#{value}")
+        value = [int(value[i:i + 2], 16) for i in range(0, len(value), 2)]
+    color = tuple(int(v) for v in value)
+    if len(color) == 3:
+        color += (200,)
+    if len(color) != 4 or not all(0 <= v <= 255 for v in color):
+        raise ValueError(f"无效的颜色：{value}")
+    return color
+
+
+def _palette_color(fraction):
+    """在 PALETTE_STOPS 色带上按位置 fraction（0~1）线性插值"""
+    position = fraction * (len(PALETTE_STOPS) - 1)
+    i = min(int(position), len(PALETTE_STOPS) - 2)
+    low, high = np.array(PALETTE_STOPS[i], dtype=float), np.array(PALETTE_STOPS[i + 1], dtype=float)
+    return tuple(int(round(v)) for v in low + (high - low) * (position - i))
+
+
+def class_colors(classes):
+    """
+    各等级代码的颜色：分级表第5项中配置的颜色，否则默认分级的等级代码用 CLASS_COLORS，
+    其余等级按代码从小（湿润）到大（干旱）在色带上均匀取色
+    :param classes: 分级表，见 togeoJSON.get_classes
+    :return: {等级代码: RGBA}
+    """
+    codes = sorted({int(item[2]) for item in classes})
+    colors = {}
+    for item in classes:
+        if len(item) > 4 and item[4] is not None:
+            colors.setdefault(int(item[2]), parse_color(item[4]))
+    uses_default_codes = set(codes) <= set(CLASS_COLORS)
+    for i, code in enumerate(codes):
+        if code not in colors:
+            colors[code] = CLASS_COLORS[code] if uses_default_codes \
+                else _palette_color(i / (len(codes) - 1) if len(codes) > 1 else 1.0)
+    return colors
+
+
+def color_lut(classes):
+    """
+    :return: 等级代码 → RGBA 的查找表 (256×4)，代码 0（无效）为透明
+    """
+    lut = np.zeros((256, 4), dtype=np.uint8)
+    for code, color in class_colors(classes).items():
+        lut[code] = color
+    return lut
+
+
+def tile_bounds(z, x, y):
+    """
+    :return: 瓦片在 EPSG:3857 下的范围 (minx, miny, maxx, maxy)
+    """
+    size = 2 * ORIGIN_SHIFT / (2 ** z)
+    minx = -ORIGIN_SHIFT + x * size
+    maxy = ORIGIN_SHIFT - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def _encode_png(rgba):
+    buffer = io.BytesIO()
+    Image.fromarray(rgba, 'RGBA').save(buffer, format='PNG', optimize=False)
+    return buffer.getvalue()
+
+
+EMPTY_TILE = _encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8))
+
+
+def render_tile(smi_tif, z, x, y, region=None):
+    """
+    生成一张PNG瓦片
+    :param smi_tif: 土壤含水量tif（COG）路径
+    :param region: 干旱分级所属区域，见 togeoJSON.get_classes
+    :return: PNG字节，瓦片与影像不相交时为透明瓦片
+    """
+    bounds = tile_bounds(z, x, y)
+    dst_transform = Affine((bounds[2] - bounds[0]) / TILE_SIZE, 0, bounds[0],
+                           0, -(bounds[3] - bounds[1]) / TILE_SIZE, bounds[3])
+    with rasterio.open(smi_tif) as src:
+        left, bottom, right, top = transform_bounds(WEB_MERCATOR, src.crs, *bounds)
+        if right <= src.bounds.left or left >= src.bounds.right or top <= src.bounds.bottom \
+                or bottom >= src.bounds.top:
+            return EMPTY_TILE
+        window = from_bounds(left, bottom, right, top, transform=src.transform)
+        # 按瓦片分辨率读取，缩小显示时直接使用COG金字塔，不读全分辨率数据
+        out_height = max(1, min(int(round(window.height)), 2 * TILE_SIZE))
+        out_width = max(1, min(int(round(window.width)), 2 * TILE_SIZE))
+        fill_value = src.nodata if src.nodata is not None else NODATA
+        raw = src.read(1, window=window, out_shape=(out_height, out_width), boundless=True, fill_value=fill_value,
+                       resampling=Resampling.nearest)
+        data = decode_smi(raw, fill_value, src.scales[0], src.offsets[0])
+        src_transform = src.window_transform(window) * Affine.scale(window.width / out_width,
+                                                                    window.height / out_height)
+        src_crs = src.crs
+
+    data[np.isnan(data)] = NODATA
+    tile = np.full((TILE_SIZE, TILE_SIZE), NODATA, dtype=np.float32)
+    reproject(data, tile, src_transform=src_transform, src_crs=src_crs, src_nodata=NODATA,
+              dst_transform=dst_transform, dst_crs=WEB_MERCATOR, dst_nodata=NODATA, resampling=Resampling.nearest)
+    tile[tile == NODATA] = np.nan
+    classes = get_classes(region)
+    codes = reclassify(tile, classes)
+    if not codes.any():
+        return EMPTY_TILE
+    return _encode_png(color_lut(classes)[codes])
+
+
+class TileCache:
+    """进程内的瓦片LRU缓存"""
+
+    def __init__(self, max_items=DEFAULT_CACHE_SIZE):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+
+_tile_cache = None
+_tile_cache_lock = threading.Lock()
+
+
+def _get_tile_cache():
+    global _tile_cache
+    with _tile_cache_lock:
+        if _tile_cache is None:
+            _tile_cache = TileCache(int(load_config('tiles').get('cache-size', DEFAULT_CACHE_SIZE)))
+        return _tile_cache
+
+
+def get_tile(smi_key, z, x, y, region=None):
+    """
+    获取瓦片，先查LRU缓存
+    :param smi_key: 土壤含水量tif的缓存键（/model5/get_smi 响应头 X-SMI-Key）
+    :param region: 干旱分级所属区域
+    :return: PNG字节
+    """
+    if not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+        raise ValueError(f"瓦片坐标超出范围：{z}/{x}/{y}")
+    tile_cache = _get_tile_cache()
+    png = tile_cache.get((smi_key, region, z, x, y))
+    if png is not None:
+        return png
+    result_cache = get_result_cache()
+    if result_cache.get(smi_key, ('.tif',)) is None:
+        raise FileNotFoundError(f"未找到土壤含水量结果{smi_key}，请先调用 /model5/get_smi")
+    png = render_tile(result_cache.path(smi_key, '.tif'), z, x, y, region)
+    tile_cache.put((smi_key, region, z, x, y), png)
+    return png
@@ -1,14 +1,15 @@
+import json
+
 import geopandas as gpd
 import numpy as np
+import pyogrio
 import rasterio
-import yaml
-from rasterio.features import shapes
+import shapely
+from rasterio.features import shapes, sieve
+from shapely.geometry import shape
 import utils.file_path_processor
-
-with open("config/configuration_local.yaml", 'r', encoding='utf-8') as f:
-    config = yaml.safe_load(f)['model5']
-
-tif_temp_dir = config['tif-temp-dir']  # 重分类后临时tif文件存放路径
+from utils.config import load_config
+from utils.metrics import span
 
 
 # ========================
@@ -16,62 +17,284 @@ tif_temp_dir = config['tif-temp-dir']  # 重分类后临时tif文件存放路径
 # ========================
 
 
-def generate_geoJSON(input_tif_path, out_geojson_path):
-    output_geojson = out_geojson_path
-    input_tif = input_tif_path
-    classes = [
-        (0.6, 1.0, 2, "湿润"),
-        (0.5, 0.6, 3, "轻度干旱"),
-        (0.4, 0.5, 4, "中度干旱"),
-        (0.3, 0.4, 5, "严重干旱"),
-        (0.00, 0.3, 5, "特大干旱")  # 注意：<0.25
-    ]
+# 土壤含水量分级 (min, max, level_code, level_name)，配置中的分级表还可以有第5项：瓦片颜色
+CLASSES = [
+    (0.6, 1.0, 2, "湿润"),
+    (0.5, 0.6, 3, "轻度干旱"),
+    (0.4, 0.5, 4, "中度干旱"),
+    (0.3, 0.4, 5, "严重干旱"),
+    (0.00, 0.3, 5, "特大干旱")  # 注意：<0.25
+]
+STREAM_CHUNK_SIZE = 64 * 1024  # 流式输出时每次发送的字节数
+RECLASS_CHUNK = 1 << 20  # 重分类时每段处理的像元数
+
+
+def get_classes(region=None):
+    """
+    获取干旱分级表
+    :param region: 区域名称，对应配置 model5.drought-classes 中的键，None 表示 default
+    :return: 分级表 [(min, max, level_code, level_name)]
+    """
+    tables = load_config('model5').get('drought-classes') or {}
+    name = region or 'default'
+    if name not in tables:
+        if region is None:
+            return CLASSES
+        raise ValueError(f"未配置区域{region}的干旱分级，可选：{list(tables)}")
+    return [tuple(item) for item in tables[name]]
+
+
+def level_names(classes):
+    """
+    等级代码对应的级别名称，同一代码有多个区间时取分级表中第一个区间的名称
+    :param classes: 分级表，见 get_classes
+    :return: {等级代码: 级别名称}
+    """
+    names = {}
+    for item in classes:
+        names.setdefault(int(item[2]), item[3])
+    return names
+
+
+def _class_lut(classes, dtype):
+    """
+    把分级表转换为分组边界和查找表：np.digitize 得到的第 i 组为 [edges[i-1], edges[i])，对应等级代码 lut[i]
+    min 为 0 的等级包含所有小于 max 的值；等级重叠时与逐个等级赋值一样，以后面的等级为准
+    """
+    edges = sorted({value for item in classes for value in item[:2]})
+    lower = [-np.inf] + edges
+    upper = edges + [np.inf]
+    lut = np.zeros(len(edges) + 1, dtype=np.uint8)
+    for i in range(len(lut)):
+        for min_val, max_val, code in (item[:3] for item in classes):
+            low = -np.inf if min_val == 0.0 else min_val
+            if low <= lower[i] and upper[i] <= max_val:
+                lut[i] = code
+    return np.array(edges, dtype=dtype), lut
+
+
+def reclassify(band, classes=CLASSES):
+    """
+    重分类：将连续的土壤含水量映射到等级代码，一次 np.digitize 查表完成
+    :param band: 土壤含水量数组，无效值为 NaN
+    :param classes: 分级表 [(min, max, level_code, level_name)]
+    :return: 等级代码数组（uint8），不属于任何等级的为 0
+    """
+    band = np.ascontiguousarray(band)
+    # 分组边界与数组同精度，比较结果与直接用阈值比较一致
+    edges, lut = _class_lut(classes, band.dtype if band.dtype.kind == 'f' else np.float64)
+    codes = np.empty(band.shape, dtype=np.uint8)
+    band_flat, codes_flat = band.reshape(-1), codes.reshape(-1)
+    for start in range(0, band_flat.size, RECLASS_CHUNK):  # 分段处理，np.digitize 的 int64 结果不占用整幅内存
+        codes_flat[start:start + RECLASS_CHUNK] = lut[np.digitize(band_flat[start:start + RECLASS_CHUNK], edges)]
+    if lut[-1] != 0:
+        codes[np.isnan(band)] = 0  # NaN 落在最后一组
+    return codes
+
+
+def vector_options(sieve_pixels=None, dissolve=None, simplify_tolerance=None, region=None):
+    """
+    补全矢量化参数，未指定的取配置 model5.geojson-*
+    :param sieve_pixels: 最小图斑面积（像元数），小于该面积的图斑并入相邻的最大图斑，0 表示不处理
+    :param dissolve: 是否按干旱等级合并图斑
+    :param simplify_tolerance: 简化容差（像元），0 表示不简化
+    :param region: 干旱分级所属区域，见 get_classes
+    :return: generate_geoJSON 的关键字参数
+    """
+    config = load_config('model5')
+    return {
+        "region": region,
+        "sieve_pixels": int(config.get('geojson-sieve-pixels', 0) if sieve_pixels is None else sieve_pixels),
+        "dissolve": bool(config.get('geojson-dissolve', False) if dissolve is None else dissolve),
+        "simplify_tolerance": float(config.get('geojson-simplify-tolerance', 0)
+                                    if simplify_tolerance is None else simplify_tolerance),
+    }
+
+
+def _simplify(geometries, tolerance):
+    """
+    简化多边形并保持相邻图斑的公共边一致（shapely>=2.1 的 coverage_simplify），
+    低版本shapely只能逐个保持拓扑简化，相邻图斑之间可能出现细小缝隙
+    """
+    if hasattr(shapely, 'coverage_simplify'):
+        return shapely.coverage_simplify(geometries, tolerance)
+    return shapely.simplify(geometries, tolerance, preserve_topology=True)
+
+
+def decode_smi(data, nodata=None, scale=1.0, offset=0.0):
+    """
+    把tif中读出的原始值还原为土壤含水量
+    :param data: 原始数组
+    :param nodata: nodata值
+    :param scale: 波段 scale（uint8 量化存储时为 0.01）
+    :param offset: 波段 offset
+    :return: float32 数组，nodata 为 NaN
+    """
+    if scale != 1.0 or offset != 0.0:
+        # 以 float64 还原后再转 float32，与直接以 float32 存储的值一致（如 60 × 0.01 → 0.6）
+        band = (data * float(scale) + float(offset)).astype(np.float32)
+    else:
+        band = data.astype(np.float32)
+    if nodata is not None:
+        band[data == nodata] = np.nan
+    return band
 
+
+def classify_tif(input_tif_path, sieve_pixels=0, region=None):
+    """
+    读取土壤含水量tif并重分类
+    :param input_tif_path: 土壤含水量tif路径
+    :param sieve_pixels: 最小图斑面积（像元数），小于该面积的碎斑并入相邻的最大图斑，0 表示不处理
+    :param region: 干旱分级所属区域，见 get_classes
+    :return: (等级代码 uint8 数组（0 表示无效）, 有效掩膜, 仿射变换, 坐标系)
+    """
     # 1. 读取TIFF文件
-    with rasterio.open(input_tif) as src:
-        # 读取第一个波段（假设是单波段）
-        band = src.read(1).astype(np.float32)
-
-        # 获取NoData值
-        nodata = src.nodata
-        if nodata is not None:
-            band[band == nodata] = np.nan
-
-        # 创建重分类后的数组
-        classified = np.full(band.shape, np.nan)  # 初始化为NaN
-
-        # 2. 重分类：将连续值映射到等级
-        for min_val, max_val, code, name in classes:
-            if min_val == 0.0:
-                # 重旱: < 0.25
-                mask = (band < max_val)
-            else:
-                # 其他区间: [min_val, max_val)
-                mask = (band >= min_val) & (band < max_val)
-            classified[mask] = code
+    with span('raster_read'), rasterio.open(input_tif_path) as src:
+        # 读取第一个波段（假设是单波段），NoData 置为 NaN，量化存储的按 scale/offset 还原
+        band = decode_smi(src.read(1), src.nodata, src.scales[0], src.offsets[0])
 
         # 设置仿射变换（用于坐标转换）
         transform = src.transform
         crs = src.crs
 
-    # 3. 矢量化：将栅格转为多边形
-    results = (
-        {'properties': {'DN': v}, 'geometry': s}
-        for s, v in shapes(classified.astype(np.float32), mask=np.isfinite(classified), transform=transform)
-    )
+    with span('raster_compute'):
+        # 2. 重分类：将连续值映射到等级，等级代码为小整数，0 表示无效
+        codes = reclassify(band, get_classes(region))
+
+        # 3. 去除小于最小图斑面积的碎斑（并入相邻的最大图斑）
+        valid = codes > 0
+        if sieve_pixels > 1:
+            codes = sieve(codes, size=sieve_pixels, mask=valid, connectivity=4)
+    return codes, valid, transform, crs
+
+
+def iter_features(codes, valid, transform, names):
+    """
+    逐个生成矢量化后的GeoJSON要素，不在内存中保存全部要素
+    :param names: {等级代码: 级别名称}，见 level_names
+    :return: 要素dict生成器
+    """
+    for geom, value in shapes(codes, mask=valid, transform=transform):
+        code = int(value)
+        yield {"type": "Feature", "properties": {"DN": code, "level_name": names.get(code)}, "geometry": geom}
 
-    # 4. 转换为GeoJSON格式
-    features = list(results)
+
+def _crs_member(crs):
+    """GeoJSON 的 crs 成员（与GDAL输出一致），WGS84 或无坐标系时省略"""
+    epsg = crs.to_epsg() if crs is not None else None
+    if epsg is None or epsg == 4326:
+        return ''
+    return f'"crs": {{"type": "name", "properties": {{"name": "urn:ogc:def:crs:EPSG::{epsg}"}}}},\n'
+
+
+def stream_features(features, fmt='geojson', crs=None, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    把要素流式编码为文本，边矢量化边输出
+    :param features: 要素dict生成器
+    :param fmt: 'geojson' 标准 FeatureCollection / 'ndjson' 每行一个要素
+    :param crs: 坐标系，geojson 格式写入 crs 成员
+    :param chunk_size: 累计到该字节数后输出一次
+    :return: bytes 生成器
+    """
+    buffer = []
+    size = 0
+    if fmt == 'geojson':
+        header = '{\n"type": "FeatureCollection",\n' + _crs_member(crs) + '"features": [\n'
+        buffer.append(header.encode('utf-8'))
+    separator = b',\n' if fmt == 'geojson' else b'\n'
+    first = True
     for feature in features:
-        feature['properties']['DN'] = int(feature['properties']['DN'])  # 转为整数
+        line = json.dumps(feature, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        if fmt == 'geojson' and not first:
+            buffer.append(separator)
+        buffer.append(line if fmt == 'geojson' else line + separator)
+        first = False
+        size += len(line)
+        if size >= chunk_size:
+            yield b''.join(buffer)
+            buffer, size = [], 0
+    if fmt == 'geojson':
+        buffer.append(b'\n]\n}\n')
+    yield b''.join(buffer)
+
+
+def write_features(input_tif_path, out_path, fmt='geojson', sieve_pixels=0, region=None):
+    """
+    土壤含水量tif重分类、矢量化并逐块写入文件，内存占用与要素数量无关
+    :param fmt: 'geojson' 标准 FeatureCollection / 'ndjson' 每行一个要素
+    :return: 是否成功
+    """
+    codes, valid, transform, crs = classify_tif(input_tif_path, sieve_pixels, region)
+    features = iter_features(codes, valid, transform, level_names(get_classes(region)))
+    with span('polygonize'), open(out_path, 'wb') as f:  # 矢量化与写出交替进行，一并计时
+        for chunk in stream_features(features, fmt, crs):
+            f.write(chunk)
+    return True
+
+
+def write_flatgeobuf(input_tif_path, out_path, sieve_pixels=0, region=None):
+    """
+    矢量化为带空间索引的FlatGeobuf，要素只以WKB数组形式保存一份
+    空间索引需在写入要素前建立，无法边矢量化边输出
+    :return: 要素数量
+    """
+    codes, valid, transform, crs = classify_tif(input_tif_path, sieve_pixels, region)
+    geometries, values = [], []
+    with span('polygonize'):
+        for geom, value in shapes(codes, mask=valid, transform=transform):
+            geometries.append(shapely.to_wkb(shape(geom)))
+            values.append(int(value))
+    values = np.array(values, dtype=np.int32)
+    names = level_names(get_classes(region))
+    name_values = np.array([names.get(v) for v in values], dtype=object)
+    with span('vector_write'):
+        pyogrio.raw.write(out_path, np.array(geometries, dtype=object), [values, name_values], ['DN', 'level_name'],
+                          driver='FlatGeobuf', geometry_type='Polygon', crs=crs.to_wkt() if crs else None,
+                          layer_options={'SPATIAL_INDEX': 'YES'})
+    return len(values)
+
+
+def generate_geoJSON(input_tif_path, out_geojson_path, sieve_pixels=0, dissolve=False, simplify_tolerance=0,
+                     region=None):
+    """
+    土壤含水量tif重分类后矢量化为geojson
+    不合并、不简化时要素边生成边写入文件，否则需先汇总到GeoDataFrame
+    :param input_tif_path: 土壤含水量tif路径
+    :param out_geojson_path: 输出geojson路径
+    :param sieve_pixels: 最小图斑面积（像元数），矢量化前去除小于该面积的碎斑，0 表示不处理
+    :param dissolve: 是否按干旱等级合并图斑，每个等级输出一个要素
+    :param simplify_tolerance: 简化容差（像元），0 表示不简化
+    :param region: 干旱分级所属区域，见 get_classes
+    :return: 是否成功
+    """
+    codes, valid, transform, crs = classify_tif(input_tif_path, sieve_pixels, region)
+
+    # 4. 矢量化：将栅格转为多边形
+    if not dissolve and simplify_tolerance <= 0:
+        with span('polygonize'), open(out_geojson_path, 'wb') as f:  # 矢量化与写出交替进行，一并计时
+            features = iter_features(codes, valid, transform, level_names(get_classes(region)))
+            for chunk in stream_features(features, 'geojson', crs):
+                f.write(chunk)
+        return True
+
+    geometries, values = [], []
+    with span('polygonize'):
+        for geom, value in shapes(codes, mask=valid, transform=transform):
+            geometries.append(shape(geom))
+            values.append(int(value))
 
     # 5. 创建GeoDataFrame
-    gdf = gpd.GeoDataFrame.from_features(features, crs=crs)
+    gdf = gpd.GeoDataFrame({'DN': values}, geometry=geometries, crs=crs)
+    if dissolve and len(gdf) > 0:
+        gdf = gdf.dissolve(by='DN', as_index=False)
+    if simplify_tolerance > 0 and len(gdf) > 0:
+        gdf['geometry'] = _simplify(gdf.geometry.values, simplify_tolerance * abs(transform.a))
+        gdf = gdf[~gdf.geometry.is_empty]
 
     # 6. （可选）添加级别名称字段
-    level_map = {2: "湿润", 3: "轻旱", 4: "中旱", 5: "重旱"}
-    gdf['level_name'] = gdf['DN'].map(level_map)
+    gdf['level_name'] = gdf['DN'].map(level_names(get_classes(region)))
 
     # 7. 保存为GeoJSON
-    gdf.to_file(output_geojson, driver='GeoJSON', encoding='utf-8')
+    with span('vector_write'):
+        gdf.to_file(out_geojson_path, driver='GeoJSON', encoding='utf-8')
     return True
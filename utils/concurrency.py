@@ -0,0 +1,99 @@
+"""
+异步接口中阻塞操作的卸载
+
+async 接口中不能直接调用 GDAL、rasterio、geopandas 或同步文件读写，否则会阻塞事件循环，
+所有其他请求都要等它结束。这里按接口类别限制并发：
+    - raster: CPU 密集的栅格计算，在有界进程池中执行
+    - io: 文件读写，在线程中执行
+各类别的并发上限在配置文件 concurrency 节中设置。
+"""
+import asyncio
+import functools
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import anyio
+
+from utils.config import load_config
+from utils.metrics import call_collecting_spans, merge_spans
+
+DEFAULT_LIMITS = {
+    'raster': 2,
+    'io': 8,
+}
+
+_process_pool = None
+_semaphores = {}
+_limiters = {}
+_lock = threading.Lock()
+
+
+def get_limit(route_class):
+    """
+    :param route_class: 接口类别，如 'raster'、'io'
+    :return: 该类别的并发上限
+    """
+    return int(load_config('concurrency').get(route_class, DEFAULT_LIMITS.get(route_class, 4)))
+
+
+def get_process_pool():
+    """
+    共享的栅格计算进程池；接口中应通过 run_in_process 提交，以受 raster 并发上限约束（预热等启动代码除外）
+    :return: ProcessPoolExecutor
+    """
+    global _process_pool
+    with _lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=get_limit('raster'),
+                                                mp_context=multiprocessing.get_context("spawn"))
+        return _process_pool
+
+
+def _get_semaphore(route_class):
+    with _lock:
+        if route_class not in _semaphores:
+            _semaphores[route_class] = asyncio.Semaphore(get_limit(route_class))
+        return _semaphores[route_class]
+
+
+def _get_limiter(route_class):
+    with _lock:
+        if route_class not in _limiters:
+            _limiters[route_class] = anyio.CapacityLimiter(get_limit(route_class))
+        return _limiters[route_class]
+
+
+async def run_in_process(route_class, func, *args, **kwargs):
+    """
+    在有界进程池中执行CPU密集型函数，超出并发上限的请求在此排队等待
+    :param route_class: 接口类别
+    :param func: 模块级函数（需可被pickle）
+    :return: 函数返回值
+    """
+    async with _get_semaphore(route_class):
+        loop = asyncio.get_running_loop()
+        result, spans = await loop.run_in_executor(get_process_pool(),
+                                                   functools.partial(call_collecting_spans, func, *args, **kwargs))
+    merge_spans(spans)  # 子进程中各阶段的耗时计入本进程的统计
+    return result
+
+
+async def run_in_thread(route_class, func, *args, **kwargs):
+    """
+    在线程中执行阻塞I/O函数，同一类别的线程数受并发上限限制
+    :param route_class: 接口类别
+    :param func: 阻塞函数
+    :return: 函数返回值
+    """
+    return await anyio.to_thread.run_sync(functools.partial(func, *args, **kwargs),
+                                          limiter=_get_limiter(route_class))
+
+
+def shutdown_process_pool():
+    """服务关闭时停止进程池"""
+    global _process_pool
+    with _lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
@@ -0,0 +1,29 @@
+import os
+import threading
+
+import yaml
+
+from utils.metrics import span
+
+CONFIG_FILE = "config/configuration_local.yaml"
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def load_config(section=None):
+    """
+    读取配置文件，文件未修改时直接返回缓存，避免每次请求都重新解析YAML
+    :param section: 配置节名称，如 'model5'，None 表示返回全部配置
+    :return: 配置dict（只读，请勿修改）
+    """
+    mtime = os.path.getmtime(CONFIG_FILE)
+    with _lock:
+        if _cache.get('mtime') != mtime:
+            with span('config_load'), open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+                _cache['config'] = yaml.safe_load(f)
+            _cache['mtime'] = mtime
+        config = _cache['config']
+    if section is None:
+        return config
+    return config.get(section) or {}
@@ -1,21 +1,35 @@
 import requests
-import yaml
 import utils.file_path_processor
+from utils.config import load_config
+from utils.metrics import span
+from utils.shared_cache import cached
+
+DEFAULT_API_URL = 'https://mp4bj8ygm9.re.qweatherapi.com'
+API_NAME = '/v7/weather/30d'
+
+_session = requests.Session()  # 复用连接，避免每次请求重新握手
+
 
 def request_weather():
-    with open("config/configuration_local.yaml", 'r', encoding='utf-8') as ymlfile:
-        cfg = yaml.safe_load(ymlfile)
-    hefeng = cfg['hefeng']
+    """
+    请求和风天气未来30天逐日预报，接口地址取配置 hefeng.api-url
+    预报在共享缓存中保存 shared-cache.ttl.weather 秒，各工作进程共用，不必每个请求都访问天气接口
+    :return: 响应JSON
+    """
+    hefeng = load_config('hefeng')
     api_key = hefeng['api-key']
     location = hefeng['location']  # 肥城
     latitude = hefeng['latitude']
     longitude = hefeng['longitude']
-    api_host = 'mp4bj8ygm9.re.qweatherapi.com'
-    api_name = '/v7/weather/30d'
-    url = f'https://{api_host}/{api_name}?location={longitude},{latitude}&key={api_key}'
-    res = requests.get(url)
-    json_data = res.json()
-    return json_data
+    api_url = hefeng.get('api-url', DEFAULT_API_URL).rstrip('/')
+    url = f'{api_url}{API_NAME}?location={longitude},{latitude}&key={api_key}'
+
+    def fetch():
+        with span('weather_fetch'):
+            res = _session.get(url, timeout=hefeng.get('timeout', 10))
+            res.raise_for_status()
+            return res.json()
+    return cached('weather', (api_url, API_NAME, longitude, latitude), fetch)
 
 
 if __name__ == '__main__':
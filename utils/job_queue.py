@@ -0,0 +1,336 @@
+"""
+后台任务队列
+
+长时间运行的计算（遥感反演、SARIMA拟合、配水优化等）以任务形式提交，在进程内的工作池中执行：
+    - thread: 线程池，适合I/O为主的任务
+    - process: 进程池，适合CPU密集型任务
+任务状态、进度、结果保存在可替换的存储后端中（MemoryJobStore / SQLiteJobStore）。
+任务函数的第一个参数为进度回调 progress(fraction, message)，调用时若任务已被取消会抛出 JobCancelled。
+"""
+import importlib
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from utils.config import load_config
+from utils.server import worker_count
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLING = "cancelling"
+CANCELLED = "cancelled"
+FINISHED_STATUS = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """任务已被取消"""
+
+
+class MemoryJobStore:
+    """进程内存储，服务重启后任务记录丢失"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job_id, kind, params):
+        now = time.time()
+        with self._lock:
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "kind": kind,
+                "status": QUEUED,
+                "progress": 0.0,
+                "message": "",
+                "params": params,
+                "result": None,
+                "error": None,
+                "created_at": now,
+                "updated_at": now,
+            }
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(fields)
+            job["updated_at"] = time.time()
+
+    def report_progress(self, job_id, progress, message):
+        """
+        更新进度，检查与写入在同一把锁内完成，不会覆盖并发的取消请求
+        :return: 任务已被取消时返回False
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return True
+            if job["status"] in (CANCELLING, CANCELLED):
+                return False
+            job.update(status=RUNNING, progress=progress, message=message, updated_at=time.time())
+            return True
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return None if job is None else dict(job)
+
+    def reporter(self, job_id):
+        """线程任务使用的进度回调"""
+        return ProgressReporter(job_id, store=self)
+
+    def process_reporter(self, job_id):
+        """进程任务无法访问内存存储，进度只在开始/结束时更新"""
+        return None
+
+
+class SQLiteJobStore:
+    """本地SQLite存储，任务记录在服务重启后仍可查询，且可跨进程更新进度"""
+
+    def __init__(self, db_path, init=True):
+        """
+        :param db_path: 数据库文件路径
+        :param init: 是否建表并清理上次未完成的任务，子进程中只需连接已有数据库
+        """
+        self.db_path = db_path
+        if not init:
+            return
+        db_dir = os.path.dirname(db_path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    kind TEXT,
+                    status TEXT,
+                    progress REAL,
+                    message TEXT,
+                    params TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL,
+                    updated_at REAL
+                )
+            """)
+            # 服务重启前未完成的任务已无法继续执行
+            conn.execute("UPDATE jobs SET status = ?, error = ? WHERE status IN (?, ?, ?)",
+                         (FAILED, "服务重启，任务中断", QUEUED, RUNNING, CANCELLING))
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create(self, job_id, kind, params):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (job_id, kind, QUEUED, 0.0, "", json.dumps(params, ensure_ascii=False), None, None,
+                          now, now))
+
+    def update(self, job_id, **fields):
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"], ensure_ascii=False, default=str)
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{k} = ?" for k in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE job_id = ?", (*fields.values(), job_id))
+
+    def report_progress(self, job_id, progress, message):
+        """
+        更新进度，取消状态的判断放在同一条UPDATE中，不会覆盖并发的取消请求
+        :return: 任务已被取消时返回False
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, progress = ?, message = ?, updated_at = ? "
+                "WHERE job_id = ? AND status NOT IN (?, ?)",
+                (RUNNING, progress, message, time.time(), job_id, CANCELLING, CANCELLED))
+            if cursor.rowcount:
+                return True
+            row = conn.execute("SELECT status FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return row is None or row["status"] not in (CANCELLING, CANCELLED)
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"]) if job["params"] else None
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def reporter(self, job_id):
+        return ProgressReporter(job_id, store=self)
+
+    def process_reporter(self, job_id):
+        """SQLite可跨进程访问，子进程中直接写入进度"""
+        return ProgressReporter(job_id, db_path=self.db_path)
+
+
+class ProgressReporter:
+    """任务进度回调，同时负责检查取消请求"""
+
+    def __init__(self, job_id, store=None, db_path=None):
+        """
+        :param store: 线程任务直接使用的存储后端
+        :param db_path: 进程任务在子进程中连接的SQLite数据库
+        """
+        self.job_id = job_id
+        self.store = store
+        self.db_path = db_path
+
+    def __getstate__(self):
+        return {"job_id": self.job_id, "store": None, "db_path": self.db_path}
+
+    def __call__(self, fraction, message=""):
+        if self.store is None:
+            self.store = SQLiteJobStore(self.db_path, init=False)
+        if not self.store.report_progress(self.job_id, round(float(fraction), 4), message):
+            raise JobCancelled()
+
+
+def _noop_progress(fraction, message=""):
+    return None
+
+
+def _run_task(target, reporter, params):
+    """在工作线程/子进程中执行任务函数"""
+    module_name, func_name = target.split(":")
+    func = getattr(importlib.import_module(module_name), func_name)
+    return func(reporter or _noop_progress, **params)
+
+
+class JobManager:
+    """
+    任务管理器
+    :param store: 任务存储后端
+    :param tasks: 任务类型注册表 {任务类型: ("模块:函数", "thread" | "process")}
+    """
+
+    def __init__(self, store, tasks, thread_workers=4, process_workers=2):
+        self.store = store
+        self.tasks = tasks
+        self.thread_pool = ThreadPoolExecutor(max_workers=thread_workers, thread_name_prefix="job")
+        # spawn 方式启动子进程，避免 fork 复制服务进程中的线程和GDAL状态
+        self.process_pool = ProcessPoolExecutor(max_workers=process_workers,
+                                                mp_context=multiprocessing.get_context("spawn"))
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind, params):
+        """
+        提交任务
+        :param kind: 任务类型
+        :param params: 任务参数dict
+        :return: 任务ID
+        """
+        if kind not in self.tasks:
+            raise KeyError(f"未知任务类型{kind}，可选：{list(self.tasks.keys())}")
+        target, pool_type = self.tasks[kind]
+        job_id = uuid.uuid4().hex
+        self.store.create(job_id, kind, params)
+        if pool_type == "process":
+            future = self.process_pool.submit(_run_task, target, self.store.process_reporter(job_id), params)
+        else:
+            future = self.thread_pool.submit(_run_task, target, self.store.reporter(job_id), params)
+        with self._lock:
+            self._futures[job_id] = future
+        future.add_done_callback(lambda f: self._on_done(job_id, f))
+        return job_id
+
+    def _on_done(self, job_id, future):
+        with self._lock:
+            self._futures.pop(job_id, None)
+        job = self.store.get(job_id)
+        if future.cancelled() or (job is not None and job["status"] in (CANCELLING, CANCELLED)):
+            self.store.update(job_id, status=CANCELLED)
+            return
+        error = future.exception()
+        if isinstance(error, JobCancelled):
+            self.store.update(job_id, status=CANCELLED)
+        elif error is not None:
+            message = "".join(traceback.format_exception(type(error), error, error.__traceback__))
+            self.store.update(job_id, status=FAILED, error=message)
+        else:
+            self.store.update(job_id, status=SUCCEEDED, progress=1.0, result=future.result())
+
+    def status(self, job_id):
+        """
+        :return: 任务状态，不包含结果
+        """
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        with self._lock:
+            future = self._futures.get(job_id)
+        if job["status"] == QUEUED and future is not None and future.running():
+            job["status"] = RUNNING
+        job.pop("result", None)
+        return job
+
+    def result(self, job_id):
+        return self.store.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        取消任务：排队中的任务直接取消，运行中的任务在下一次报告进度时中止
+        :return: 取消后的任务状态
+        """
+        job = self.store.get(job_id)
+        if job is None or job["status"] in FINISHED_STATUS:
+            return job
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None and future.cancel():
+            self.store.update(job_id, status=CANCELLED)
+        else:
+            self.store.update(job_id, status=CANCELLING)
+        return self.status(job_id)
+
+    def shutdown(self):
+        self.thread_pool.shutdown(wait=False, cancel_futures=True)
+        self.process_pool.shutdown(wait=False, cancel_futures=True)
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager(tasks=None):
+    """
+    获取全局任务管理器，第一次调用时按配置文件创建
+    :param tasks: 任务类型注册表，仅第一次调用时生效
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            config = load_config('jobs')
+            if config.get('store', 'sqlite') == 'sqlite':
+                # 多进程部署时由主进程在启动工作进程前建表并清理中断的任务，见 utils.server
+                store = SQLiteJobStore(config.get('db-path', 'jobs/jobs.db'), init=worker_count() <= 1)
+            else:
+                store = MemoryJobStore()
+            _manager = JobManager(store, tasks or {}, config.get('thread-workers', 4),
+                                  config.get('process-workers', 2))
+        return _manager
+
+
+def shutdown_job_manager():
+    """服务关闭时停止工作池"""
+    global _manager
+    with _manager_lock:
+        if _manager is not None:
+            _manager.shutdown()
+            _manager = None
@@ -0,0 +1,71 @@
+from fastapi import APIRouter
+from starlette.responses import FileResponse
+
+from utils.job_queue import SUCCEEDED, get_job_manager
+from utils.job_tasks import TASKS
+from utils.profiling import ProfiledRoute
+
+router_jobs = APIRouter(
+    prefix="/jobs",
+    tags=["后台任务"],
+    route_class=ProfiledRoute,
+)
+
+
+@router_jobs.post('/submit/{kind}')
+def submit_job(kind: str, params: dict):
+    """
+    提交后台任务，立即返回任务ID
+    \n:param kind: 任务类型，枚举["get_smi", "dynamic_smi", "mid_long_inflow_predict", "allocation", "allocation_scenarios"]
+    \n:param params: 任务参数，与对应接口的参数一致，如get_smi为{"red_tif_dir": "", "nir_tif_dir": ""}
+    \n:return: job_id
+    """
+    try:
+        job_id = get_job_manager(TASKS).submit(kind, params)
+    except KeyError as e:
+        return {"error": str(e)}
+    return {"job_id": job_id}
+
+
+@router_jobs.get('/{job_id}')
+def job_status(job_id: str):
+    """
+    查询任务状态与进度
+    \n:param job_id: 任务ID
+    \n:return: status: queued/running/succeeded/failed/cancelling/cancelled, progress: 0~1
+    """
+    job = get_job_manager(TASKS).status(job_id)
+    if job is None:
+        return {"error": "任务不存在"}
+    return job
+
+
+@router_jobs.get('/{job_id}/result')
+def job_result(job_id: str):
+    """
+    获取任务结果，结果为文件时直接下载
+    \n:param job_id: 任务ID
+    """
+    job = get_job_manager(TASKS).result(job_id)
+    if job is None:
+        return {"error": "任务不存在"}
+    if job["status"] != SUCCEEDED:
+        return {"error": f"任务未完成，当前状态：{job['status']}", "detail": job["error"]}
+    result = job["result"]
+    if isinstance(result, dict) and "file" in result:
+        filename = result["file"].split('/')[-1]
+        headers = {"Content-Disposition": f"attachment; filename={filename}"}
+        return FileResponse(result["file"], media_type=result["media_type"], headers=headers)
+    return result
+
+
+@router_jobs.delete('/{job_id}')
+def cancel_job(job_id: str):
+    """
+    取消任务，排队中的任务立即取消，运行中的任务在下一次报告进度时中止
+    \n:param job_id: 任务ID
+    """
+    job = get_job_manager(TASKS).cancel(job_id)
+    if job is None:
+        return {"error": "任务不存在"}
+    return job
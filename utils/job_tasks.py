@@ -0,0 +1,88 @@
+"""
+可提交到后台任务队列的任务函数
+
+每个任务函数的第一个参数为进度回调 progress(fraction, message)，其余参数与对应接口一致。
+返回值需可JSON序列化；结果为文件时返回 {"file": 文件路径, "media_type": 类型}。
+模型模块在函数内导入，子进程中只加载任务真正用到的依赖。
+"""
+
+from utils.config import load_config
+from utils.metrics import span
+from utils.shared_cache import reference_table
+
+
+def get_smi(progress, red_tif_dir, nir_tif_dir, soil_line_method=None, sample_step=None, compare_exact=False,
+            sieve_pixels=None, dissolve=None, simplify_tolerance=None, region=None):
+    """遥感影像土壤含水量反演并矢量化，同 /model5/get_smi"""
+    from model5.algorithm import get_smi_geojson
+
+    progress(0.0, "计算土壤含水量")
+    vector = {"sieve_pixels": sieve_pixels, "dissolve": dissolve, "simplify_tolerance": simplify_tolerance,
+              "region": region}
+    success, output_geojson_path, soil_line = get_smi_geojson(red_tif_dir, nir_tif_dir, soil_line_method,
+                                                              sample_step, compare_exact, vector)
+    if not success:
+        raise RuntimeError("生成geojson失败")
+    return {"file": output_geojson_path, "media_type": "application/geo+json", "soil_line": soil_line}
+
+
+def dynamic_smi(progress, file_list):
+    """多期影像土壤含水量，同 /model5/dynamic_smi"""
+    from model5.algorithm import get_dynamic_smi, zipDir
+
+    folder_path = get_dynamic_smi(file_list, progress)
+    progress(0.95, "压缩结果")
+    output_dir = folder_path + '.zip'
+    zipDir(folder_path, output_dir)
+    return {"file": output_dir, "media_type": "application/zip"}
+
+
+def mid_long_inflow_predict(progress, file_path):
+    """中长期来水预报，同 /model1/mid_long_inflow_predict，file_path为服务器上的csv路径"""
+    import pandas as pd
+    from model1.service import predict_mid_long_series
+
+    progress(0.0, "读取历史数据")
+    with span('csv_read'):
+        df = pd.read_csv(file_path)
+    progress(0.1, "拟合SARIMA模型")
+    return predict_mid_long_series(df)
+
+
+def _load_area_info():
+    return reference_table(load_config('model3')['area-info-file'])
+
+
+def allocation(progress, water_requirement_json, predict_inflow):
+    """各灌片旬、月、年配水量，同 /model3/get_allocation_for_each_area"""
+    from model3.implement import calculate_10days_allocation, calculate_monthly_allocation, \
+        calculate_yearly_allocation
+
+    progress(0.0, "计算逐旬配水量")
+    allocations_10days = calculate_10days_allocation(water_requirement_json, predict_inflow, _load_area_info())
+    progress(0.8, "汇总月、年配水量")
+    return {
+        "per_10days": allocations_10days,
+        "monthly": calculate_monthly_allocation(allocations_10days),
+        "yearly": calculate_yearly_allocation(allocations_10days),
+    }
+
+
+def allocation_scenarios(progress, water_requirement_json, predict_inflow, scenarios, supply=None,
+                         initial_storage=0.0, storage_capacity=None, percentiles=(10, 50, 90)):
+    """多情景配水对比，同 /model3/allocation_scenarios"""
+    from model3.scenario import run_scenarios
+
+    progress(0.0, "计算多情景配水量")
+    return run_scenarios(water_requirement_json, predict_inflow, _load_area_info(), scenarios, supply,
+                         initial_storage, storage_capacity, tuple(percentiles))
+
+
+# 任务类型注册表 {任务类型: ("模块:函数", 工作池类型)}
+TASKS = {
+    "get_smi": ("utils.job_tasks:get_smi", "process"),
+    "dynamic_smi": ("utils.job_tasks:dynamic_smi", "process"),
+    "mid_long_inflow_predict": ("utils.job_tasks:mid_long_inflow_predict", "process"),
+    "allocation": ("utils.job_tasks:allocation", "process"),
+    "allocation_scenarios": ("utils.job_tasks:allocation_scenarios", "thread"),
+}
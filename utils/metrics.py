@@ -0,0 +1,173 @@
+"""
+耗时统计
+
+模型代码中用 span 标记各阶段（配置读取、CSV读取、模型拟合、天气请求、逐日分配、
+线性规划建模/求解、栅格读取/计算/写出、矢量化），每个请求的总耗时由 utils.profiling.MetricsMiddleware 记录，
+全部计入进程内的直方图，由 /utils/metrics 以 Prometheus 文本格式输出。
+
+本模块只依赖标准库，进程池子进程导入模型模块时不会连带导入 fastapi。
+直方图保存在进程内，多进程部署时各进程分别统计。进程池中执行的函数经 call_collecting_spans 包装后，
+子进程中的阶段耗时随返回值带回主进程合并。
+"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+REQUEST_METRIC = 'http_request_duration_seconds'
+STAGE_METRIC = 'stage_duration_seconds'
+METRIC_HELP = {
+    REQUEST_METRIC: '接口请求耗时（秒）',
+    STAGE_METRIC: '模型各阶段耗时（秒）',
+}
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_request_spans = contextvars.ContextVar('request_spans', default=None)  # 当前请求的 [(阶段, 秒)]
+
+
+class Histogram:
+    """累计分桶直方图，与 Prometheus histogram 的语义一致"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一项为 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+_histograms = {}  # (指标名, ((标签名, 标签值), ...)) → Histogram
+_histograms_lock = threading.Lock()
+
+
+def observe(name, seconds, **labels):
+    """
+    记录一次耗时
+    :param name: 指标名
+    :param seconds: 耗时（秒）
+    :param labels: 标签
+    """
+    key = (name, tuple(sorted(labels.items())))
+    with _histograms_lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+
+def start_request():
+    """
+    开始统计一个请求的阶段耗时
+    :return: (本次请求的 [(阶段, 秒)]，用于 end_request 的令牌)
+    """
+    spans = []
+    return spans, _request_spans.set(spans)
+
+
+def end_request(token):
+    _request_spans.reset(token)
+
+
+def record_span(stage, seconds):
+    """记录一个阶段的耗时，在请求中调用时同时计入本次请求的分段统计"""
+    observe(STAGE_METRIC, seconds, stage=stage)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+
+@contextmanager
+def span(stage):
+    """
+    标记一个阶段，可用作 with 语句或装饰器
+        with span('csv_read'):
+            df = pd.read_csv(path)
+    :param stage: 阶段名，如 csv_read、model_fit、raster_compute
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - start)
+
+
+class SpanTotals:
+    """
+    循环中反复执行的阶段（如逐块读取、计算、写出），先累计耗时，循环结束后每个阶段只记录一次
+        totals = SpanTotals()
+        for window in windows:
+            with totals.span('raster_read'):
+                ...
+        totals.record()
+    """
+
+    def __init__(self):
+        self.seconds = {}
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + time.perf_counter() - start
+
+    def record(self):
+        for stage, seconds in self.seconds.items():
+            record_span(stage, seconds)
+        self.seconds = {}
+
+
+def call_collecting_spans(func, *args, **kwargs):
+    """
+    在子进程中执行函数并收集其中的阶段耗时
+    :return: (函数返回值, [(阶段, 秒)])，主进程用 merge_spans 合并
+    """
+    spans, token = start_request()
+    try:
+        return func(*args, **kwargs), spans
+    finally:
+        end_request(token)
+
+
+def merge_spans(spans):
+    """合并子进程带回的阶段耗时"""
+    for stage, seconds in spans:
+        record_span(stage, seconds)
+
+
+def render_prometheus():
+    """
+    :return: 全部直方图的 Prometheus 文本格式
+    """
+    with _histograms_lock:
+        items = sorted((key, list(h.counts), h.sum, h.count, h.buckets) for key, h in _histograms.items())
+    lines = []
+    current = None
+    for (name, labels), counts, total, count, buckets in items:
+        if name != current:
+            lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+            current = name
+        label_text = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+        prefix = label_text + "," if label_text else ""
+        suffix = "{" + label_text + "}" if label_text else ""
+        cumulative = 0
+        for bound, bucket_count in zip(buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float('inf') else repr(bound)
+            lines.append(f'{name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+        lines.append(f"{name}_sum{suffix} {total!r}")
+        lines.append(f"{name}_count{suffix} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
@@ -0,0 +1,140 @@
+"""
+请求耗时中间件与单次请求的性能分析
+
+    - MetricsMiddleware 记录每个请求的耗时（按方法、路由模板、状态码），并在响应头 Server-Timing 中给出本次请求的各阶段耗时；
+    - 请求带 ?profile=1 时（配置 metrics.profile 开启，默认关闭），返回本次请求的 cProfile 报告而不是接口结果。
+      同步接口在线程池中执行，路由需使用 ProfiledRoute，才能在执行接口函数的线程中开启分析器。
+      async 接口在事件循环中与其他请求交替执行，开启分析器会把其他请求也统计进来，只给出阶段耗时；
+      同一时间只允许一个请求做性能分析（Python 3.12 起同时只能有一个分析器），其他分析请求返回 409。
+"""
+import asyncio
+import contextvars
+import cProfile
+import functools
+import io
+import pstats
+import threading
+import time
+from urllib.parse import parse_qs
+
+from fastapi.routing import APIRoute
+
+from utils.config import load_config
+from utils.metrics import REQUEST_METRIC, end_request, observe, start_request
+
+_profiler = contextvars.ContextVar('profiler', default=None)  # 当前请求的 cProfile.Profile
+_profile_lock = threading.Lock()  # 正在做性能分析的请求持有
+
+
+def server_timing(spans, total=None):
+    """
+    :return: Server-Timing 响应头，同名阶段的耗时合并
+    """
+    merged = {}
+    for stage, seconds in spans:
+        merged[stage] = merged.get(stage, 0.0) + seconds
+    if total is not None:
+        merged['total'] = total
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in merged.items())
+
+
+def _profile_requested(scope):
+    values = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('profile')
+    if not values or values[-1] not in ('1', 'true'):
+        return False
+    return bool(load_config('metrics').get('profile', False))
+
+
+def _profile_report(profiler, spans, status, elapsed):
+    buffer = io.StringIO()
+    buffer.write(f"状态码 {status}，总耗时 {elapsed * 1000:.1f} ms\n\n阶段耗时：\n")
+    for stage, seconds in spans:
+        buffer.write(f"  {stage:<20} {seconds * 1000:10.1f} ms\n")
+    buffer.write("\n")
+    profiler.create_stats()
+    if not profiler.stats:
+        buffer.write("async 接口不做函数级分析，只给出阶段耗时\n")
+        return buffer.getvalue()
+    stats = pstats.Stats(profiler, stream=buffer)
+    stats.sort_stats('cumulative').print_stats(int(load_config('metrics').get('profile-top', 40)))
+    return buffer.getvalue()
+
+
+async def _send_text(send, status, body):
+    body = body.encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'text/plain; charset=utf-8'),
+                            (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class MetricsMiddleware:
+    """记录请求耗时与阶段耗时的ASGI中间件"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        profiler = None
+        if _profile_requested(scope):
+            if not _profile_lock.acquire(blocking=False):
+                await _send_text(send, 409, "已有请求正在进行性能分析，请稍后重试")
+                return
+            profiler = cProfile.Profile()
+        spans, spans_token = start_request()
+        profiler_token = _profiler.set(profiler)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                if profiler is not None:
+                    return  # 分析模式下丢弃接口结果，改为返回报告
+                headers = list(message.get('headers', []))
+                headers.append((b'server-timing', server_timing(spans, time.perf_counter() - start).encode()))
+                message = {**message, 'headers': headers}
+            elif profiler is not None:
+                return
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            elapsed = time.perf_counter() - start
+            route = scope.get('route')
+            observe(REQUEST_METRIC, elapsed, method=scope['method'],
+                    route=route.path if route is not None else 'unmatched', status=status)
+            end_request(spans_token)
+            _profiler.reset(profiler_token)
+            if profiler is not None:
+                _profile_lock.release()
+        if profiler is not None:
+            await _send_text(send, 200, _profile_report(profiler, spans, status, elapsed))
+
+
+class ProfiledRoute(APIRoute):
+    """
+    路由类：请求带 ?profile=1 时在执行同步接口函数的线程中开启 cProfile
+    同步接口在线程池中执行，只有在该线程中开启分析器才能统计到接口内部的调用；async 接口不开启
+    """
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, _profiled(endpoint), **kwargs)
+
+
+def _profiled(func):
+    if asyncio.iscoroutinefunction(func):
+        return func  # 跨 await 开启分析器会统计到事件循环中其他请求的协程
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler = _profiler.get()
+        if profiler is None:
+            return func(*args, **kwargs)
+        return profiler.runcall(func, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,80 @@
+"""
+大数据量接口的JSON响应
+
+接口直接返回 dict 时，FastAPI 先用 jsonable_encoder 逐个元素转换一遍再交给标准库 json 序列化，
+一年逐日序列这样的大量小 dict 大部分时间都花在这里。这些接口改为返回 json_response(...)：
+    - 跳过 jsonable_encoder，由 orjson 直接序列化，numpy 数组/数值、date/datetime 无需先转换为 Python 对象
+    - 未安装 orjson 时退回标准库 json，结果相同（NaN 除外，orjson 输出 null）
+逐日序列还可以按列返回（format=columns）：{"dates": [...], "值名称": [...]}，
+不必为每一天构造一个 dict，响应体也更小。
+"""
+import datetime as dt
+import json
+
+import numpy as np
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # 可选依赖，见 requirements.txt
+    orjson = None
+
+RESPONSE_FORMATS = ('records', 'columns')  # records: [{"date": ..., 值名称: ...}]（默认）；columns: 按列返回
+
+
+def _default(obj):
+    """标准库 json 无法序列化的类型"""
+    if isinstance(obj, np.ndarray):
+        if np.issubdtype(obj.dtype, np.datetime64):
+            return np.datetime_as_string(obj).tolist()
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, (dt.date, dt.datetime)):
+        return obj.isoformat()
+    raise TypeError(f"无法序列化为JSON：{type(obj).__name__}")
+
+
+class FastJSONResponse(JSONResponse):
+    """orjson 序列化的JSON响应，支持 numpy 数组/数值与 date/datetime"""
+
+    def render(self, content):
+        if orjson is not None:
+            return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+        return json.dumps(content, ensure_ascii=False, separators=(',', ':'), default=_default).encode('utf-8')
+
+
+def json_response(content, status_code=200):
+    """
+    直接返回响应对象，FastAPI 不再对返回值做 jsonable_encoder 转换
+    :param content: 可含 numpy 数组/数值、date/datetime 的 dict/list
+    """
+    return FastJSONResponse(content, status_code=status_code)
+
+
+def check_format(format):
+    """
+    :return: 错误信息dict，format 合法时为 None
+    """
+    if format not in RESPONSE_FORMATS:
+        return {"error": f"format可选：{list(RESPONSE_FORMATS)}"}
+    return None
+
+
+def date_strings(dates):
+    """
+    :param dates: datetime64 数组或 date/datetime 序列
+    :return: %Y-%m-%d 字符串列表
+    """
+    return np.datetime_as_string(np.asarray(dates, dtype='datetime64[D]'), unit='D').tolist()
+
+
+def records_to_columns(records, value_names, date_key='date'):
+    """
+    [{"date": ..., 值名称: ...}] 转为按列的 {"dates": [...], 值名称: [...]}
+    :param value_names: 值名称列表
+    """
+    columns = {"dates": [r[date_key] for r in records]}
+    for name in value_names:
+        columns[name] = [r[name] for r in records]
+    return columns
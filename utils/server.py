@@ -0,0 +1,54 @@
+"""
+服务启动
+
+python main.py 按配置 server 节启动：
+    - workers: 1  单进程运行（默认）
+    - workers > 1 由 uvicorn 启动多个工作进程共同监听同一端口，一个请求的SARIMA拟合或栅格计算不再阻塞其他请求。
+      各工作进程通过共享缓存（见 utils.shared_cache）、任务数据库（配置 jobs.store: sqlite）和磁盘结果缓存共享数据。
+多进程模式下主进程先初始化共享数据库、清理上次中断的任务，再启动工作进程；
+工作进程不再各自清理，以免后启动（或被重启）的进程把其他进程正在执行的任务标记为中断。
+使用其他方式启动多个工作进程（如 gunicorn）时，需自行设置环境变量 WATER_SERVICE_WORKERS 为工作进程数。
+"""
+import os
+
+from utils.config import load_config
+
+WORKERS_ENV = 'WATER_SERVICE_WORKERS'
+
+
+def worker_count():
+    """
+    :return: 工作进程数，单进程运行时为 1
+    """
+    return int(os.environ.get(WORKERS_ENV, 1))
+
+
+def prepare_shared_state():
+    """多进程模式下在主进程中执行：建立共享数据库，清理过期缓存和上次中断的任务"""
+    from utils.job_queue import SQLiteJobStore
+    from utils.shared_cache import get_shared_cache
+
+    get_shared_cache().purge_expired()
+    jobs = load_config('jobs')
+    if jobs.get('store', 'sqlite') == 'sqlite':
+        SQLiteJobStore(jobs.get('db-path', 'jobs/jobs.db'))
+
+
+def run(app, app_path='main:app'):
+    """
+    按配置启动服务
+    :param app: 单进程运行时直接使用的应用对象
+    :param app_path: 多进程运行时各工作进程导入应用的路径
+    """
+    import uvicorn
+
+    config = load_config('server')
+    host = config.get('host', '0.0.0.0')
+    port = int(config.get('port', 8081))
+    workers = int(config.get('workers', 1))
+    if workers <= 1:
+        uvicorn.run(app, host=host, port=port)
+        return
+    os.environ[WORKERS_ENV] = str(workers)  # 工作进程继承环境变量
+    prepare_shared_state()
+    uvicorn.run(app_path, host=host, port=port, workers=workers)
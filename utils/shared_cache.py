@@ -0,0 +1,276 @@
+"""
+跨进程共享缓存
+
+多进程部署（配置 server.workers > 1）时各工作进程的内存互不共享，
+天气预报、模型拟合结果等存放在本地SQLite数据库中，所有工作进程读写同一份，服务重启后仍然有效：
+    - 条目按 (命名空间, 键) 存放，值用 pickle 序列化，可设置有效期（配置 shared-cache.ttl）
+    - 同一进程内同一个键同时只计算一次，其他线程等待结果；不同进程之间可能重复计算，结果相同，后写入的覆盖先写入的
+    - 读取-修改-写回需要在进程之间互斥时（如滚动配水计划的 observe），使用 lock() 取得跨进程锁
+参考数据表（JSON/CSV文件）以文件本身为共享数据源，各进程按文件修改时间缓存解析结果，见 reference_table。
+遥感反演结果由按内容寻址的磁盘缓存保存（见 model5.result_cache），同样跨进程共享。
+"""
+import contextlib
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+
+from utils.config import load_config
+
+DEFAULT_DB_PATH = 'cache/shared_cache.db'
+PURGE_INTERVAL = 600  # 清理过期条目的最短间隔（秒）
+LOCK_POLL_INTERVAL = 0.05  # 等待跨进程锁时的轮询间隔（秒）
+
+
+def make_key(*parts):
+    """
+    由若干部分生成缓存键，无法JSON序列化的部分（如 numpy 数值、日期）按字符串处理
+    :return: 十六进制sha256
+    """
+    text = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def file_signature(file_path):
+    """
+    文件的路径、大小和修改时间，文件被修改后得到不同的缓存键
+    :return: (绝对路径, 大小, 修改时间ns)
+    """
+    stat = os.stat(file_path)
+    return os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns
+
+
+class SharedCache:
+    """本地SQLite键值缓存，可跨进程访问"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._last_purge = 0.0
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")  # 读写互不阻塞
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    namespace TEXT,
+                    key TEXT,
+                    value BLOB,
+                    created_at REAL,
+                    expires_at REAL,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS locks (
+                    namespace TEXT,
+                    key TEXT,
+                    owner TEXT,
+                    expires_at REAL,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def get(self, namespace, key, default=None):
+        """
+        :return: 缓存值，不存在或已过期时返回 default
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT value, expires_at FROM entries WHERE namespace = ? AND key = ?",
+                               (namespace, key)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return default
+        return pickle.loads(row[0])
+
+    def set(self, namespace, key, value, ttl=None):
+        """
+        :param ttl: 有效期（秒），None 表示不过期
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                         (namespace, key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), now,
+                          None if ttl is None else now + ttl))
+        if now - self._last_purge > PURGE_INTERVAL:
+            self.purge_expired()
+
+    def delete(self, namespace, key):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def _key_lock(self, namespace, key):
+        with self._locks_lock:
+            return self._locks.setdefault((namespace, key), threading.Lock())
+
+    def get_or_compute(self, namespace, key, compute, ttl=None):
+        """
+        读取缓存，未命中时调用 compute() 计算并写入；compute 抛出异常时不写入
+        :return: 缓存值或计算结果
+        """
+        missing = object()
+        value = self.get(namespace, key, missing)
+        if value is not missing:
+            return value
+        lock = self._key_lock(namespace, key)
+        with lock:
+            value = self.get(namespace, key, missing)  # 等待期间其他线程可能已写入
+            if value is missing:
+                value = compute()
+                self.set(namespace, key, value, ttl)
+        with self._locks_lock:
+            if self._locks.get((namespace, key)) is lock and not lock.locked():
+                del self._locks[(namespace, key)]
+        return value
+
+    @contextlib.contextmanager
+    def lock(self, namespace, key, timeout=60, lease=600):
+        """
+        跨进程互斥锁，同一 (命名空间, 键) 同一时间只有一个持有者（包括同一进程的其他线程）
+        锁记录在数据库中，持有者所在进程异常退出时锁在 lease 秒后失效
+        :param timeout: 等待锁的最长时间（秒）
+        :param lease: 锁的有效期（秒），需大于持有锁的最长时间
+        :raise TimeoutError: timeout 秒内未取得锁
+        """
+        owner = uuid.uuid4().hex
+        deadline = time.time() + timeout
+        while True:
+            now = time.time()
+            with self._connect() as conn:
+                conn.execute("DELETE FROM locks WHERE namespace = ? AND key = ? AND expires_at < ?",
+                             (namespace, key, now))
+                acquired = conn.execute("INSERT OR IGNORE INTO locks VALUES (?, ?, ?, ?)",
+                                        (namespace, key, owner, now + lease)).rowcount == 1
+            if acquired:
+                break
+            if now > deadline:
+                raise TimeoutError(f"等待{namespace}/{key}的锁超时")
+            time.sleep(LOCK_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM locks WHERE namespace = ? AND key = ? AND owner = ?", (namespace, key, owner))
+
+    def purge_expired(self):
+        """
+        删除已过期的条目
+        :return: 删除的条目数
+        """
+        self._last_purge = time.time()
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at < ?",
+                                (self._last_purge,)).rowcount
+
+    def clear(self, namespace=None):
+        """清空缓存，指定 namespace 时只清空该命名空间"""
+        with self._connect() as conn:
+            if namespace is None:
+                conn.execute("DELETE FROM entries")
+            else:
+                conn.execute("DELETE FROM entries WHERE namespace = ?", (namespace,))
+
+    def stats(self):
+        """
+        :return: {命名空间: 条目数}
+        """
+        with self._connect() as conn:
+            rows = conn.execute("SELECT namespace, COUNT(*) FROM entries GROUP BY namespace").fetchall()
+        return dict(rows)
+
+
+class _NoCache:
+    """关闭共享缓存（配置 shared-cache.enabled: false）时使用，每次都重新计算"""
+
+    def get(self, namespace, key, default=None):
+        return default
+
+    def set(self, namespace, key, value, ttl=None):
+        return None
+
+    def delete(self, namespace, key):
+        return None
+
+    def get_or_compute(self, namespace, key, compute, ttl=None):
+        return compute()
+
+    def lock(self, namespace, key, timeout=60, lease=600):
+        return contextlib.nullcontext()  # 不共享数据时无需跨进程互斥
+
+    def purge_expired(self):
+        return 0
+
+    def clear(self, namespace=None):
+        return None
+
+    def stats(self):
+        return {}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_shared_cache():
+    """
+    获取全局共享缓存，按配置文件 shared-cache 节创建
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            config = load_config('shared-cache')
+            if config.get('enabled', True):
+                _cache = SharedCache(config.get('db-path', DEFAULT_DB_PATH))
+            else:
+                _cache = _NoCache()
+        return _cache
+
+
+def get_ttl(namespace):
+    """
+    :return: 命名空间的有效期（秒），配置 shared-cache.ttl 中未设置时为 None（不过期）
+    """
+    ttl = (load_config('shared-cache').get('ttl') or {}).get(namespace)
+    return None if ttl is None else float(ttl)
+
+
+def cached(namespace, key_parts, compute):
+    """
+    按命名空间的配置有效期缓存 compute() 的结果
+    :param key_parts: 组成缓存键的各部分，见 make_key
+    """
+    return get_shared_cache().get_or_compute(namespace, make_key(*key_parts), compute, get_ttl(namespace))
+
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def reference_table(file_path, loader=None):
+    """
+    读取参考数据表，文件未修改时直接返回上次解析的结果（只读，请勿修改）
+    :param file_path: 文件路径
+    :param loader: 解析函数 loader(file_path)，默认按JSON读取
+    :return: 解析结果
+    """
+    signature = file_signature(file_path)
+    with _tables_lock:
+        memo = _tables.get(signature[0])
+    if memo is not None and memo[0] == signature:
+        return memo[1]
+    if loader is None:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            table = json.load(f)
+    else:
+        table = loader(file_path)
+    with _tables_lock:
+        _tables[signature[0]] = (signature, table)
+    return table
@@ -0,0 +1,114 @@
+"""
+上传文件的流式保存
+
+上传的文件按固定大小分块写入磁盘，同时计算sha256并检查大小上限：
+    - 先写入同目录下的临时文件，完成后再原子重命名，不会留下写了一半的文件
+    - 以内容哈希去重，同一份文件（如同一景无人机影像）重复上传时直接返回已有路径
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from utils.config import load_config
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+HASH_INDEX_FILE = '.upload_hash_index.json'
+
+_index_lock = threading.Lock()
+
+# mkstemp 创建的临时文件权限为 0600，重命名前改为普通文件的权限（0666 去掉 umask），与直接 open 写入的文件一致
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+FILE_MODE = 0o666 & ~_UMASK
+
+
+class UploadTooLarge(Exception):
+    """上传文件超过大小上限"""
+
+
+def file_sha256(file_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    分块计算文件的sha256
+    :param file_path: 文件路径
+    :return: 十六进制哈希值
+    """
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _load_index(save_dir):
+    index_path = os.path.join(save_dir, HASH_INDEX_FILE)
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _save_index(save_dir, index):
+    index_path = os.path.join(save_dir, HASH_INDEX_FILE)
+    fd, tmp_path = tempfile.mkstemp(dir=save_dir, prefix='.index-')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=4)
+    os.chmod(tmp_path, FILE_MODE)
+    os.replace(tmp_path, index_path)
+
+
+def _copy_chunks(source, target, chunk_size, max_size):
+    """分块复制并计算哈希，超过上限时抛出 UploadTooLarge"""
+    sha = hashlib.sha256()
+    size = 0
+    for chunk in iter(lambda: source.read(chunk_size), b''):
+        size += len(chunk)
+        if max_size is not None and size > max_size:
+            raise UploadTooLarge(f"文件超过大小上限{max_size}字节")
+        sha.update(chunk)
+        target.write(chunk)
+    return sha.hexdigest(), size
+
+
+def save_upload_file(upload_file, full_path, chunk_size=None, max_size=None, deduplicate=True):
+    """
+    将上传的文件流式写入磁盘，不把整个文件读入内存
+    同步函数，需在线程中调用
+    :param upload_file: fastapi UploadFile
+    :param full_path: 保存路径
+    :param chunk_size: 分块大小（字节），默认取配置 upload.chunk-size
+    :param max_size: 大小上限（字节），默认取配置 upload.max-size，None 表示不限
+    :param deduplicate: 是否按内容哈希去重
+    :return: {"file_path": 实际保存路径, "sha256": 哈希, "size": 字节数, "duplicate": 是否为重复上传}
+    """
+    config = load_config('upload')
+    chunk_size = chunk_size or config.get('chunk-size', DEFAULT_CHUNK_SIZE)
+    max_size = max_size if max_size is not None else config.get('max-size')
+
+    save_dir = os.path.dirname(full_path) or '.'
+    if not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+    upload_file.file.seek(0)
+    fd, tmp_path = tempfile.mkstemp(dir=save_dir, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            sha256, size = _copy_chunks(upload_file.file, f, chunk_size, max_size)
+        with _index_lock:
+            index = _load_index(save_dir) if deduplicate else {}
+            existing = index.get(sha256)
+            if existing is not None and os.path.exists(existing):
+                os.remove(tmp_path)
+                return {"file_path": existing, "sha256": sha256, "size": size, "duplicate": True}
+            os.chmod(tmp_path, FILE_MODE)
+            os.replace(tmp_path, full_path)  # 原子重命名
+            if deduplicate:
+                # 同名文件被覆盖后，旧内容的哈希记录失效
+                index = {k: v for k, v in index.items() if v != full_path}
+                index[sha256] = full_path
+                _save_index(save_dir, index)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return {"file_path": full_path, "sha256": sha256, "size": size, "duplicate": False}
@@ -0,0 +1,103 @@
+"""
+服务启动后的后台预热
+
+各模型接口的依赖在首次调用时才导入（见各 service.py），服务启动后可以立即接受请求。
+开启预热（配置 startup.warm-up）后，启动完成时在后台线程中依次导入这些模块，
+并让栅格计算进程池的子进程预先导入遥感模块，首个请求不必再等待导入。
+"""
+import importlib
+import threading
+import time
+
+from utils.config import load_config
+
+WARM_UP_MODULES = (  # 按常用程度排列
+    'model5.algorithm',
+    'model5.tiles',
+    'model5.heatmap',
+    'model5.forecast',
+    'model1.inflow_ARIMA',
+    'model1.inflow_SARIMA',
+    'model1.inflow_SARIMAX',
+    'model1.sarima_predict',
+    'model2.main',
+    'model3.implement',
+    'model3.scenario',
+)
+PROCESS_WARM_UP_MODULES = ('model5.algorithm',)  # 栅格计算进程池中执行的任务所需模块
+
+_status = {"state": "idle", "modules": {}, "errors": {}}
+_status_lock = threading.Lock()
+
+
+def import_modules(modules):
+    """
+    依次导入模块
+    :return: ({模块名: 耗时秒}, {模块名: 错误信息})
+    """
+    seconds, errors = {}, {}
+    for name in modules:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except Exception as e:  # 缺少可选依赖时不影响其他模块
+            errors[name] = repr(e)
+        seconds[name] = round(time.perf_counter() - start, 3)
+    return seconds, errors
+
+
+def warm_up(modules=WARM_UP_MODULES, process_pool=True):
+    """
+    预热：导入模块，可选让进程池的每个子进程导入遥感模块
+    :param modules: 在当前进程中导入的模块
+    :param process_pool: 是否同时预热栅格计算进程池
+    """
+    with _status_lock:
+        _status["state"] = "running"
+    seconds, errors = {}, {}
+    try:
+        futures = []
+        if process_pool:
+            from utils.concurrency import get_limit, get_process_pool
+
+            try:
+                pool = get_process_pool()
+                futures = [pool.submit(import_modules, PROCESS_WARM_UP_MODULES) for _ in range(get_limit('raster'))]
+            except Exception as e:  # 进程池已关闭、无法创建子进程等，不影响当前进程中的预热
+                errors['process_pool'] = repr(e)
+        module_seconds, module_errors = import_modules(modules)
+        seconds.update(module_seconds)
+        errors.update(module_errors)
+        for future in futures:
+            try:
+                errors.update(future.result()[1])
+            except Exception as e:  # 进程池已关闭等
+                errors['process_pool'] = repr(e)
+    finally:
+        # 无论预热中途出现什么异常，状态都不会停留在 running
+        with _status_lock:
+            _status.update(state="done", modules=seconds, errors=errors)
+
+
+def start_warm_up():
+    """
+    按配置在后台线程中预热，未开启时不做任何事
+    :return: 预热线程，未开启时为 None
+    """
+    config = load_config('startup')
+    if not config.get('warm-up', False):
+        return None
+    with _status_lock:
+        _status["state"] = "running"  # 线程启动前置为 running，调用方随即查询状态时不会看到 idle
+    thread = threading.Thread(target=warm_up, kwargs={"process_pool": bool(config.get('warm-up-process-pool', True))},
+                              name='warm-up', daemon=True)
+    thread.start()
+    return thread
+
+
+def get_warm_up_status():
+    """
+    :return: {"state": idle / running / done, "modules": {模块名: 导入耗时秒}, "errors": {模块名: 错误信息}}
+    """
+    with _status_lock:
+        return {"state": _status["state"], "modules": dict(_status["modules"]), "errors": dict(_status["errors"])}